@@ -1,52 +1,182 @@
+from argparse import ArgumentParser
+from functools import partial
+from math import ceil
+from threading import Event
 from time import sleep
 from pyVmomi import vim
-from json import dumps as json_dumps
 import logging
 import socket
 
 from data_retriever.cache import Cache, CacheException
-from data_retriever.cache_element import serialize_server, serialize_vm
-from data_retriever.dto import vm_metrics_info, server_metrics_info
+from data_retriever.cache_element import VCenterElement
+from data_retriever.dto import VM_METRICS_PROPERTIES, SERVER_METRICS_PROPERTIES
+from data_retriever.metrics_collector import MetricsCollector
+from data_retriever.metrics_history import MetricsHistory
+from data_retriever.scheduler import Scheduler
 from data_retriever.vm_ware_connection import VMwareConnection
 
 
-RELOAD_DELAY = 60
+RELOAD_DELAY = 60       # Interval of the history samples and of the check of the vCenter stored in the cache
+PERFORMANCE_DELAY = 60  # Interval of the collection of the performance counters
+
+# Metric class: (collection interval in seconds, VM properties, server properties)
+# The properties of all classes together are `VM_METRICS_PROPERTIES` and `SERVER_METRICS_PROPERTIES`
+METRIC_CLASSES = {
+    "state": (
+        10,
+        ["runtime.powerState", "runtime.connectionState", "guest.guestState", "guestHeartbeatStatus", "overallStatus",
+         "runtime.bootTime", "runtime.vmFailoverInProgress"],
+        ["runtime.powerState", "overallStatus", "summary.rebootRequired", "runtime.bootTime"],
+    ),
+    "usage": (
+        60,
+        ["summary.quickStats", "runtime.maxCpuUsage", "runtime.maxMemoryUsage"],
+        ["summary.quickStats", "hardware.cpuInfo.hz", "hardware.cpuInfo.numCpuCores"],
+    ),
+    "storage": (
+        600,
+        ["summary.storage"],
+        [],
+    ),
+}
+
+
+def collect_class(conn: VMwareConnection, collector: MetricsCollector, vm_properties: list[str], server_properties: list[str],
+                  complete: bool, tick: float):
+    """
+    Retrieve a class of metrics of every VM and server of the vCenter, and push the metrics that changed to the cache
+    Args:
+        conn (VMwareConnection): The connection to the vCenter
+        collector (MetricsCollector): The collector keeping the metrics
+        vm_properties (list[str]): The VM properties of the class
+        server_properties (list[str]): The server properties of the class
+        complete (bool): Whether the elements missing from the retrieval have to be removed
+        tick (float): The scheduled time of the collection
+    Raises:
+        CacheException: If metrics could not be pushed
+    """
+    if vm_properties:
+        collector.update_records(vim.VirtualMachine, conn.get_all_vms_properties(vm_properties), vm_properties, complete)
+    if server_properties:
+        collector.update_records(vim.HostSystem, conn.get_all_hosts_properties(server_properties), server_properties, complete)
+    collector.push()
+
+
+def collect_performance(collector: MetricsCollector, tick: float):
+    """
+    Retrieve the performance counters of every powered on VM and server, and push the metrics that changed to the cache
+    Args:
+        collector (MetricsCollector): The collector keeping the metrics
+        tick (float): The scheduled time of the collection
+    Raises:
+        CacheException: If metrics could not be pushed
+    """
+    collector.refresh_performance()
+    collector.push()
+
+
+def poll_metrics(conn: VMwareConnection, cache: Cache, collector: MetricsCollector, vcenter: VCenterElement):
+    """
+    Retrieve each class of metrics of every VM and server of the vCenter at its own fixed interval (see `METRIC_CLASSES`)
+    and push the metrics that changed to the cache, until the vCenter stored in the cache changes.
+    The metrics of every element are pushed to their history every `RELOAD_DELAY` seconds
+    Args:
+        conn (VMwareConnection): The connection to the vCenter
+        cache (Cache): The cache where metrics are pushed
+        collector (MetricsCollector): The collector keeping the metrics
+        vcenter (VCenterElement): The vCenter the connection is established with
+    Raises:
+        CacheException: If metrics could not be pushed
+    """
+    vcenter_changed = Event()
+    scheduler = Scheduler()
+    for name, (interval, vm_properties, server_properties) in METRIC_CLASSES.items():
+        # Every element has a state: the state retrieval is the one that detects deleted elements
+        scheduler.add_job(name, interval, partial(collect_class, conn, collector, vm_properties, server_properties, name == "state"))
+    scheduler.add_job("performance", PERFORMANCE_DELAY, partial(collect_performance, collector))
+    scheduler.add_job("history", RELOAD_DELAY, collector.push_history)
+    scheduler.add_job("vcenter", RELOAD_DELAY, partial(check_vcenter, cache, vcenter, vcenter_changed))
+    scheduler.run(vcenter_changed.is_set)
+
+
+def follow_metrics(conn: VMwareConnection, cache: Cache, collector: MetricsCollector, vcenter: VCenterElement):
+    """
+    Push the metrics of every VM and server of the vCenter to the cache as soon as they change, until the vCenter
+    stored in the cache changes. Only the metrics of the elements whose properties changed are pushed.
+    The performance counters are refreshed every `PERFORMANCE_DELAY` seconds, and the metrics of every element are pushed
+    to their history every `RELOAD_DELAY` seconds
+    Args:
+        conn (VMwareConnection): The connection to the vCenter
+        cache (Cache): The cache where metrics are pushed
+        collector (MetricsCollector): The collector keeping the metrics
+        vcenter (VCenterElement): The vCenter the connection is established with
+    Raises:
+        CacheException: If metrics could not be pushed
+    """
+    vcenter_changed = Event()
+    scheduler = Scheduler()
+    scheduler.add_job("performance", PERFORMANCE_DELAY, partial(collect_performance, collector))
+    scheduler.add_job("history", RELOAD_DELAY, collector.push_history)
+    scheduler.add_job("vcenter", RELOAD_DELAY, partial(check_vcenter, cache, vcenter, vcenter_changed))
+    watcher = conn.create_property_watcher()
+    try:
+        watcher.watch_container(vim.VirtualMachine, VM_METRICS_PROPERTIES)
+        watcher.watch_container(vim.HostSystem, SERVER_METRICS_PROPERTIES)
+        while not vcenter_changed.is_set():
+            collector.apply_updates(watcher.wait_for_updates(ceil(scheduler.delay())))
+            collector.push()
+            scheduler.run_pending()
+    finally:
+        watcher.destroy()
+
+
+def check_vcenter(cache: Cache, vcenter: VCenterElement, vcenter_changed: Event, tick: float):
+    """
+    Check whether the vCenter stored in the cache changed
+    Args:
+        cache (Cache): The cache where the vCenter is stored
+        vcenter (VCenterElement): The vCenter the connection is established with
+        vcenter_changed (Event): Set if the vCenter changed
+        tick (float): The scheduled time of the check
+    Raises:
+        CacheException: If the vCenter could not be retrieved
+    """
+    new_vcenter = cache.get_vcenter()
+    if not new_vcenter or vcenter != new_vcenter:
+        vcenter_changed.set()
+
 
 if __name__ == "__main__":
+    parser = ArgumentParser(description="Mettre en cache les métriques des VM et des serveurs du vCenter")
+    parser.add_argument("--incremental", action="store_true", help="Pousser les métriques dès qu'elles changent au lieu de les relire à intervalles fixes")
+
+    args = parser.parse_args()
+
     logging.basicConfig(
         filename='cache_metrics.log',
-        level=logging.ERROR,
+        level=logging.WARNING,
         format='%(asctime)s %(message)s',
         datefmt='%d-%m-%Y %H:%M:%S'
     )
 
     conn = VMwareConnection()
-    metrics = None
+    history = MetricsHistory()
 
     while True:
         try:
             cache = Cache()
+            cache.migrate_metrics_layout()
             vcenter = cache.get_vcenter()
             while not vcenter:
                 sleep(RELOAD_DELAY)
                 vcenter = cache.get_vcenter()
             conn.connect(vcenter.ip, vcenter.user, vcenter.password, vcenter.port)
-            while True:
-                vms = conn.get_all_vms()
-                for vm in vms:
-                    metrics = vm_metrics_info(vm)
-                    cache.set_metrics(serialize_vm(vm), json_dumps(metrics))
-
-                servers = conn.get_all_hosts()
-                for server in servers:
-                    metrics = server_metrics_info(server)
-                    cache.set_metrics(serialize_server(server), json_dumps(metrics))
-
-                sleep(RELOAD_DELAY)
-                new_vcenter = cache.get_vcenter()
-                if not new_vcenter or vcenter != new_vcenter:
-                    conn.disconnect()
-                    break
+            collector = MetricsCollector(cache, history, conn.create_perf_collector())
+            if args.incremental:
+                follow_metrics(conn, cache, collector, vcenter)
+            else:
+                poll_metrics(conn, cache, collector, vcenter)
+            conn.disconnect()
 
         except CacheException as e:
             sleep(RELOAD_DELAY)
@@ -1,6 +1,6 @@
 #!/bin/bash
 
-# Usage: ./cache_metrics.sh
+# Usage: ./cache_metrics.sh [--incremental]
 
 if [ ! -f .venv/bin/activate ]; then
     echo "ERROR: Virtual environment not found at .venv/bin/activate"
@@ -15,4 +15,4 @@ if [[ "$VIRTUAL_ENV" != "$(pwd)/.venv"* ]]; then
     exit 1
 fi
 
-python cache_metrics.py &
+python cache_metrics.py "$@" &
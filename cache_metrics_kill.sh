@@ -2,7 +2,7 @@
 
 # Usage: ./cache_metrics_kill.sh
 
-PID=$(pgrep -f "python.*cache_metrics\.py$")
+PID=$(pgrep -f "python.*cache_metrics\.py( |$)")
 if [ -n "$PID" ]; then
     echo "Killing cache_metrics.py (PID $PID)..."
     kill "$PID"
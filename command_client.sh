@@ -0,0 +1,34 @@
+#!/bin/bash
+
+# Usage: ./command_client.sh <COMMAND> [--<PARAMETER> <VALUE> [<VALUE> ...] ...]
+# Send a command to the command server at $UPS_MANAGER_URL (http://127.0.0.1:8765 by default)
+# Several values of a parameter are sent separated by commas
+# Exits with code 7 if the command server is unreachable
+
+if [[ -z "$1" ]]; then
+    echo "ERROR : Missing command"
+    echo "Usage: $0 <COMMAND> [--<PARAMETER> <VALUE> ...]"
+    exit 1
+fi
+COMMAND="$1"
+shift
+URL="${UPS_MANAGER_URL:-http://127.0.0.1:8765}"
+
+DATA=()
+while [[ "$#" -gt 0 ]]; do
+    case $1 in
+        --*)
+            NAME="${1#--}"
+            VALUE="$2"
+            shift
+            while [[ "$#" -gt 1 && "$2" != --* ]]; do
+                VALUE="$VALUE,$2"
+                shift
+            done
+            DATA+=(--data-urlencode "$NAME=$VALUE") ;;
+        *) echo "Unknown parameter: $1" ; exit 1 ;;
+    esac
+    shift
+done
+
+curl -s -X POST "${URL}/${COMMAND}" "${DATA[@]}"
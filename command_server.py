@@ -0,0 +1,151 @@
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from json import dumps as json_dumps, loads as json_loads
+from urllib.parse import parse_qsl
+import logging
+
+from data_retriever.batch import BATCH_CONCURRENCY
+from data_retriever.dto import result_message
+from list_server import list_server
+from list_vm import list_vm
+from server_info import server_data
+from server_metrics import server_metrics
+from server_start import server_start
+from server_stop import server_stop
+from vm_metrics import vm_metrics
+from vm_migration import complete_vm_migration
+from vm_start import complete_vm_start
+from vm_stop import complete_vm_stop
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+def moid_list(value) -> str | list[str]:
+    """
+    Parse the moids of a VM command, given as a JSON list or separated by commas
+    Args:
+        value (str | list): The value of the parameter
+    Returns:
+        str | list[str]: The moid if a single one is given as a string, or else the list of moids, to run the command as
+            a batch. A JSON list is always run as a batch, even with a single moid, so that its result has the same shape
+    Raises:
+        ValueError: If there is no moid
+    """
+    moids = [str(moid).strip() for moid in value] if isinstance(value, list) else [moid.strip() for moid in str(value).split(",")]
+    moids = [moid for moid in moids if moid]
+    if not moids:
+        raise ValueError("No moid")
+    return moids if isinstance(value, list) or len(moids) > 1 else moids[0]
+
+
+VCENTER_PARAMETERS = {"ip": str, "user": str, "password": str, "port": int}
+ILO_PARAMETERS = {"ip": str, "user": str, "password": str}
+BATCH_PARAMETERS = {"max_concurrency": int}
+DEFAULT_VALUES = {"port": 443, "max_concurrency": BATCH_CONCURRENCY}
+
+# Command name: (function to call, parameters of the function with their type)
+COMMANDS = {
+    "list_vm": (list_vm, VCENTER_PARAMETERS),
+    "list_server": (list_server, VCENTER_PARAMETERS),
+    "server_info": (server_data, {"moid": str, **VCENTER_PARAMETERS}),
+    "server_metrics": (server_metrics, {"moid": str, **VCENTER_PARAMETERS}),
+    "vm_metrics": (vm_metrics, {"moid": str, **VCENTER_PARAMETERS}),
+    "vm_start": (complete_vm_start, {"moid": moid_list, **VCENTER_PARAMETERS, **BATCH_PARAMETERS}),
+    "vm_stop": (complete_vm_stop, {"moid": moid_list, **VCENTER_PARAMETERS, **BATCH_PARAMETERS}),
+    "vm_migration": (complete_vm_migration, {"vm_moid": moid_list, "dist_moid": str, **VCENTER_PARAMETERS, **BATCH_PARAMETERS}),
+    "server_start": (server_start, ILO_PARAMETERS),
+    "server_stop": (server_stop, ILO_PARAMETERS),
+}
+
+
+def run_command(name: str, parameters: dict) -> tuple[int, dict]:
+    """
+    Run a command with the same result as its command line utility
+    Args:
+        name (str): The name of the command (see `COMMANDS`)
+        parameters (dict): The parameters of the command, by name
+    Returns:
+        tuple[int, dict]: The HTTP status of the request, and the dictionary formatted for json dump returned by the command,
+            or an error message (result_message()) if the request is invalid
+    """
+    if name not in COMMANDS:
+        return 404, result_message(f"Unknown command: {name}", 404)
+    function, expected = COMMANDS[name]
+
+    kwargs = {}
+    for parameter, parameter_type in expected.items():
+        if parameter in parameters:
+            value = parameters[parameter]
+        elif parameter in DEFAULT_VALUES:
+            value = DEFAULT_VALUES[parameter]
+        else:
+            return 400, result_message(f"Missing parameter: {parameter}", 400)
+        try:
+            kwargs[parameter] = parameter_type(value)
+        except (TypeError, ValueError):
+            return 400, result_message(f"Invalid value for parameter {parameter}: {value}", 400)
+    return 200, function(**kwargs)
+
+
+class CommandHandler(BaseHTTPRequestHandler):
+    """ Serve `POST /<command>` requests with a JSON or form encoded body containing the command parameters """
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length).decode("utf-8") if length else ""
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                parameters = json_loads(body) if body else {}
+            else:
+                parameters = dict(parse_qsl(body))
+            if not isinstance(parameters, dict):
+                raise ValueError("Parameters must be a JSON object")
+        except ValueError as e:
+            self._send(400, result_message(f"Invalid request body: {e}", 400))
+            return
+
+        try:
+            status, payload = run_command(self.path.strip("/"), parameters)
+        except Exception as e:
+            logging.error(e)
+            status, payload = 500, result_message(str(e), 500)
+        self._send(status, payload)
+
+    def _send(self, status: int, payload: dict):
+        """
+        Send a JSON response, formatted like the output of the command line utilities
+        Args:
+            status (int): The HTTP status of the response
+            payload (dict): The dictionary to send
+        """
+        data = (json_dumps(payload, indent=2) + "\n").encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.info(format, *args)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Serveur local exécutant les commandes sans relancer d'interpréteur Python")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Adresse d'écoute (optionnel, {DEFAULT_HOST} par défaut)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port d'écoute (optionnel, {DEFAULT_PORT} par défaut)")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        filename='command_server.log',
+        level=logging.ERROR,
+        format='%(asctime)s %(message)s',
+        datefmt='%d-%m-%Y %H:%M:%S'
+    )
+
+    server = ThreadingHTTPServer((args.host, args.port), CommandHandler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,14 @@
+#!/bin/bash
+
+# Usage: ./command_server_kill.sh
+
+PID=$(pgrep -f "python.*command_server\.py")
+if [ -n "$PID" ]; then
+    echo "Killing command_server.py (PID $PID)..."
+    kill "$PID"
+    sleep 2
+    if kill -0 "$PID" 2>/dev/null; then
+        echo "Process $PID still running, forcing termination..."
+        kill -9 "$PID"
+    fi
+fi
@@ -0,0 +1,46 @@
+from argparse import ArgumentParser
+from pyVmomi import vim
+import socket
+
+from data_retriever.decrypt_password import DecryptionException
+from data_retriever.dto import result_message, output
+from data_retriever.plan_compiler import compile_plan, PlanCompilationException
+
+
+def complete_compile_plan(file_path: str, resolve: bool) -> dict:
+    """
+    Compile a migration plan, so that it is validated before an outage and loaded quickly during one
+    Args:
+        file_path (str): The path to the migration plan
+        resolve (bool): Whether every server and VM of the plan is checked against the vCenter
+    Returns:
+        dict: A dictionary formatted for json dump containing the result message. See result_message() function in dto.py
+    """
+    try:
+        compile_plan(file_path, resolve)
+        return result_message(f"Migration plan '{file_path}' has been successfully compiled", 200)
+
+    except FileNotFoundError:
+        return result_message(f"Migration plan '{file_path}' not found", 404)
+    except DecryptionException as e:
+        return result_message(f"Can't decrypt passwords: {e.message}", 400)
+    except (KeyError, ValueError) as e:
+        return result_message(f"Invalid migration plan: {e}", 400)
+    except PlanCompilationException as e:
+        return result_message(e.message, 404)
+    except vim.fault.InvalidLogin:
+        return result_message("Invalid credentials", 401)
+    except (vim.fault.NoCompatibleHost, vim.fault.InvalidHostState, OSError, socket.error):
+        return result_message("Host is unreachable", 404)
+    except Exception as err:
+        return result_message(str(err), 400)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Valider et compiler un plan de migration")
+    parser.add_argument("--file", default="plans/migration.yml", help="Chemin du plan de migration (optionnel, plans/migration.yml par défaut)")
+    parser.add_argument("--offline", action="store_true", help="Ne pas vérifier les serveurs et les VM auprès du vCenter")
+
+    args = parser.parse_args()
+
+    output(complete_compile_plan(args.file, not args.offline))
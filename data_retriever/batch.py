@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+from sys import stdin
+from typing import Callable
+
+from data_retriever.dto import result_message
+from data_retriever.task_monitor import TaskMonitor
+from data_retriever.vm_ware_connection import VMwareConnection
+
+
+BATCH_CONCURRENCY = 8  # Default maximum number of VMs handled at the same time by a batch
+
+
+def read_moids(moids: list[str] = None, file_path: str = None) -> list[str]:
+    """
+    Get the moids of a batch, given on the command line and/or in a file
+    Args:
+        moids (list[str]): The moids given on the command line, if any
+        file_path (str): The path of a file containing one moid per line, "-" to read them from the standard input
+    Returns:
+        list[str]: The moids, in the order they were given, without duplicates
+    """
+    all_moids = list(moids or [])
+    if file_path == "-":
+        all_moids += stdin.read().split()
+    elif file_path:
+        with open(file_path, "r") as f:
+            all_moids += f.read().split()
+    return list(dict.fromkeys(all_moids))
+
+
+def run_batch(conn: VMwareConnection, moids: list[str], operation: Callable[[str, TaskMonitor], dict], max_concurrency: int = BATCH_CONCURRENCY) -> dict:
+    """
+    Run an operation on many VMs at once, over a single connection. The vCenter tasks of the VMs are followed together
+    by a single task monitor
+    Args:
+        conn (VMwareConnection): The connection to the vCenter
+        moids (list[str]): The Managed Object IDs of the VMs
+        operation (Callable[[str, TaskMonitor], dict]): The operation, called with the moid of a VM and the task monitor,
+            returning the result message of the VM
+        max_concurrency (int): The maximum number of VMs handled at the same time
+    Returns:
+        dict: A dictionary formatted for json dump containing the result message of each VM, with its moid, in the order of `moids`
+    """
+    monitor = TaskMonitor(conn.create_property_watcher())
+    monitor.start()
+
+    def run(moid: str) -> dict:
+        try:
+            result = operation(moid, monitor)
+        except Exception as err:
+            result = result_message(str(err), 400)
+        return {"moid": moid, **result}
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(min(max_concurrency, len(moids)), 1), thread_name_prefix="batch") as executor:
+            results = list(executor.map(run, moids))
+    finally:
+        monitor.stop()
+    return {"results": results}
@@ -1,6 +1,8 @@
 from redis import Redis
 from dotenv import load_dotenv
 from os import environ as env
+from json import loads as json_loads, dumps as json_dumps
+from time import time
 
 from data_retriever.cache_element import VCenterElement, deserialize_vcenter
 
@@ -8,13 +10,36 @@ load_dotenv()
 
 VCENTER = "metrics:vcenter"
 METRICS = "metrics:metrics"
+METRICS_CHUNK_SIZE = 1000
+
+# "hash": metrics of every element in the METRICS hash (legacy layout)
+# "keys": metrics of each element in its own key, expiring after METRICS_TTL seconds, and indexed in METRICS_INDEX
+METRICS_LAYOUT = env.get('METRICS_LAYOUT', 'hash')
+METRICS_TTL = int(env.get('METRICS_TTL', 180))
+METRICS_ELEMENT_PREFIX = "metrics:element:"
+METRICS_INDEX = "metrics:elements"  # Sorted set of serialized elements, scored by the time of their last update
+
+METRICS_HISTORY_PREFIX = "metrics:history:"
+# Resolution of a history stream ("raw" for collected samples): (maximum number of entries, retention in seconds)
+METRICS_HISTORY_LENGTHS = {
+    "raw": (60, 60 * 60),
+    "1m": (180, 3 * 60 * 60),
+    "15m": (192, 2 * 24 * 60 * 60),
+    "1h": (336, 14 * 24 * 60 * 60),
+}
+# Error of Redis when a sample is older than the last one of its stream
+STALE_HISTORY_ERROR = "equal or smaller than the target stream top item"
 
 class CacheException(Exception):
     def __init__(self, message):
         self.message = message
 
 class Cache:
-    def __init__(self):
+    def __init__(self, layout=METRICS_LAYOUT, ttl=METRICS_TTL):
+        if layout not in ("hash", "keys"):
+            raise CacheException(f"Unknown metrics layout: {layout}")
+        self._layout = layout
+        self._ttl = ttl
         try:
             host = env.get('REDIS_HOST')
             port = int(env.get('REDIS_PORT'))
@@ -58,7 +83,199 @@ class Cache:
         Raises:
             CacheException: If an error occured while setting metrics
         """
+        self.set_metrics_bulk({element: metrics})
+
+    def set_metrics_bulk(self, metrics: dict[str, str], chunk_size=METRICS_CHUNK_SIZE):
+        """
+        Set the metrics of several VMware elements in one round trip
+        Args:
+            metrics (dict[str, str]): The serialized JSON of the metrics of each element, by serialized JSON `VMwareElement`
+            chunk_size (int): The maximum number of elements sent in a single command
+        Raises:
+            CacheException: If an error occured while setting metrics
+        """
+        if not metrics:
+            return
         try:
-            self._redis.hset(METRICS, element, metrics)
+            items = list(metrics.items())
+            now = time()
+            pipeline = self._redis.pipeline(transaction=False)
+            for i in range(0, len(items), chunk_size):
+                chunk = items[i:i + chunk_size]
+                if self._layout == "hash":
+                    pipeline.hset(METRICS, mapping=dict(chunk))
+                else:
+                    for element, element_metrics in chunk:
+                        pipeline.set(_element_key(element), element_metrics, ex=self._ttl)
+                    pipeline.zadd(METRICS_INDEX, {element: now for element, _ in chunk})
+            pipeline.execute()
         except Exception as e:
             raise CacheException(f"Failed to push metrics to Redis: {e}") from e
+
+    def touch_metrics(self, elements: list[str], chunk_size=METRICS_CHUNK_SIZE):
+        """
+        Mark the metrics of VMware elements as still up to date, so that they don't expire. Does nothing with the "hash" layout
+        Args:
+            elements (list[str]): The serialized JSON `VMwareElement` of the elements
+            chunk_size (int): The maximum number of elements sent in a single command
+        Raises:
+            CacheException: If an error occured while refreshing metrics
+        """
+        if self._layout == "hash" or not elements:
+            return
+        try:
+            now = time()
+            pipeline = self._redis.pipeline(transaction=False)
+            for i in range(0, len(elements), chunk_size):
+                chunk = elements[i:i + chunk_size]
+                for element in chunk:
+                    pipeline.expire(_element_key(element), self._ttl)
+                pipeline.zadd(METRICS_INDEX, {element: now for element in chunk})
+            pipeline.execute()
+        except Exception as e:
+            raise CacheException(f"Failed to refresh metrics in Redis: {e}") from e
+
+    def delete_metrics(self, element: str):
+        """
+        Delete the metrics of a VMware element
+        Args:
+            element (str): The serialized JSON `VMwareElement`
+        Raises:
+            CacheException: If an error occured while deleting metrics
+        """
+        try:
+            if self._layout == "hash":
+                self._redis.hdel(METRICS, element)
+            else:
+                pipeline = self._redis.pipeline(transaction=False)
+                pipeline.delete(_element_key(element))
+                pipeline.zrem(METRICS_INDEX, element)
+                pipeline.execute()
+        except Exception as e:
+            raise CacheException(f"Failed to delete metrics from Redis: {e}") from e
+
+    def get_metrics(self, elements: list[str] = None, chunk_size=METRICS_CHUNK_SIZE) -> dict[str, str]:
+        """
+        Get the metrics of VMware elements
+        Args:
+            elements (list[str]): The serialized JSON `VMwareElement` of the elements to get metrics from. Default to every element
+            chunk_size (int): The maximum number of elements fetched by a single command
+        Returns:
+            dict[str, str]: The serialized JSON of the metrics of each element found, by serialized JSON `VMwareElement`
+        Raises:
+            CacheException: If an error occured while getting metrics
+        """
+        try:
+            if self._layout == "hash":
+                if elements is None:
+                    return self._redis.hgetall(METRICS)
+                values = []
+                for i in range(0, len(elements), chunk_size):
+                    values.extend(self._redis.hmget(METRICS, elements[i:i + chunk_size]))
+            else:
+                if elements is None:
+                    self._redis.zremrangebyscore(METRICS_INDEX, "-inf", time() - self._ttl)
+                    elements = self._redis.zrange(METRICS_INDEX, 0, -1)
+                values = []
+                for i in range(0, len(elements), chunk_size):
+                    values.extend(self._redis.mget([_element_key(element) for element in elements[i:i + chunk_size]]))
+            return {element: value for element, value in zip(elements, values) if value is not None}
+        except Exception as e:
+            raise CacheException(f"Failed to get metrics from Redis: {e}") from e
+
+    def add_history_bulk(self, samples: list[tuple[str, str, float, dict]]):
+        """
+        Append metrics samples to the bounded history streams of VMware elements, in one round trip.
+        Streams are trimmed to the length of their resolution and expire when the element is no longer collected
+        Args:
+            samples (list[tuple[str, str, float, dict]]): The samples to append, as (serialized JSON `VMwareElement`,
+                resolution, timestamp in seconds since the epoch, metrics). See `METRICS_HISTORY_LENGTHS` for resolutions
+        Raises:
+            CacheException: If an error occured while appending samples
+        """
+        if not samples:
+            return
+        try:
+            pipeline = self._redis.pipeline(transaction=False)
+            for element, resolution, timestamp, metrics in samples:
+                max_length, retention = METRICS_HISTORY_LENGTHS[resolution]
+                key = _history_key(element, resolution)
+                pipeline.xadd(key, {"metrics": json_dumps(metrics)}, id=f"{int(timestamp * 1000)}-0",
+                              maxlen=max_length, approximate=True)
+                pipeline.expire(key, retention)
+            # A sample older than the last one of its stream is rejected by Redis: it is dropped. Any other error is raised
+            results = pipeline.execute(raise_on_error=False)
+            for index, result in enumerate(results):
+                if isinstance(result, Exception) and not (index % 2 == 0 and STALE_HISTORY_ERROR in str(result)):
+                    raise result
+        except Exception as e:
+            raise CacheException(f"Failed to push metrics history to Redis: {e}") from e
+
+    def get_history(self, element: str, start: float, end: float, resolution="raw") -> list[tuple[float, dict]]:
+        """
+        Get the metrics history of a VMware element over a time window
+        Args:
+            element (str): The serialized JSON `VMwareElement`
+            start (float): The start of the window, in seconds since the epoch
+            end (float): The end of the window, in seconds since the epoch
+            resolution (str): The resolution of the history: "raw", "1m", "15m" or "1h" (default to "raw")
+        Returns:
+            list[tuple[float, dict]]: The samples of the window as (timestamp in seconds since the epoch, metrics), oldest first
+        Raises:
+            CacheException: If an error occured while getting history
+        """
+        if resolution not in METRICS_HISTORY_LENGTHS:
+            raise CacheException(f"Unknown history resolution: {resolution}")
+        try:
+            entries = self._redis.xrange(_history_key(element, resolution), min=int(start * 1000), max=int(end * 1000))
+            return [(int(entry_id.split("-")[0]) / 1000, json_loads(fields["metrics"])) for entry_id, fields in entries]
+        except Exception as e:
+            raise CacheException(f"Failed to get metrics history from Redis: {e}") from e
+
+    def migrate_metrics_layout(self, chunk_size=METRICS_CHUNK_SIZE):
+        """
+        Move the metrics stored with the legacy "hash" layout to the per-element keys of the "keys" layout, then delete the
+        legacy hash. Does nothing with the "hash" layout or if there is nothing to migrate
+        Args:
+            chunk_size (int): The maximum number of elements migrated by a single round trip
+        Raises:
+            CacheException: If an error occured while migrating metrics
+        """
+        if self._layout == "hash":
+            return
+        try:
+            batch = {}
+            for element, metrics in self._redis.hscan_iter(METRICS, count=chunk_size):
+                batch[element] = metrics
+                if len(batch) >= chunk_size:
+                    self.set_metrics_bulk(batch, chunk_size)
+                    batch = {}
+            self.set_metrics_bulk(batch, chunk_size)
+            self._redis.delete(METRICS)
+        except Exception as e:
+            raise CacheException(f"Failed to migrate metrics in Redis: {e}") from e
+
+
+def _element_key(element: str) -> str:
+    """
+    Get the key storing the metrics of a VMware element with the "keys" layout
+    Args:
+        element (str): The serialized JSON `VMwareElement`
+    Returns:
+        str: The Redis key of the element
+    """
+    obj = json_loads(element)
+    return f"{METRICS_ELEMENT_PREFIX}{obj['type']}:{obj['moid']}"
+
+
+def _history_key(element: str, resolution: str) -> str:
+    """
+    Get the stream storing the metrics history of a VMware element at a resolution
+    Args:
+        element (str): The serialized JSON `VMwareElement`
+        resolution (str): The resolution of the history
+    Returns:
+        str: The Redis key of the stream
+    """
+    obj = json_loads(element)
+    return f"{METRICS_HISTORY_PREFIX}{resolution}:{obj['type']}:{obj['moid']}"
@@ -0,0 +1,188 @@
+from heapq import heapify, heapreplace
+from json import load as json_load, dump as json_dump
+from os import replace as replace_file
+from threading import Lock
+import logging
+
+from data_retriever.ups_monitor import UpsMonitor
+
+
+STEP_DURATIONS_FILE = "plans/step_durations.json"
+# Duration of a step never executed, in seconds, by action (first word of the step name)
+DEFAULT_STEP_DURATIONS = {
+    "check-server": 5,
+    "stop": 60,
+    "migrate": 120,
+    "start": 60,
+    "stop-server": 120,
+}
+DURATION_WEIGHT = 0.3  # Weight of the last run in the moving average of the duration of a step
+
+
+class StepDurations:
+    """ Exponentially weighted moving average of the duration of each step of the migration plans, saved across runs """
+    def __init__(self, file_path: str = STEP_DURATIONS_FILE):
+        self._file_path = file_path
+        self._durations = {}
+        self._lock = Lock()
+
+    def load(self):
+        """ Load the durations saved by previous runs. A missing or invalid file is ignored """
+        try:
+            with open(self._file_path, "r") as f:
+                durations = json_load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning(f"Can't load step durations: {e}")
+            return
+        with self._lock:
+            self._durations = {step: float(duration) for step, duration in durations.items()}
+
+    def save(self):
+        """ Save the durations for the next runs. Failures are logged """
+        with self._lock:
+            durations = dict(self._durations)
+        try:
+            tmp_path = f"{self._file_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json_dump(durations, f, indent=2)
+            replace_file(tmp_path, self._file_path)
+        except OSError as e:
+            logging.warning(f"Can't save step durations: {e}")
+
+    def record(self, step: str, duration: float):
+        """
+        Record the duration of an execution of a step
+        Args:
+            step (str): The name of the step (e.g. "migrate vm-123")
+            duration (float): The duration of the step, in seconds
+        """
+        with self._lock:
+            previous = self._durations.get(step)
+            self._durations[step] = duration if previous is None else DURATION_WEIGHT * duration + (1 - DURATION_WEIGHT) * previous
+
+    def estimate(self, step: str) -> float:
+        """
+        Estimate the duration of a step: its average duration if it was already executed, or else the average duration of
+        the steps of the same action, or else the default duration of the action
+        Args:
+            step (str): The name of the step (e.g. "migrate vm-123")
+        Returns:
+            float: The estimated duration, in seconds
+        """
+        action = step.split(" ")[0]
+        with self._lock:
+            if step in self._durations:
+                return self._durations[step]
+            same_action = [duration for name, duration in self._durations.items() if name.split(" ")[0] == action]
+        if same_action:
+            return sum(same_action) / len(same_action)
+        return DEFAULT_STEP_DURATIONS.get(action, max(DEFAULT_STEP_DURATIONS.values()))
+
+
+class DeadlinePlanner:
+    """
+    Keep track of the pending steps of a migration plan, to check that the mandatory ones (stopping VMs and servers) can
+    finish before the UPS battery runs out. Steps of different groups (servers) are assumed to run in parallel, up to
+    `max_groups` groups at a time
+    """
+    def __init__(self, monitor: UpsMonitor = None, durations: StepDurations = None, safety_margin: float = 60,
+                 max_groups: int = None):
+        """
+        Args:
+            monitor (UpsMonitor): The monitor of the UPS, None if the UPS is unknown: every step is then affordable
+            durations (StepDurations): The durations of the steps
+            safety_margin (float): Time to keep in reserve when the mandatory steps are done, in seconds
+            max_groups (int): The maximum number of groups executed at the same time, None for all of them
+        """
+        self._monitor = monitor
+        self._durations = durations if durations else StepDurations()
+        self._safety_margin = safety_margin
+        self._max_groups = max_groups
+        self._pending = {}  # (group, mandatory, concurrency) of each pending step, by step name
+        self._lock = Lock()
+
+    def add_step(self, group: str, step: str, mandatory: bool, concurrency: int = 1):
+        """
+        Register a step to execute
+        Args:
+            group (str): The group of the step
+            step (str): The name of the step
+            mandatory (bool): Whether the step has to be done before the battery runs out
+            concurrency (int): The number of steps of the group that run at the same time as this one
+        """
+        with self._lock:
+            self._pending[step] = (group, mandatory, max(concurrency, 1))
+
+    def finish_step(self, step: str):
+        """
+        Mark a step as done, or skipped
+        Args:
+            step (str): The name of the step
+        """
+        with self._lock:
+            self._pending.pop(step, None)
+
+    def record(self, step: str, duration: float):
+        """
+        Record the duration of an execution of a step, for the estimates of the next steps and runs
+        Args:
+            step (str): The name of the step
+            duration (float): The duration of the step, in seconds
+        """
+        self._durations.record(step, duration)
+
+    def can_afford(self, step: str) -> bool:
+        """
+        Check whether an optional step can be done without putting the mandatory pending steps at risk
+        Args:
+            step (str): The name of the step
+        Returns:
+            bool: True if the step and the mandatory steps should finish before the battery runs out
+        """
+        remaining = self._monitor.remaining() if self._monitor else None
+        if remaining is None:
+            return True
+        return self._durations.estimate(step) + self._estimate(mandatory_only=True) + self._safety_margin <= remaining
+
+    def plan_at_risk(self) -> bool:
+        """
+        Check whether the pending steps may not finish before the battery runs out. Only used to end the grace period
+        early: the steps are not reordered, and the only work dropped is the optional steps refused by can_afford().
+        There is no force-stop fallback, since VMs are already stopped by powering them off (see vm_stop())
+        Returns:
+            bool: True if the pending steps should not finish before the battery runs out
+        """
+        remaining = self._monitor.remaining() if self._monitor else None
+        if remaining is None:
+            return False
+        return self._estimate(mandatory_only=False) + self._safety_margin > remaining
+
+    def save(self):
+        """ Save the durations of the steps for the next runs """
+        self._durations.save()
+
+    def _estimate(self, mandatory_only: bool) -> float:
+        """
+        Estimate the time needed to execute the pending steps: the longest of the groups, or when at most `max_groups`
+        groups run at a time, the longest of the `max_groups` slots the groups are spread over (longest groups first,
+        each to the least loaded slot)
+        Args:
+            mandatory_only (bool): Whether only the mandatory steps are estimated
+        Returns:
+            float: The estimated time, in seconds
+        """
+        with self._lock:
+            pending = list(self._pending.items())
+        by_group = {}
+        for step, (group, mandatory, concurrency) in pending:
+            if mandatory or not mandatory_only:
+                by_group[group] = by_group.get(group, 0) + self._durations.estimate(step) / concurrency
+        if not self._max_groups or len(by_group) <= self._max_groups:
+            return max(by_group.values(), default=0)
+        slots = [0.0] * self._max_groups
+        heapify(slots)
+        for duration in sorted(by_group.values(), reverse=True):
+            heapreplace(slots, slots[0] + duration)
+        return max(slots)
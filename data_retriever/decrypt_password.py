@@ -1,8 +1,11 @@
 from base64 import b64decode, b64encode
+from hashlib import sha256
+from hmac import new as hmac_new
 from Crypto.Cipher import AES
 from Crypto.Protocol.KDF import scrypt
 from Crypto.Random import get_random_bytes
 from dotenv import load_dotenv
+from functools import lru_cache
 from os import environ as env
 
 load_dotenv()
@@ -11,6 +14,18 @@ class DecryptionException(Exception):
     def __init__(self, message):
         self.message = message
 
+@lru_cache(maxsize=1)
+def _derive_key(secret_key: str) -> bytes:
+    """
+    Derive the AES key from the encryption secret. Derivation is costly by design, so the key is derived once per process
+    and kept in memory only, until the secret changes
+    Args:
+        secret_key (str): The encryption secret (ENCRYPTION_KEY)
+    Returns:
+        bytes: The AES key
+    """
+    return scrypt(secret_key, 'salt', 32, N=16384, r=8, p=1)
+
 def decrypt(encrypted_base64: str) -> str:
     """
     Decrypt a base64 encoded encrypted password
@@ -29,7 +44,7 @@ def decrypt(encrypted_base64: str) -> str:
         auth_tag = combined[16:32]
         ciphertext = combined[32:]
 
-        key = scrypt(secret_key, 'salt', 32, N=16384, r=8, p=1)
+        key = _derive_key(secret_key)
 
         cipher = AES.new(key, AES.MODE_GCM, nonce=iv)
         cipher.update(b'')
@@ -39,6 +54,41 @@ def decrypt(encrypted_base64: str) -> str:
     except Exception as e:
         raise DecryptionException(e)
 
+def decrypt_all(encrypted_base64: list[str]) -> list[str]:
+    """
+    Decrypt many base64 encoded encrypted passwords. Identical passwords are decrypted once
+    Args:
+        encrypted_base64 (list[str]): base64 encoded encrypted passwords
+    Returns:
+        list[str]: decrypted passwords, in the same order
+    Raises:
+        DecryptionException: If an encrypted password cannot be decrypted
+    """
+    decrypted = {}
+    for encrypted in encrypted_base64:
+        if encrypted not in decrypted:
+            decrypted[encrypted] = decrypt(encrypted)
+    return [decrypted[encrypted] for encrypted in encrypted_base64]
+
+def keyed_hash(message: str) -> str:
+    """
+    Compute an HMAC-SHA256 of a message, keyed by the encryption secret, so that it can't be computed or brute-forced
+    without the secret
+    Args:
+        message (str): The message to hash
+    Returns:
+        str: The hexadecimal HMAC of the message
+    Raises:
+        ValueError: If ENCRYPTION_KEY is not set
+    """
+    secret_key = env.get('ENCRYPTION_KEY')
+    if not secret_key:
+        raise ValueError("ENCRYPTION_KEY must be set in the environment.")
+
+    # Separate key for hashing, so that the AES key is never used for anything else
+    hash_key = hmac_new(_derive_key(secret_key), b'keyed-hash', sha256).digest()
+    return hmac_new(hash_key, message.encode('utf-8'), sha256).hexdigest()
+
 def encrypt(plaintext: str) -> str:
     """
     Encrypt a plaintext password and return a base64-encoded string
@@ -49,7 +99,7 @@ def encrypt(plaintext: str) -> str:
     if not secret_key:
         raise ValueError("ENCRYPTION_KEY must be set in the environment.")
 
-    key = scrypt(secret_key, 'salt', 32, N=16384, r=8, p=1)
+    key = _derive_key(secret_key)
     iv = get_random_bytes(16)
 
     cipher = AES.new(key, AES.MODE_GCM, nonce=iv)
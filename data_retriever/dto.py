@@ -1,7 +1,57 @@
 from pyVmomi import vim
 from json import dumps as json_dumps
+from typing import Iterable
 
 
+VM_LIST_PROPERTIES = [
+    "name",
+    "summary.guest.ipAddress",
+    "config.guestFullName",
+    "guest.guestFamily",
+    "config.version",
+    "config.createDate",
+    "config.hardware.numCoresPerSocket",
+    "config.hardware.numCPU",
+    "runtime.host",
+]
+
+VM_METRICS_PROPERTIES = [
+    "runtime.powerState",
+    "guest.guestState",
+    "runtime.connectionState",
+    "guestHeartbeatStatus",
+    "overallStatus",
+    "runtime.maxCpuUsage",
+    "runtime.maxMemoryUsage",
+    "runtime.bootTime",
+    "runtime.vmFailoverInProgress",
+    "summary.quickStats",
+    "summary.storage",
+]
+
+SERVER_LIST_PROPERTIES = [
+    "name",
+    "parent",
+    "summary.managementServerIp",
+    "hardware.systemInfo.vendor",
+    "hardware.systemInfo.model",
+    "config.network.vnic",
+    "hardware.cpuInfo.numCpuCores",
+    "hardware.cpuInfo.numCpuThreads",
+    "hardware.cpuInfo.hz",
+    "hardware.memorySize",
+]
+
+SERVER_METRICS_PROPERTIES = [
+    "runtime.powerState",
+    "overallStatus",
+    "summary.rebootRequired",
+    "summary.quickStats",
+    "hardware.cpuInfo.hz",
+    "hardware.cpuInfo.numCpuCores",
+    "runtime.bootTime",
+]
+
 def output(json_dict: dict):
     """
     Send dictionary to output
@@ -11,6 +61,16 @@ def output(json_dict: dict):
     print(json_dumps(json_dict, indent=2))
 
 
+def output_ndjson(json_dicts: Iterable[dict]):
+    """
+    Send dictionaries to output as soon as they are ready, one compact JSON object per line
+    Args:
+        json_dicts (Iterable[dict]): Json formatted dictionaries to send
+    """
+    for json_dict in json_dicts:
+        print(json_dumps(json_dict, separators=(",", ":")), flush=True)
+
+
 def result_message(message: str, http_code) -> dict:
     """
     Dump a json formatted result message
@@ -60,6 +120,44 @@ def vms_list_info(vms: list[vim.VirtualMachine]) -> dict:
     return {"vms": vm_list}
 
 
+def vms_list_records_info(records: list[dict], host_names: dict[str, str]) -> dict:
+    """
+    Format VMs data retrieved in bulk (see `VM_LIST_PROPERTIES`) to a json dictionary
+    Args:
+        records (list[dict]): A list of VM property records
+        host_names (dict[str, str]): The name of each server, by Managed Object ID
+    Returns:
+        dict: A dictionary formatted for json dump containing the vms data
+    """
+    return {"vms": [vm_record_info(record, host_names) for record in records]}
+
+
+def vm_record_info(record: dict, host_names: dict[str, str]) -> dict:
+    """
+    Format the data of a VM retrieved in bulk (see `VM_LIST_PROPERTIES`) to a json dictionary
+    Args:
+        record (dict): The VM property record
+        host_names (dict[str, str]): The name of each server, by Managed Object ID
+    Returns:
+        dict: A dictionary formatted for json dump containing the vm data
+    """
+    create_date = record.get("config.createDate")
+    host = record.get("runtime.host")
+    return {
+        "name": record.get("name"),
+        "moid": record["moid"],
+        "ip": record.get("summary.guest.ipAddress") or "",
+        "guestOs": record.get("config.guestFullName"),
+        "guestFamily": record.get("guest.guestFamily", ""),
+        "version": record.get("config.version"),
+        "createDate": create_date.isoformat() if create_date else "",
+        "numCoresPerSocket": record.get("config.hardware.numCoresPerSocket"),
+        "numCPU": record.get("config.hardware.numCPU"),
+        "esxiHostName": host_names.get(host._moId, "") if host else "",
+        "esxiHostMoid": host._moId if host else "",
+    }
+
+
 def vm_metrics_info(vm: vim.VirtualMachine) -> dict:
     """
     Format VM metrics data to a json dictionary
@@ -79,25 +177,75 @@ def vm_metrics_info(vm: vim.VirtualMachine) -> dict:
         "bootTime": vm.runtime.bootTime.isoformat() if vm.runtime.bootTime else "",
         "isMigrating": vm.runtime.vmFailoverInProgress
     }
-    if vm.summary.quickStats:
-        json_object["overallCpuUsage"] = vm.summary.quickStats.overallCpuUsage
-        json_object["guestMemoryUsage"] = vm.summary.quickStats.guestMemoryUsage
-        json_object["uptimeSeconds"] = vm.summary.quickStats.uptimeSeconds
-        json_object["swappedMemory"] = vm.summary.quickStats.swappedMemory
-    else:
-        json_object["overallCpuUsage"] = 0
-        json_object["guestMemoryUsage"] = 0
-        json_object["uptimeSeconds"] = 0
-        json_object["swappedMemory"] = 0
-    if vm.summary.storage:
-        json_object["usedStorage"] = vm.summary.storage.committed
-        json_object["totalStorage"] = vm.summary.storage.committed + vm.summary.storage.uncommitted
-    else:
-        json_object["usedStorage"] = 0
-        json_object["totalStorage"] = 0
+    json_object.update(_vm_quick_stats(vm.summary.quickStats))
+    json_object.update(_vm_storage(vm.summary.storage))
+    return json_object
+
+
+def vm_metrics_record_info(record: dict) -> dict:
+    """
+    Format VM metrics data retrieved in bulk (see `VM_METRICS_PROPERTIES`) to a json dictionary
+    Args:
+        record (dict): The VM property record where metrics are retrieved
+    Returns:
+        dict: A dictionary formatted for json dump containing the metrics data
+    """
+    boot_time = record.get("runtime.bootTime")
+    json_object = {
+        "powerState": record.get("runtime.powerState"),
+        "guestState": record.get("guest.guestState", ""),
+        "connectionState": record.get("runtime.connectionState"),
+        "guestHeartbeatStatus": record.get("guestHeartbeatStatus"),
+        "overallStatus": record.get("overallStatus"),
+        "maxCpuUsage": record.get("runtime.maxCpuUsage"),
+        "maxMemoryUsage": record.get("runtime.maxMemoryUsage"),
+        "bootTime": boot_time.isoformat() if boot_time else "",
+        "isMigrating": record.get("runtime.vmFailoverInProgress")
+    }
+    json_object.update(_vm_quick_stats(record.get("summary.quickStats")))
+    json_object.update(_vm_storage(record.get("summary.storage")))
     return json_object
 
 
+def _vm_quick_stats(quick_stats: vim.vm.Summary.QuickStats) -> dict:
+    """
+    Format VM quick statistics to a json dictionary
+    Args:
+        quick_stats (vim.vm.Summary.QuickStats): The quick statistics of the VM, or None
+    Returns:
+        dict: A dictionary formatted for json dump containing the usage metrics
+    """
+    if not quick_stats:
+        return {
+            "overallCpuUsage": 0,
+            "guestMemoryUsage": 0,
+            "uptimeSeconds": 0,
+            "swappedMemory": 0,
+        }
+    return {
+        "overallCpuUsage": quick_stats.overallCpuUsage,
+        "guestMemoryUsage": quick_stats.guestMemoryUsage,
+        "uptimeSeconds": quick_stats.uptimeSeconds,
+        "swappedMemory": quick_stats.swappedMemory,
+    }
+
+
+def _vm_storage(storage: vim.vm.Summary.StorageSummary) -> dict:
+    """
+    Format VM storage summary to a json dictionary
+    Args:
+        storage (vim.vm.Summary.StorageSummary): The storage summary of the VM, or None
+    Returns:
+        dict: A dictionary formatted for json dump containing the storage metrics
+    """
+    if not storage:
+        return {"usedStorage": 0, "totalStorage": 0}
+    return {
+        "usedStorage": storage.committed,
+        "totalStorage": storage.committed + storage.uncommitted,
+    }
+
+
 def servers_list_info(hosts: list[vim.HostSystem]) -> dict:
     """
     Format Server data to a json dictionary
@@ -135,6 +283,34 @@ def server_info(host: vim.HostSystem) -> dict:
     }
 
 
+def server_record_info(record: dict, parent_names: dict[str, str]) -> dict:
+    """
+    Format Server data retrieved in bulk (see `SERVER_LIST_PROPERTIES`) to a json dictionary, like server_info()
+    Args:
+        record (dict): The Host property record where server data are retrieved
+        parent_names (dict[str, str]): The name of each compute resource (cluster), by Managed Object ID
+    Returns:
+        dict: A dictionary formatted for json dump containing the server data
+    """
+    parent = record.get("parent")
+    vnics = record.get("config.network.vnic")
+    hz = record.get("hardware.cpuInfo.hz")
+    memory_size = record.get("hardware.memorySize")
+    return {
+        "name": record.get("name"),
+        "moid": record["moid"],
+        "vCenterIp": record.get("summary.managementServerIp"),
+        "cluster": parent_names.get(parent._moId, "") if parent else "",
+        "vendor": record.get("hardware.systemInfo.vendor"),
+        "model": record.get("hardware.systemInfo.model"),
+        "ip": vnics[0].spec.ip.ipAddress if vnics else "",
+        "cpuCores": record.get("hardware.cpuInfo.numCpuCores"),
+        "cpuThreads": record.get("hardware.cpuInfo.numCpuThreads"),
+        "cpuMHz": hz / 1000000 if hz else 0,
+        "ramTotal": int(memory_size / (1024 ** 3)) if memory_size else 0,
+    }
+
+
 def server_metrics_info(host: vim.HostSystem) -> dict:
     """
     Format Server metrics data to a json dictionary
@@ -144,7 +320,7 @@ def server_metrics_info(host: vim.HostSystem) -> dict:
        dict: A dictionary formatted for json dump containing the metrics data
     """
     if host.summary.quickStats.overallCpuUsage and host.hardware:
-        cpu_usage = (host.summary.quickStats.overallCpuUsage / ((host.hardware.cpuInfo.hz / 1000000) * host.hardware.cpuInfo.numCpuCores)) * 100
+        cpu_usage = _cpu_usage_percent(host.summary.quickStats.overallCpuUsage, host.hardware.cpuInfo.hz, host.hardware.cpuInfo.numCpuCores)
     else:
         cpu_usage = 0
     return {
@@ -156,3 +332,43 @@ def server_metrics_info(host: vim.HostSystem) -> dict:
         "uptime": host.summary.quickStats.uptime,
         "boottime": host.runtime.bootTime.isoformat() if host.runtime.bootTime else "",
     }
+
+
+def server_metrics_record_info(record: dict) -> dict:
+    """
+    Format Server metrics data retrieved in bulk (see `SERVER_METRICS_PROPERTIES`) to a json dictionary
+    Args:
+       record (dict): The Host property record where metrics are retrieved
+    Returns:
+       dict: A dictionary formatted for json dump containing the metrics data
+    """
+    quick_stats = record.get("summary.quickStats")
+    hz = record.get("hardware.cpuInfo.hz")
+    cores = record.get("hardware.cpuInfo.numCpuCores")
+    if quick_stats and quick_stats.overallCpuUsage and hz and cores:
+        cpu_usage = _cpu_usage_percent(quick_stats.overallCpuUsage, hz, cores)
+    else:
+        cpu_usage = 0
+    boot_time = record.get("runtime.bootTime")
+    return {
+        "powerState": record.get("runtime.powerState"),
+        "overallStatus": record.get("overallStatus"),
+        "rebootRequired": record.get("summary.rebootRequired"),
+        "cpuUsagePercent": cpu_usage,
+        "ramUsageMB": quick_stats.overallMemoryUsage if quick_stats else 0,
+        "uptime": quick_stats.uptime if quick_stats else 0,
+        "boottime": boot_time.isoformat() if boot_time else "",
+    }
+
+
+def _cpu_usage_percent(overall_cpu_usage: int, hz: int, num_cpu_cores: int) -> float:
+    """
+    Compute the CPU usage of a server as a percentage of its total capacity
+    Args:
+        overall_cpu_usage (int): The CPU usage of the server in MHz
+        hz (int): The frequency of a CPU core in Hz
+        num_cpu_cores (int): The number of CPU cores of the server
+    Returns:
+        float: The CPU usage in percent
+    """
+    return (overall_cpu_usage / ((hz / 1000000) * num_cpu_cores)) * 100
@@ -0,0 +1,101 @@
+from threading import Condition, Event, Thread
+from time import monotonic
+from pyVmomi import vim
+import logging
+
+from data_retriever.property_watcher import PropertyWatcher
+
+
+HOST_READY_TIMEOUT = 600  # Default maximum time to wait for a host to be connected, in seconds
+UPDATE_WAIT = 5           # Maximum duration of a wait for updates, so that the waiter stops quickly, in seconds
+UPDATE_RETRY_DELAY = 5    # Delay before waiting for updates again after an error, in seconds
+
+
+class HostReadinessWaiter:
+    """
+    Wait for hosts to be connected to the vCenter. The connection state of every host is followed with a single
+    PropertyWatcher in the background, so that waiters wake up as soon as the state of their host changes.
+    Each host has a single deadline, shared by every wait on it, which starts when the host is armed (see arm()), e.g.
+    once it is powered on
+    """
+    def __init__(self, watcher: PropertyWatcher, timeout: float = HOST_READY_TIMEOUT):
+        """
+        Args:
+            watcher (PropertyWatcher): The watcher to follow the hosts with, destroyed by stop()
+            timeout (float): Maximum time to wait for a host to be connected, from its arming, in seconds
+        """
+        self._watcher = watcher
+        self._timeout = timeout
+        self._states = {}     # Connection state of each host, by moid
+        self._deadlines = {}  # Deadline of the waits on each armed host, by moid
+        self._changed = Condition()
+        self._stopped = Event()
+        self._thread = None
+
+    def start(self):
+        """ Start following the connection state of the hosts """
+        self._watcher.watch_container(vim.HostSystem, ["runtime.connectionState"])
+        self._stopped.clear()
+        self._thread = Thread(target=self._follow, name="host-readiness", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop following the hosts and destroy the watcher. Pending waits return False """
+        self._stopped.set()
+        with self._changed:
+            self._changed.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self._watcher.destroy()
+
+    def arm(self, moid: str):
+        """
+        Start the deadline of the waits on a host. Arming a host again keeps its first deadline
+        Args:
+            moid (str): The Managed Object ID of the host
+        """
+        with self._changed:
+            self._deadlines.setdefault(moid, monotonic() + self._timeout)
+            self._changed.notify_all()
+
+    def wait_ready(self, moid: str) -> bool:
+        """
+        Wait for a host to be connected to the vCenter. The wait has no limit until the host is armed
+        Args:
+            moid (str): The Managed Object ID of the host
+        Returns:
+            bool: True if the host is connected, False if it is not connected by its deadline or the waiter is stopped
+        """
+        with self._changed:
+            while self._states.get(moid) != "connected":
+                if self._stopped.is_set():
+                    return False
+                deadline = self._deadlines.get(moid)
+                if deadline is None:
+                    self._changed.wait()
+                    continue
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+            return True
+
+    def _follow(self):
+        """ Update the connection state of the hosts and wake the waiters up on every change, until stopped """
+        while not self._stopped.is_set():
+            try:
+                updates = self._watcher.wait_for_updates(UPDATE_WAIT)
+            except Exception as e:
+                logging.error(f"Can't follow the connection state of the hosts: {e}")
+                self._stopped.wait(UPDATE_RETRY_DELAY)
+                continue
+            if not updates:
+                continue
+            with self._changed:
+                for update in updates:
+                    if update.kind == "leave":
+                        self._states.pop(update.moid, None)
+                    elif "runtime.connectionState" in update.changes:
+                        self._states[update.moid] = update.changes["runtime.connectionState"]
+                self._changed.notify_all()
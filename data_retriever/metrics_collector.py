@@ -0,0 +1,163 @@
+from json import dumps as json_dumps, loads as json_loads
+from pyVmomi import vim
+import logging
+
+from data_retriever.cache import Cache
+from data_retriever.cache_element import serialize_server, serialize_vm
+from data_retriever.dto import vm_metrics_record_info, server_metrics_record_info
+from data_retriever.metrics_history import MetricsHistory
+from data_retriever.perf_counters import PerfCollector
+from data_retriever.property_watcher import PropertyUpdate
+
+
+def serialize_element(obj) -> str:
+    """
+    Serialize a VM or a server into a JSON string
+    Args:
+        obj (vim.VirtualMachine | vim.HostSystem): The element to serialize
+    Returns:
+        str: Json formatted string representation of the element
+    """
+    if isinstance(obj, vim.VirtualMachine):
+        return serialize_vm(obj)
+    return serialize_server(obj)
+
+
+class MetricsCollector:
+    """
+    Keep the latest properties of every VM and server of the vCenter, and push their metrics to the cache when they change.
+    Properties are fed either by bulk retrievals (update_records()) or by property updates (apply_updates())
+    """
+    def __init__(self, cache: Cache, history: MetricsHistory, perf_collector: PerfCollector):
+        self._cache = cache
+        self._history = history
+        self._perf_collector = perf_collector
+        self._records = {}      # Property record of each element, by serialized element
+        self._performance = {}  # Last performance counters of each element, by serialized element
+        self._pushed = {}       # Last metrics pushed for each element, by serialized element
+        self._changed = set()   # Elements whose metrics have to be computed again
+
+    def update_records(self, obj_type, records: list[dict], properties: list[str], complete=False):
+        """
+        Merge properties retrieved in bulk into the records of the elements. Unset properties are missing from the
+        retrieved records: the retrieved properties missing from a record are removed from the record of its element
+        Args:
+            obj_type (type): The type of the elements (vim.VirtualMachine or vim.HostSystem)
+            records (list[dict]): The property records retrieved (see VMwareConnection.get_all_vms_properties())
+            properties (list[str]): The property paths retrieved
+            complete (bool): Whether `records` contains every element of the type: the other elements of the type are
+                removed, along with their history, even those deleted before this collector was created
+        Raises:
+            CacheException: If the metrics of a removed element could not be deleted
+        """
+        seen = set()
+        for record in records:
+            element = serialize_element(record["obj"])
+            seen.add(element)
+            element_record = self._records.setdefault(element, {})
+            for path in properties:
+                if path not in record:
+                    element_record.pop(path, None)
+            element_record.update(record)
+            self._changed.add(element)
+        if complete:
+            for element, record in list(self._records.items()):
+                if isinstance(record["obj"], obj_type) and element not in seen:
+                    self._remove(element)
+            # The history outlives the collectors (e.g. across vCenter reconnections): elements deleted in between are
+            # only known by the history
+            element_type = "VM" if obj_type is vim.VirtualMachine else "Server"
+            for element in self._history.elements() - seen:
+                if json_loads(element)["type"] == element_type:
+                    self._history.forget(element)
+
+    def apply_updates(self, updates: list[PropertyUpdate]):
+        """
+        Apply property updates to the records of the elements
+        Args:
+            updates (list[PropertyUpdate]): The updates returned by PropertyWatcher.wait_for_updates()
+        Raises:
+            CacheException: If the metrics of a removed element could not be deleted
+        """
+        for update in updates:
+            element = serialize_element(update.obj)
+            if update.kind == "leave":
+                self._remove(element)
+                continue
+            record = self._records.setdefault(element, {"obj": update.obj, "moid": update.moid})
+            record.update(update.changes)
+            for path in update.removed:
+                record.pop(path, None)
+            self._changed.add(element)
+
+    def refresh_performance(self):
+        """
+        Retrieve the real-time performance counters of the powered on elements. Errors are logged and ignored, since
+        performance counters only complement the metrics
+        """
+        entities = {}
+        for element, record in self._records.items():
+            if record.get("runtime.powerState") == "poweredOn":
+                entities[record["moid"]] = (element, record["obj"])
+        try:
+            performance = self._perf_collector.collect([obj for _, obj in entities.values()])
+        except Exception as e:
+            logging.error(f"Can't retrieve performance counters: {e}")
+            return
+        self._changed.update(self._performance)
+        self._performance = {entities[moid][0]: values for moid, values in performance.items() if moid in entities}
+        self._changed.update(self._performance)
+
+    def push(self):
+        """
+        Push to the cache the metrics of the elements that changed since the last push
+        Raises:
+            CacheException: If metrics could not be pushed
+        """
+        to_push = {}
+        for element in self._changed:
+            record = self._records.get(element)
+            if not record:
+                continue
+            if isinstance(record["obj"], vim.VirtualMachine):
+                metrics = vm_metrics_record_info(record)
+            else:
+                metrics = server_metrics_record_info(record)
+            metrics.update(self._performance.get(element, {}))
+            if self._pushed.get(element) != metrics:
+                to_push[element] = metrics
+        self._cache.set_metrics_bulk({element: json_dumps(metrics) for element, metrics in to_push.items()})
+        self._pushed.update(to_push)
+        self._changed = set()
+
+    def push_history(self, timestamp: float):
+        """
+        Push the current metrics of every element to its history, along with the rollups they complete, and keep the
+        metrics of unchanged elements from expiring
+        Args:
+            timestamp (float): The time of the samples, in seconds since the epoch
+        Raises:
+            CacheException: If history could not be pushed
+        """
+        samples = []
+        for element, metrics in self._pushed.items():
+            samples.append((element, "raw", timestamp, metrics))
+            for rollup in self._history.add(element, metrics, timestamp):
+                samples.append((rollup.element, rollup.resolution, rollup.timestamp, rollup.metrics))
+        self._cache.add_history_bulk(samples)
+        self._cache.touch_metrics(list(self._pushed))
+
+    def _remove(self, element: str):
+        """
+        Forget an element and delete its metrics from the cache
+        Args:
+            element (str): The serialized element
+        Raises:
+            CacheException: If the metrics could not be deleted
+        """
+        self._records.pop(element, None)
+        self._performance.pop(element, None)
+        self._pushed.pop(element, None)
+        self._changed.discard(element)
+        self._history.forget(element)
+        self._cache.delete_metrics(element)
@@ -0,0 +1,82 @@
+from dataclasses import dataclass, field
+
+
+# Resolution name: duration of a rollup bucket in seconds
+ROLLUP_RESOLUTIONS = {
+    "1m": 60,
+    "15m": 15 * 60,
+    "1h": 60 * 60,
+}
+
+
+@dataclass
+class Rollup:
+    element: str
+    resolution: str
+    timestamp: float                             # Start of the bucket
+    metrics: dict = field(default_factory=dict)  # Average of each numeric metric over the bucket
+
+
+@dataclass
+class _Bucket:
+    start: float
+    sums: dict = field(default_factory=dict)    # Sum of each numeric metric over the bucket
+    counts: dict = field(default_factory=dict)  # Number of samples of each numeric metric in the bucket
+
+
+class MetricsHistory:
+    """ Downsample the metrics samples of VMware elements into rollups of fixed resolutions """
+    def __init__(self, resolutions=None):
+        self._resolutions = resolutions if resolutions is not None else ROLLUP_RESOLUTIONS
+        self._buckets = {}  # Bucket being filled, by (element, resolution)
+
+    def add(self, element: str, metrics: dict, timestamp: float) -> list[Rollup]:
+        """
+        Add a metrics sample of an element
+        Args:
+            element (str): The serialized JSON `VMwareElement`
+            metrics (dict): The metrics of the element (see vm_metrics_info() and server_metrics_info())
+            timestamp (float): The time of the sample, in seconds since the epoch
+        Returns:
+            list[Rollup]: The rollups of the element completed by this sample
+        """
+        rollups = []
+        for resolution, duration in self._resolutions.items():
+            start = timestamp - timestamp % duration
+            bucket = self._buckets.get((element, resolution))
+            if bucket and start < bucket.start:
+                # Sample older than the bucket being filled: its bucket has already been completed
+                continue
+            if bucket and bucket.start != start:
+                rollups.append(Rollup(
+                    element,
+                    resolution,
+                    bucket.start,
+                    {name: total / bucket.counts[name] for name, total in bucket.sums.items()}
+                ))
+                bucket = None
+            if not bucket:
+                bucket = _Bucket(start)
+                self._buckets[(element, resolution)] = bucket
+            for name, value in metrics.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    bucket.sums[name] = bucket.sums.get(name, 0) + value
+                    bucket.counts[name] = bucket.counts.get(name, 0) + 1
+        return rollups
+
+    def elements(self) -> set[str]:
+        """
+        Get the elements having buckets being filled
+        Returns:
+            set[str]: The serialized JSON `VMwareElement` of each element
+        """
+        return {element for element, _ in self._buckets}
+
+    def forget(self, element: str):
+        """
+        Drop the buckets being filled for an element, e.g. when it has been deleted
+        Args:
+            element (str): The serialized JSON `VMwareElement`
+        """
+        for resolution in self._resolutions:
+            self._buckets.pop((element, resolution), None)
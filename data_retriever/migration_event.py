@@ -112,3 +112,70 @@ def deserialize_event(event_type: str, event_json: dict):
         return event
     except TypeError as e:
         raise ValueError(f"Invalid event data for {event_type}: {e}") from e
+
+def compact_events(events: list) -> list:
+    """
+    Reduce the events of a migration plan to the net change of each VM and server, so that the rollback only undoes what
+    is needed to go back to the initial state (e.g. a VM stopped, migrated and started only has to be stopped, migrated
+    back and started, even if the plan ran several times)
+    Args:
+        events (list): The events of the migration plan, latest first (see EventQueue.get_event_list())
+    Returns:
+        list: The events to undo, latest first: for each VM, in order, a VMStartedEvent if it has to be stopped, a
+            VMMigrationEvent if it has to be migrated back and a VMShutdownEvent if it has to be started, a
+            ServerShutdownEvent for each server to start, and the other events unchanged
+    """
+    vm_events = {}      # Events of each VM, latest first, by VM moid
+    server_events = {}  # Latest ServerShutdownEvent or ServerStartedEvent of each server, by server moid
+    others = []
+    for event in events:
+        if isinstance(event, (VMShutdownEvent, VMMigrationEvent, VMStartedEvent)):
+            vm_events.setdefault(event.vm_moid, []).append(event)
+        elif isinstance(event, (ServerShutdownEvent, ServerStartedEvent)):
+            server_events.setdefault(event.server_moid, event)
+        else:
+            others.append(event)
+
+    compacted = [event for event in server_events.values() if isinstance(event, ServerShutdownEvent)]
+    for vm_moid, vm_history in vm_events.items():
+        server_moid = vm_history[0].server_moid
+        power_events = [event for event in vm_history if not isinstance(event, VMMigrationEvent)]
+        # A VM can only be migrated when it is off
+        initially_on = isinstance(vm_history[-1], VMShutdownEvent)
+        currently_on = isinstance(power_events[0], VMStartedEvent) if power_events else initially_on
+        migrated = any(isinstance(event, VMMigrationEvent) for event in vm_history)
+
+        if currently_on and (migrated or not initially_on):
+            compacted.append(VMStartedEvent(vm_moid, server_moid))
+        if migrated:
+            compacted.append(VMMigrationEvent(vm_moid, server_moid))
+        if initially_on and (migrated or not currently_on):
+            compacted.append(VMShutdownEvent(vm_moid, server_moid))
+    return compacted + others
+
+def remove_undone_events(events: list, rollback_events: list) -> list:
+    """
+    Remove the events already undone by a previous run of the rollback, so that an interrupted rollback resumes where it
+    stopped
+    Args:
+        events (list): The events to undo (see compact_events())
+        rollback_events (list): The events of the previous runs of the rollback
+    Returns:
+        list: The events still to undo, in the same order
+    """
+    undone = set()
+    for event in rollback_events:
+        if isinstance(event, VMStartedEvent):
+            undone.add((VMShutdownEvent, event.vm_moid))
+        elif isinstance(event, VMMigrationEvent):
+            undone.add((VMMigrationEvent, event.vm_moid))
+        elif isinstance(event, VMShutdownEvent):
+            undone.add((VMStartedEvent, event.vm_moid))
+        elif isinstance(event, ServerStartedEvent):
+            undone.add((ServerShutdownEvent, event.server_moid))
+
+    def key(event):
+        if isinstance(event, ServerShutdownEvent):
+            return ServerShutdownEvent, event.server_moid
+        return type(event), getattr(event, "vm_moid", None)
+    return [event for event in events if key(event) not in undone]
@@ -1,10 +1,14 @@
 from uuid import uuid4
 from enum import Enum
 from psycopg2 import connect as postgres
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
-from os import environ as env, remove as remove_file
+from json import dumps as json_dumps, loads as json_loads
+from os import environ as env, remove as remove_file, replace as replace_file, fsync
 from os.path import exists as path_exists
 from datetime import datetime
+from threading import Condition, Event, Lock, Thread
+import logging
 
 from data_retriever.migration_event import deserialize_event, serialize_event, VMShutdownEvent, serialize_event_type, \
     MigrationErrorEvent
@@ -12,6 +16,12 @@ from data_retriever.migration_event import deserialize_event, serialize_event, V
 load_dotenv()
 
 SAVED_MIGRATION_ID = "plans/migration_id"
+SAVED_MIGRATION_STATUS = "plans/migration_status"  # Last status of the migration of `SAVED_MIGRATION_ID`
+EVENT_WAL = env.get('EVENT_WAL', 'plans/events.wal')  # Write-ahead log of the events, its high-water mark is in `<EVENT_WAL>.ack`
+WRITE_INTERVAL = 0.5     # Interval between two batches of events written to Postgres, in seconds
+WRITE_BATCH_SIZE = 500   # Maximum number of events written to Postgres in one statement
+WRITE_RETRY_DELAY = 5    # Delay before writing events again when Postgres is unreachable, in seconds
+FLUSH_TIMEOUT = 10       # Default maximum time to wait for pending events to be written, in seconds
 
 class EventQueueException(Exception):
     def __init__(self, message):
@@ -25,106 +35,280 @@ class MigrationStatus(str, Enum):
     END_ROLLBACK = "END_ROLLBACK"       # The rollback of the migration plan ended
 
 class EventQueue:
-    def __init__(self):
+    """
+    Queue of the events of a migration, stored in Postgres. Events can be pushed from several threads.
+    Pushed events are appended to a local write-ahead log, then written to Postgres in batches by a background writer,
+    so that pushing never waits for the database. Events not yet written when the process stops are written by the next
+    queue that connects.
+    Delivery is at least once: when the process stops after a batch is committed but before its high-water mark is
+    saved, the rows of the batch are written again by the next queue. The duplicates are identical events, with the
+    same "createdAt"
+    """
+    def __init__(self, wal_path=EVENT_WAL):
         self._conn = None
         self._cursor = None
         self._migration_id = ""
+        self._lock = Lock()  # Serializes the use of the Postgres connection
+        self._wal_path = wal_path
+        self._wal = None
+        self._seq = 0        # Sequence number of the last row appended to the WAL
+        self._pending = []   # Rows appended to the WAL but not written to Postgres yet, in order
+        self._pending_changed = Condition()  # Guards the WAL, `_seq` and `_pending`
+        self._stopped = Event()
+        self._writer = None
 
     def connect(self):
         """
-        Connect to Postgres
+        Open the write-ahead log and start the background writer. The rows of the log not written to Postgres by a
+        previous queue are written first. The log is truncated after its last complete row, so that a row partially
+        written when the process stopped is not followed by new rows. Postgres is connected to by the writer, which
+        retries until it succeeds
         Raises:
-            EventQueueException: If connection could not be performed
+            EventQueueException: If the write-ahead log could not be opened
         """
         try:
-            db_host = env.get('DB_HOST')
-            db_port = env.get('DB_PORT')
-            db_name = env.get('DB_NAME')
-            db_username = env.get('DB_USERNAME')
-            db_password = env.get('DB_PASSWORD')
-            self._conn = postgres(
-                host=db_host,
-                port=db_port,
-                dbname=db_name,
-                user=db_username,
-                password=db_password
-            )
-            self._cursor = self._conn.cursor()
+            ack = _read_ack(self._wal_path)
+            rows = []
+            valid_size = 0  # Size of the complete rows at the start of the log, in bytes
+            if path_exists(self._wal_path):
+                with open(self._wal_path, "rb") as f:
+                    for line in f:
+                        try:
+                            if not line.endswith(b"\n"):
+                                raise ValueError("Incomplete line")
+                            rows.append(json_loads(line))
+                        except ValueError:
+                            # Line partially written when the process stopped: its push never returned
+                            break
+                        valid_size += len(line)
+            self._seq = max([ack] + [row["seq"] for row in rows])
+            self._pending = [row for row in rows if row["seq"] > ack]
+            self._wal = open(self._wal_path, "a")
+            self._wal.truncate(valid_size)
             self._migration_id = ""
         except Exception as e:
-            raise EventQueueException(f"Failed to connect to Postgres: {e}") from e
+            raise EventQueueException(f"Failed to open event log: {e}") from e
+        self._stopped.clear()
+        self._writer = Thread(target=self._write_rows, name="event-writer", daemon=True)
+        self._writer.start()
 
     def disconnect(self):
         """
-        Disconnect from Postgres
+        Write the pending events to Postgres, waiting at most `FLUSH_TIMEOUT` seconds, then disconnect from Postgres.
+        Events not written yet stay in the write-ahead log
         Raises:
             EventQueueException: If deconnection could not be performed
         """
-        if not self._conn or not self._cursor:
+        if not self._writer:
             raise EventQueueException(f"Postgres connection not established")
+        self.flush()
+        self._stopped.set()
+        with self._pending_changed:
+            self._pending_changed.notify_all()
+        self._writer.join()
+        self._writer = None
         try:
-            self._cursor.close()
-            self._conn.close()
+            self._wal.close()
+            with self._lock:
+                if self._conn:
+                    self._cursor.close()
+                    self._conn.close()
+                    self._conn = None
+                    self._cursor = None
         except Exception as e:
             raise EventQueueException(f"Failed to close Postgres connection: {e}") from e
 
     def push(self, event, is_rollback=False):
         """
-        Push an event to the queue
+        Push an event to the queue. The event is saved in the write-ahead log, and written to Postgres in the background
         Args:
             event (VMMigrationEvent | VMShutdownEvent | ServerShutdownEvent): The event to push to the queue
             is_rollback (bool): Whether the event occured during migration or rollback. Default to False for migration
         Raises:
-            EventQueueException: If push could not be performed
+            EventQueueException: If push could not be performed, or no migration has been started or rolled back
         """
-        if not self._conn or not self._cursor:
+        if not self._writer:
             raise EventQueueException(f"Postgres connection not established")
         if self._migration_id == "":
-            self._generate_migration_id()
-            if self._migration_id != "":
-                raise EventQueueException("No migration has been started")
+            raise EventQueueException("No migration has been started")
         if isinstance(event, MigrationErrorEvent):
             migration_id = f"error_{self._migration_id}"
         elif is_rollback:
             migration_id = f"rollback_{self._migration_id}"
         else:
             migration_id = f"migration_{self._migration_id}"
+        self._append_row(migration_id, serialize_event_type(event), serialize_event(event))
+
+    def push_error(self, event: MigrationErrorEvent, is_rollback=False):
+        """
+        Push the error that ended a plan. The error is logged instead when it can't be pushed, e.g. when the plan failed
+        before its migration was started, so that it is never lost
+        Args:
+            event (MigrationErrorEvent): The error to push to the queue
+            is_rollback (bool): Whether the error occured during migration or rollback. Default to False for migration
+        """
         try:
-            self._cursor.execute("""
-                INSERT INTO "history_event" (
-                    "entity", "entityId", "action", "metadata", "userAgent", "createdAt"
-                ) VALUES (
-                    'migration', %s, %s, %s, 'UPSTRA', %s
-                );
-                """, (migration_id, serialize_event_type(event), serialize_event(event), datetime.now())
-            )
-            self._conn.commit()
-        except Exception as e:
-            raise EventQueueException(f"Failed to push event to Redis: {e}")
+            self.push(event, is_rollback)
+        except EventQueueException as e:
+            logging.error(f"{event.title}: {event.message} (not saved: {e.message})")
 
-    def get_event_list(self):
+    def flush(self, timeout=FLUSH_TIMEOUT) -> bool:
         """
-        Get all events from the queue
+        Wait for the pending events to be written to Postgres
+        Args:
+            timeout (float): Maximum time to wait, in seconds
+        Returns:
+            bool: True if every event pushed has been written
+        """
+        with self._pending_changed:
+            self._pending_changed.notify_all()
+            return self._pending_changed.wait_for(lambda: not self._pending, timeout)
+
+    def _append_row(self, entity_id: str, action: str, metadata: str):
+        """
+        Append a row to the write-ahead log and queue it for Postgres
+        Args:
+            entity_id (str): The "entityId" of the row
+            action (str): The "action" of the row
+            metadata (str): The "metadata" of the row, or None
+        Raises:
+            EventQueueException: If the row could not be saved in the write-ahead log
+        """
+        with self._pending_changed:
+            row = {
+                "seq": self._seq + 1,
+                "entityId": entity_id,
+                "action": action,
+                "metadata": metadata,
+                "createdAt": datetime.now().isoformat(),
+            }
+            try:
+                self._wal.write(json_dumps(row) + "\n")
+                self._wal.flush()
+                fsync(self._wal.fileno())
+            except Exception as e:
+                raise EventQueueException(f"Failed to save event in event log: {e}") from e
+            self._seq = row["seq"]
+            self._pending.append(row)
+            if len(self._pending) >= WRITE_BATCH_SIZE:
+                self._pending_changed.notify_all()
+
+    def _write_rows(self):
+        """ Write the pending rows to Postgres in batches, every `WRITE_INTERVAL` seconds, until stopped """
+        while True:
+            with self._pending_changed:
+                if not self._stopped.is_set() and len(self._pending) < WRITE_BATCH_SIZE:
+                    self._pending_changed.wait(WRITE_INTERVAL)
+                batch = self._pending[:WRITE_BATCH_SIZE]
+            if batch:
+                try:
+                    self._insert_rows(batch)
+                except Exception as e:
+                    logging.error(f"Failed to write events to Postgres: {e}")
+                    if self._stopped.is_set():
+                        # The rows stay in the log, for the next queue
+                        return
+                    self._stopped.wait(WRITE_RETRY_DELAY)
+                    continue
+                with self._pending_changed:
+                    del self._pending[:len(batch)]
+                    try:
+                        _write_ack(self._wal_path, batch[-1]["seq"])
+                        if not self._pending:
+                            # Every row of the log is in Postgres
+                            self._wal.truncate(0)
+                    except OSError as e:
+                        logging.error(f"Failed to update event log: {e}")
+                    self._pending_changed.notify_all()
+            elif self._stopped.is_set():
+                return
+
+    def _insert_rows(self, rows: list[dict]):
+        """
+        Insert rows into Postgres in a single statement, connecting first if needed
+        Args:
+            rows (list[dict]): The rows of the write-ahead log to insert
+        Raises:
+            Exception: If the rows could not be inserted. The connection is reset
+        """
+        with self._lock:
+            try:
+                if not self._conn:
+                    self._connect_postgres()
+                execute_values(self._cursor, """
+                    INSERT INTO "history_event" (
+                        "entity", "entityId", "action", "metadata", "userAgent", "createdAt"
+                    ) VALUES %s;
+                    """,
+                    [(row["entityId"], row["action"], row["metadata"], datetime.fromisoformat(row["createdAt"])) for row in rows],
+                    template="('migration', %s, %s, %s, 'UPSTRA', %s)"
+                )
+                self._conn.commit()
+            except Exception:
+                self._reset_postgres()
+                raise
+
+    def _connect_postgres(self):
+        """ Connect to Postgres. Must be called with `_lock` held """
+        self._conn = postgres(
+            host=env.get('DB_HOST'),
+            port=env.get('DB_PORT'),
+            dbname=env.get('DB_NAME'),
+            user=env.get('DB_USERNAME'),
+            password=env.get('DB_PASSWORD')
+        )
+        self._cursor = self._conn.cursor()
+
+    def _reset_postgres(self):
+        """ Close the Postgres connection after an error, so that the next use reconnects. Must be called with `_lock` held """
+        try:
+            if self._conn:
+                self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+        self._cursor = None
+
+    def migration_interrupted(self) -> bool:
+        """
+        Check whether the execution of the saved migration plan was started and neither finished nor rolled back, i.e.
+        a previous run was interrupted halfway
+        Returns:
+            bool: True if the saved migration has a START_MIGRATION status and no later status
+        """
+        return path_exists(SAVED_MIGRATION_ID) and _read_migration_status() == MigrationStatus.START_MIGRATION.value
+
+    def get_event_list(self, rollback=False):
+        """
+        Get all events from the queue, latest first. Pending events are written to Postgres first
+        Args:
+            rollback (bool): Whether the events of the rollback are returned instead of the events of the migration
         Returns:
             (list[VMMigrationEvent | VMShutdownEvent | ServerShutdownEvent]): All events pushed to the queue
         Raises:
             EventQueueException: If no events could be pulled
         """
-        if not self._conn or not self._cursor:
+        if not self._writer:
             raise EventQueueException(f"Postgres connection not established")
         if self._migration_id == "":
             self._generate_migration_id()
             if self._migration_id == "":
                 raise EventQueueException("No migration has been started")
-        migration_id = "migration_" + self._migration_id
-        try:
-            self._cursor.execute("""
-                SELECT "action", "metadata" FROM "history_event" WHERE "entityId"=%s ORDER BY "createdAt" DESC
-            """, (migration_id,))
-            rows = self._cursor.fetchall()
-            return [deserialize_event(row[0], row[1]) for row in rows]
-        except Exception as e:
-            raise EventQueueException(f"Failed to get events from Redis: {e}")
+        if not self.flush():
+            raise EventQueueException("Failed to write pending events to Postgres")
+        migration_id = ("rollback_" if rollback else "migration_") + self._migration_id
+        with self._lock:
+            try:
+                if not self._conn:
+                    self._connect_postgres()
+                self._cursor.execute("""
+                    SELECT "action", "metadata" FROM "history_event" WHERE "entityId"=%s ORDER BY "createdAt" DESC
+                """, (migration_id,))
+                rows = self._cursor.fetchall()
+                return [deserialize_event(row[0], row[1]) for row in rows]
+            except Exception as e:
+                self._reset_postgres()
+                raise EventQueueException(f"Failed to get events from Redis: {e}")
 
     def _generate_migration_id(self):
         """ Generate migration id to save current migration events """
@@ -138,28 +322,35 @@ class EventQueue:
 
     def _delete_migration_id(self):
         """ Delete migration id """
-        if path_exists(SAVED_MIGRATION_ID):
-            remove_file(SAVED_MIGRATION_ID)
+        for path in (SAVED_MIGRATION_ID, SAVED_MIGRATION_STATUS):
+            if path_exists(path):
+                remove_file(path)
         self._migration_id = ""
 
+    def _save_migration_status(self, status: str):
+        """
+        Save the last status of the saved migration, to know whether a later run resumes it (see migration_interrupted())
+        Args:
+            status (str): The migration status
+        """
+        try:
+            with open(SAVED_MIGRATION_STATUS, "w") as f:
+                f.write(status)
+        except OSError as e:
+            logging.warning(f"Can't save the migration status: {e}")
+
     def _send_status(self, status):
         """
-        Send a migration status in log to notify of the current status of the migration
+        Send a migration status in log to notify of the current status of the migration. The status is written to
+        Postgres in the background, like events
         Args:
             status (str): The migration status
         Raises:
             EventQueueException: If status could not be sent
         """
-        if not self._conn or not self._cursor:
+        if not self._writer:
             raise EventQueueException(f"Postgres connection not established")
-        try:
-            self._cursor.execute("""
-                INSERT INTO "history_event" ("entity", "entityId", "action", "userAgent", "createdAt")
-                VALUES ('migration', 'migration_status', %s, 'UPSTRA', NOW());
-            """, (status,))
-            self._conn.commit()
-        except Exception as e:
-            raise EventQueueException(f"Failed to push {status} status to Postgres: {e}")
+        self._append_row('migration_status', status, None)
 
     def grace_shutdown(self):
         """
@@ -171,20 +362,28 @@ class EventQueue:
 
     def start_shutdown(self):
         """
-        Send a START_MIGRATION status in log to notify of the start of the execution of the migration plan
+        Send a START_MIGRATION status in log to notify of the start of the execution of the migration plan.
+        The events are added to the saved migration until it is rolled back, so that the rollback undoes every run of the
+        plan: a new migration id is only generated when there is no saved migration or it was rolled back
         Raises:
             EventQueueException: If status START_MIGRATION could not be sent
         """
         self._send_status(MigrationStatus.START_MIGRATION)
+        if _read_migration_status() == MigrationStatus.END_ROLLBACK.value:
+            self._delete_migration_id()
         self._generate_migration_id()
+        self._save_migration_status(MigrationStatus.START_MIGRATION.value)
 
     def finish_shutdown(self):
         """
-        Send a END_MIGRATION status in log to notify of the end of the execution of the migration plan
+        Send a END_MIGRATION status in log to notify of the end of the execution of the migration plan, and wait for the
+        events to be written to Postgres
         Raises:
             EventQueueException: If status END_MIGRATION could not be sent
         """
         self._send_status(MigrationStatus.END_MIGRATION)
+        self._save_migration_status(MigrationStatus.END_MIGRATION.value)
+        self.flush()
 
     def start_restart(self):
         """
@@ -193,6 +392,8 @@ class EventQueue:
             EventQueueException: If status START_ROLLBACK could not be sent
         """
         self._send_status(MigrationStatus.START_ROLLBACK)
+        self._generate_migration_id()
+        self._save_migration_status(MigrationStatus.START_ROLLBACK.value)
 
     def finish_restart(self):
         """
@@ -201,4 +402,48 @@ class EventQueue:
             EventQueueException: If status END_ROLLBACK could not be sent
         """
         self._send_status(MigrationStatus.END_ROLLBACK)
+        # Saved first, so that the next migration gets a new id even if the saved one can't be deleted
+        self._save_migration_status(MigrationStatus.END_ROLLBACK.value)
+        self.flush()
         self._delete_migration_id()
+
+
+def _read_migration_status() -> str:
+    """
+    Read the last status of the saved migration
+    Returns:
+        str: The migration status, or None if there is none
+    """
+    try:
+        with open(SAVED_MIGRATION_STATUS, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _read_ack(wal_path: str) -> int:
+    """
+    Read the high-water mark of a write-ahead log: the sequence number of the last row written to Postgres
+    Args:
+        wal_path (str): The path of the write-ahead log
+    Returns:
+        int: The sequence number, 0 if no row was ever written
+    """
+    try:
+        with open(f"{wal_path}.ack", "r") as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return 0
+
+def _write_ack(wal_path: str, seq: int):
+    """
+    Save the high-water mark of a write-ahead log
+    Args:
+        wal_path (str): The path of the write-ahead log
+        seq (int): The sequence number of the last row written to Postgres
+    """
+    tmp_path = f"{wal_path}.ack.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(str(seq))
+        f.flush()
+        fsync(f.fileno())
+    replace_file(tmp_path, f"{wal_path}.ack")
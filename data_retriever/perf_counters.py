@@ -0,0 +1,70 @@
+from pyVmomi import vim
+
+
+# Performance counter ("group.name.rollup"): (name of the metric in the cached metrics, divisor applied to the raw value)
+PERF_COUNTERS = {
+    "cpu.usage.average": ("perfCpuUsagePercent", 100),  # Reported in hundredths of a percent
+    "cpu.ready.summation": ("perfCpuReadyMs", 1),
+    "mem.active.average": ("perfMemActiveKB", 1),
+    "net.usage.average": ("perfNetUsageKBps", 1),
+    "disk.usage.average": ("perfDiskUsageKBps", 1),
+    "disk.maxTotalLatency.latest": ("perfDiskLatencyMs", 1),
+}
+REALTIME_INTERVAL = 20  # Sampling period of the real-time statistics, in seconds
+QUERY_BATCH_SIZE = 100  # Maximum number of entities queried by a single QueryPerf call
+
+
+class PerfCollector:
+    """ Collect the latest real-time performance counters of many entities with batched QueryPerf calls """
+    def __init__(self, content: vim.ServiceInstanceContent):
+        self._perf_manager = content.perfManager
+        self._counters = None  # Metric name and divisor of each counter, by counter id
+
+    def collect(self, entities: list) -> dict[str, dict]:
+        """
+        Get the latest real-time value of the counters of `PERF_COUNTERS` for the given entities.
+        Only powered on VMs and hosts have real-time statistics
+        Args:
+            entities (list): The VMs and hosts to query
+        Returns:
+            dict[str, dict]: The value of each available metric, by Managed Object ID of the entity
+        """
+        counters = self._resolve_counters()
+        if not counters or not entities:
+            return {}
+        metric_ids = [vim.PerformanceManager.MetricId(counterId=counter_id, instance="") for counter_id in counters]
+
+        results = {}
+        for i in range(0, len(entities), QUERY_BATCH_SIZE):
+            query_specs = [
+                vim.PerformanceManager.QuerySpec(
+                    entity=entity,
+                    metricId=metric_ids,
+                    intervalId=REALTIME_INTERVAL,
+                    maxSample=1,
+                    format="normal"
+                ) for entity in entities[i:i + QUERY_BATCH_SIZE]
+            ]
+            for entity_metric in self._perf_manager.QueryPerf(querySpec=query_specs) or []:
+                values = {}
+                for series in entity_metric.value:
+                    if series.id.counterId in counters and series.value:
+                        name, divisor = counters[series.id.counterId]
+                        values[name] = series.value[-1] / divisor
+                results[entity_metric.entity._moId] = values
+        return results
+
+    def _resolve_counters(self) -> dict[int, tuple[str, int]]:
+        """
+        Resolve the ids of the counters of `PERF_COUNTERS`. Ids are resolved once per collector
+        Returns:
+            dict[int, tuple[str, int]]: The metric name and divisor of each counter, by counter id
+        """
+        if self._counters is None:
+            counters = {}
+            for counter in self._perf_manager.perfCounter:
+                full_name = f"{counter.groupInfo.key}.{counter.nameInfo.key}.{counter.rollupType}"
+                if full_name in PERF_COUNTERS:
+                    counters[counter.key] = PERF_COUNTERS[full_name]
+            self._counters = counters
+        return self._counters
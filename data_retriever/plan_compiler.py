@@ -0,0 +1,161 @@
+from dataclasses import asdict, fields
+from hashlib import sha256
+from json import dumps as json_dumps, loads as json_loads
+from os import replace as replace_file, open as open_file, fdopen, O_WRONLY, O_CREAT, O_TRUNC
+import logging
+
+from data_retriever.decrypt_password import encrypt, decrypt
+from data_retriever.vm_ware_connection import VMwareConnection
+from data_retriever.yaml_parser import VCenter, UpsGrace, Servers, Server, Host, IloYaml, load_plan_from_yaml
+
+
+COMPILED_PLAN_SUFFIX = ".compiled"  # The compiled plan of `plans/migration.yml` is `plans/migration.yml.compiled`
+
+
+class PlanCompilationException(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+def compile_plan(file_path: str, resolve=True) -> tuple[VCenter, UpsGrace, Servers]:
+    """
+    Parse and validate a migration plan, and store it encrypted next to its YAML file, ready to be loaded by load_plan()
+    Args:
+        file_path (str): The path to the migration plan
+        resolve (bool): Whether every server and VM of the plan is checked against the vCenter
+    Returns:
+        tuple[VCenter, UpsGrace, Servers]: The migration plan (see load_plan_from_yaml())
+    Raises:
+        PlanCompilationException: If servers or VMs of the plan are missing from the vCenter
+        vim.fault.InvalidLogin: If the credentials of the vCenter are invalid
+        Exception: For any error raised by load_plan_from_yaml()
+    """
+    with open(file_path, 'rb') as f:
+        plan_hash = sha256(f.read()).hexdigest()
+    vcenter, ups_grace, servers = load_plan_from_yaml(file_path)
+    if resolve:
+        _resolve_plan(vcenter, servers)
+    _save_compiled_plan(file_path, plan_hash, vcenter, ups_grace, servers)
+    return vcenter, ups_grace, servers
+
+
+def load_plan(file_path: str) -> tuple[VCenter, UpsGrace, Servers]:
+    """
+    Load a migration plan from its compiled form, or compile it without checking it against the vCenter if it has
+    changed since it was last compiled, or if it was compiled by a version with other plan fields. The plan is still returned when its compiled form can't be saved, e.g. on a
+    read-only or full disk
+    Args:
+        file_path (str): The path to the migration plan
+    Returns:
+        tuple[VCenter, UpsGrace, Servers]: The migration plan (see load_plan_from_yaml())
+    Raises:
+        Exception: For any error raised by load_plan_from_yaml()
+    """
+    with open(file_path, 'rb') as f:
+        plan_hash = sha256(f.read()).hexdigest()
+    try:
+        with open(file_path + COMPILED_PLAN_SUFFIX, "r") as f:
+            data = json_loads(decrypt(f.read().strip()))
+        if data["hash"] == plan_hash and _has_current_fields(data):
+            return VCenter(**data["vCenter"]), UpsGrace(**data["ups"]), _servers_from_dict(data["servers"])
+    except Exception:
+        # Missing, unreadable or outdated compiled plan
+        pass
+    vcenter, ups_grace, servers = load_plan_from_yaml(file_path)
+    try:
+        _save_compiled_plan(file_path, plan_hash, vcenter, ups_grace, servers)
+    except Exception as e:
+        logging.warning(f"Can't save the compiled plan of {file_path}: {e}")
+    return vcenter, ups_grace, servers
+
+
+def _save_compiled_plan(file_path: str, plan_hash: str, vcenter: VCenter, ups_grace: UpsGrace, servers: Servers):
+    """
+    Store a migration plan encrypted next to its YAML file
+    Args:
+        file_path (str): The path to the migration plan
+        plan_hash (str): The sha256 of the YAML file, to detect changes of the plan
+        vcenter (VCenter): The vCenter of the plan
+        ups_grace (UpsGrace): The grace periods of the plan
+        servers (Servers): The migration plan for each server
+    Raises:
+        OSError: If the compiled plan could not be written
+        ValueError: If ENCRYPTION_KEY is not set
+    """
+    data = {
+        "hash": plan_hash,
+        "vCenter": asdict(vcenter),
+        "ups": asdict(ups_grace),
+        "servers": asdict(servers),
+    }
+    path = file_path + COMPILED_PLAN_SUFFIX
+    tmp_path = f"{path}.tmp"
+    with fdopen(open_file(tmp_path, O_WRONLY | O_CREAT | O_TRUNC, 0o600), "w") as f:
+        f.write(encrypt(json_dumps(data)))
+    replace_file(tmp_path, path)
+
+
+def _resolve_plan(vcenter: VCenter, servers: Servers):
+    """
+    Check that every server, distant server and VM of a migration plan exists in the vCenter
+    Args:
+        vcenter (VCenter): The vCenter of the plan
+        servers (Servers): The migration plan for each server
+    Raises:
+        PlanCompilationException: If servers or VMs are missing from the vCenter
+        vim.fault.InvalidLogin: If the credentials of the vCenter are invalid
+    """
+    conn = VMwareConnection()
+    try:
+        conn.connect(vcenter.ip, vcenter.user, vcenter.password, vcenter.port)
+        missing = []
+        for server in servers.servers:
+            for host in (server.host, server.destination):
+                if host and not conn.get_host_system(host.moid):
+                    missing.append(f"server '{host.name}' ({host.moid})")
+            missing += [f"VM {vm_moid}" for vm_moid in server.vm_order if not conn.get_vm(vm_moid)]
+    finally:
+        conn.disconnect()
+    if missing:
+        raise PlanCompilationException(f"Not found in the vCenter: {', '.join(missing)}")
+
+
+def _has_current_fields(data: dict) -> bool:
+    """
+    Check that a compiled plan has the fields of the current plan classes. A plan compiled before fields were added
+    would get their default values instead of those of its YAML file
+    Args:
+        data (dict): The compiled plan
+    Returns:
+        bool: True if every object of the plan has the fields of its class
+    """
+    def same_fields(cls, obj_data: dict) -> bool:
+        return set(obj_data) == {field.name for field in fields(cls)}
+
+    servers = data["servers"]["servers"]
+    hosts = [host for server in servers for host in (server["host"], server["destination"]) if host]
+    return (
+        same_fields(VCenter, data["vCenter"])
+        and same_fields(UpsGrace, data["ups"])
+        and same_fields(Servers, data["servers"])
+        and all(same_fields(Server, server) for server in servers)
+        and all(same_fields(Host, host) and same_fields(IloYaml, host["ilo"]) for host in hosts)
+    )
+
+
+def _servers_from_dict(data: dict) -> Servers:
+    """
+    Rebuild the `Servers` object of a compiled plan
+    Args:
+        data (dict): The `Servers` object converted with asdict()
+    Returns:
+        Servers: The migration plan for each server
+    """
+    def host(host_data):
+        return Host(host_data["name"], host_data["moid"], IloYaml(**host_data["ilo"])) if host_data else None
+
+    servers = [
+        Server(**{**server, "host": host(server["host"]), "destination": host(server["destination"])})
+        for server in data["servers"]
+    ]
+    return Servers(**{**data, "servers": servers})
@@ -0,0 +1,129 @@
+from dataclasses import dataclass, field
+from pyVmomi import vim, vmodl
+
+
+MAX_OBJECT_UPDATES = 500
+
+
+def container_filter_spec(view: vim.view.ContainerView, obj_type, properties: list[str]) -> vmodl.query.PropertyCollector.FilterSpec:
+    """
+    Build a PropertyCollector filter selecting properties of every object of a ContainerView
+    Args:
+        view (vim.view.ContainerView): The view containing the objects
+        obj_type (type): The managed object type of the objects
+        properties (list[str]): The property paths to select
+    Returns:
+        vmodl.query.PropertyCollector.FilterSpec: The filter specification
+    """
+    traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+        name="traverseView",
+        path="view",
+        skip=False,
+        type=vim.view.ContainerView
+    )
+    object_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal_spec])
+    property_spec = vmodl.query.PropertyCollector.PropertySpec(type=obj_type, pathSet=properties, all=False)
+    return vmodl.query.PropertyCollector.FilterSpec(objectSet=[object_spec], propSet=[property_spec])
+
+
+@dataclass
+class PropertyUpdate:
+    obj: vim.ManagedEntity
+    moid: str
+    kind: str                                    # "enter", "modify" or "leave"
+    changes: dict = field(default_factory=dict)  # New value of each property path set or modified
+    removed: list[str] = field(default_factory=list)
+
+
+class PropertyWatcher:
+    """
+    Follow the changes of properties of managed objects with WaitForUpdatesEx.
+    Each watcher uses its own PropertyCollector, so several watchers can wait for updates at the same time on a connection.
+    Filters are created without partial updates: a change of a data object property (e.g. "summary.quickStats") is
+    reported with the whole new value under the watched path, never under nested paths
+    """
+    def __init__(self, content: vim.ServiceInstanceContent):
+        self._content = content
+        self._collector = content.propertyCollector.CreatePropertyCollector()
+        self._version = ""
+        self._views = {}
+
+    def watch_container(self, obj_type, properties: list[str]) -> vmodl.query.PropertyCollector.Filter:
+        """
+        Watch properties of every object of a type in the vCenter, including objects created later
+        Args:
+            obj_type (type): The managed object type to watch (e.g. vim.VirtualMachine)
+            properties (list[str]): The property paths to watch
+        Returns:
+            vmodl.query.PropertyCollector.Filter: The filter of the watch, to give to unwatch()
+        """
+        view = self._content.viewManager.CreateContainerView(self._content.rootFolder, [obj_type], True)
+        filter_spec = container_filter_spec(view, obj_type, properties)
+        property_filter = self._collector.CreateFilter(filter_spec, partialUpdates=False)
+        self._views[property_filter] = view
+        return property_filter
+
+    def watch_objects(self, objects: list, obj_type, properties: list[str]) -> vmodl.query.PropertyCollector.Filter:
+        """
+        Watch properties of the given objects
+        Args:
+            objects (list): The managed objects to watch
+            obj_type (type): The managed object type of the objects (e.g. vim.HostSystem)
+            properties (list[str]): The property paths to watch
+        Returns:
+            vmodl.query.PropertyCollector.Filter: The filter of the watch, to give to unwatch()
+        """
+        object_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=obj, skip=False) for obj in objects]
+        property_spec = vmodl.query.PropertyCollector.PropertySpec(type=obj_type, pathSet=properties, all=False)
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=object_specs, propSet=[property_spec])
+        return self._collector.CreateFilter(filter_spec, partialUpdates=False)
+
+    def unwatch(self, property_filter: vmodl.query.PropertyCollector.Filter):
+        """
+        Stop a watch
+        Args:
+            property_filter (vmodl.query.PropertyCollector.Filter): The filter returned by watch_container() or watch_objects()
+        """
+        property_filter.Destroy()
+        view = self._views.pop(property_filter, None)
+        if view:
+            view.Destroy()
+
+    def wait_for_updates(self, max_wait_seconds: int) -> list[PropertyUpdate]:
+        """
+        Wait for changes of the watched properties. The first call after a watch returns the current value of every watched property
+        Args:
+            max_wait_seconds (int): The maximum time to wait for a change, in seconds
+        Returns:
+            list[PropertyUpdate]: The changes since the previous call, or an empty list if nothing changed before the timeout
+        """
+        options = vmodl.query.PropertyCollector.WaitOptions(
+            maxWaitSeconds=max_wait_seconds,
+            maxObjectUpdates=MAX_OBJECT_UPDATES
+        )
+        updates = []
+        update_set = self._collector.WaitForUpdatesEx(self._version, options)
+        while update_set:
+            self._version = update_set.version
+            for filter_update in update_set.filterSet:
+                for object_update in filter_update.objectSet:
+                    update = PropertyUpdate(object_update.obj, object_update.obj._moId, object_update.kind)
+                    for change in object_update.changeSet:
+                        if change.op in ("remove", "indirectRemove"):
+                            update.removed.append(change.name)
+                        else:
+                            update.changes[change.name] = change.val
+                    updates.append(update)
+            if not update_set.truncated:
+                break
+            # More updates are pending: fetch them without waiting
+            options.maxWaitSeconds = 0
+            update_set = self._collector.WaitForUpdatesEx(self._version, options)
+        return updates
+
+    def destroy(self):
+        """ Stop every watch and release the PropertyCollector of the watcher """
+        for view in self._views.values():
+            view.Destroy()
+        self._views = {}
+        self._collector.Destroy()
@@ -0,0 +1,83 @@
+from dataclasses import dataclass
+from time import time, sleep
+from typing import Callable
+import logging
+
+
+@dataclass
+class _Job:
+    name: str
+    interval: float
+    callback: Callable[[float], None]
+    next_run: float
+
+
+class Scheduler:
+    """
+    Run jobs at fixed wall-clock intervals. Ticks are aligned on multiples of the interval of each job, so they don't drift
+    with the duration of the jobs. When a job overruns its next ticks, the missed ticks are skipped and reported instead of queued
+    """
+    def __init__(self, on_overrun: Callable[[str, int], None] = None):
+        """
+        Args:
+            on_overrun (Callable[[str, int], None]): Called with the name of a job and the number of ticks it missed when
+                it overruns. Default to logging a warning
+        """
+        self._jobs = []
+        self._on_overrun = on_overrun if on_overrun else _log_overrun
+
+    def add_job(self, name: str, interval: float, callback: Callable[[float], None]):
+        """
+        Add a job, run at once then on every multiple of its interval
+        Args:
+            name (str): The name of the job, for overrun reports
+            interval (float): The interval between two runs, in seconds
+            callback (Callable[[float], None]): The job, called with the scheduled time of the tick in seconds since the epoch
+        """
+        self._jobs.append(_Job(name, interval, callback, time()))
+
+    def delay(self) -> float:
+        """
+        Get the time until the next tick
+        Returns:
+            float: The number of seconds until the next tick, 0 if a job is due
+        """
+        if not self._jobs:
+            return 0
+        return max(0.0, min(job.next_run for job in self._jobs) - time())
+
+    def run_pending(self):
+        """ Run every due job, in the order they were added """
+        for job in self._jobs:
+            now = time()
+            if now < job.next_run:
+                continue
+            tick = job.next_run
+            job.callback(tick)
+
+            now = time()
+            next_run = tick - tick % job.interval + job.interval
+            missed = 0
+            if now >= next_run:
+                missed = int((now - next_run) // job.interval) + 1
+                next_run += missed * job.interval
+                self._on_overrun(job.name, missed)
+            elif next_run - now > job.interval:
+                # The clock went backwards
+                next_run = now
+            job.next_run = next_run
+
+    def run(self, should_stop: Callable[[], bool]):
+        """
+        Run the jobs until `should_stop` returns True
+        Args:
+            should_stop (Callable[[], bool]): Checked after each round of jobs
+        """
+        while not should_stop():
+            sleep(self.delay())
+            self.run_pending()
+
+
+def _log_overrun(name: str, missed: int):
+    """ Report an overrun as a warning """
+    logging.warning(f"Job '{name}' overran its interval, {missed} tick(s) skipped")
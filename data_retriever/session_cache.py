@@ -0,0 +1,94 @@
+from dataclasses import dataclass
+from json import dumps as json_dumps, loads as json_loads
+from dotenv import load_dotenv
+from os import environ as env, makedirs, replace as replace_file, remove as remove_file, open as open_file, fdopen, \
+    O_WRONLY, O_CREAT, O_TRUNC
+from os.path import exists as path_exists, join as path_join
+
+from data_retriever.decrypt_password import encrypt, decrypt, keyed_hash
+
+load_dotenv()
+
+SESSION_CACHE_DIR = env.get('SESSION_CACHE_DIR', '.sessions')
+
+
+@dataclass
+class CachedSession:
+    cookie: str
+    version: str
+
+
+def session_key(host: str, port: int, user: str, password: str) -> str:
+    """
+    Compute the key of a vCenter session. The password is part of the key so that a session is only reused with valid
+    credentials. The key names the file of the session, so it is keyed by ENCRYPTION_KEY: the password can't be
+    brute-forced from the file name
+    Args:
+        host (str): The IP address or hostname of the vCenter
+        port (int): The port of the vCenter
+        user (str): The username of the session
+        password (str): The password of the user
+    Returns:
+        str: The hexadecimal key of the session
+    Raises:
+        ValueError: If ENCRYPTION_KEY is not set
+    """
+    return keyed_hash(f"{host}:{port}:{user}:{password}")
+
+
+class SessionCache:
+    """ Store vCenter session cookies on disk, encrypted, so that sessions can be reused across processes """
+    def __init__(self, directory=SESSION_CACHE_DIR):
+        self._directory = directory
+
+    def get(self, key: str) -> CachedSession:
+        """
+        Get a cached session
+        Args:
+            key (str): The key of the session (see session_key())
+        Returns:
+            CachedSession: The cached session, or None if there is none or it can't be read
+        """
+        path = self._path(key)
+        if not path_exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                obj = json_loads(decrypt(f.read().strip()))
+            return CachedSession(obj["cookie"], obj["version"])
+        except Exception:
+            self.delete(key)
+            return None
+
+    def set(self, key: str, session: CachedSession):
+        """
+        Cache a session. Caching is best effort: errors are ignored
+        Args:
+            key (str): The key of the session (see session_key())
+            session (CachedSession): The session to cache
+        """
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            makedirs(self._directory, mode=0o700, exist_ok=True)
+            data = encrypt(json_dumps(session.__dict__))
+            with fdopen(open_file(tmp_path, O_WRONLY | O_CREAT | O_TRUNC, 0o600), "w") as f:
+                f.write(data)
+            replace_file(tmp_path, path)
+        except Exception:
+            pass
+
+    def delete(self, key: str):
+        """
+        Remove a session from the cache
+        Args:
+            key (str): The key of the session (see session_key())
+        """
+        try:
+            remove_file(self._path(key))
+        except OSError:
+            pass
+
+    def _path(self, key: str) -> str:
+        """ Get the path of the file storing a session """
+        return path_join(self._directory, key)
@@ -0,0 +1,191 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import Callable
+
+
+def topological_order(dependencies: dict[str, list[str]]) -> list[str]:
+    """
+    Sort the nodes of a dependency graph so that every node comes after its dependencies. Independent nodes keep the
+    order of `dependencies`
+    Args:
+        dependencies (dict[str, list[str]]): The dependencies of each node
+    Returns:
+        list[str]: The nodes in topological order
+    Raises:
+        ValueError: If a dependency is not a node of the graph, or if the graph has a cycle
+    """
+    remaining = {}
+    dependents = {node: [] for node in dependencies}
+    for node, depends_on in dependencies.items():
+        for dependency in depends_on:
+            if dependency not in dependencies:
+                raise ValueError(f"'{node}' depends on unknown '{dependency}'")
+            dependents[dependency].append(node)
+        remaining[node] = len(set(depends_on))
+
+    order = [node for node, count in remaining.items() if count == 0]
+    for node in order:
+        for dependent in set(dependents[node]):
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                order.append(dependent)
+    if len(order) != len(dependencies):
+        cycle = [node for node, count in remaining.items() if count > 0]
+        raise ValueError(f"Dependency cycle between {', '.join(cycle)}")
+    return order
+
+
+@dataclass
+class _Task:
+    name: str
+    callback: Callable[[], None]
+    depends_on: list[str]
+    priority: tuple
+    pools: tuple[str, ...]
+    group: str
+    start: float = None
+    end: float = None
+    dependents: list[str] = field(default_factory=list)
+
+
+class TaskGraph:
+    """
+    Run tasks as soon as their dependencies are done, independent tasks running concurrently.
+    When several tasks are ready, they are started by priority. A task only starts when every pool it uses has room
+    for it, and when it belongs to one of at most `max_groups` groups in progress
+    """
+    def __init__(self, max_groups: int = None, on_task_done: Callable[[str], None] = None):
+        """
+        Args:
+            max_groups (int): Maximum number of groups whose tasks are in progress at the same time, None for no limit
+            on_task_done (Callable[[str], None]): Called with the name of each task once it is done
+        """
+        self._tasks = {}
+        self._pool_limits = {}
+        self._max_groups = max_groups
+        self._on_task_done = on_task_done
+
+    def add_task(self, name: str, callback: Callable[[], None], depends_on=(), priority=(), pools=(), group: str = None):
+        """
+        Add a task to the graph
+        Args:
+            name (str): The unique name of the task
+            callback (Callable[[], None]): The task
+            depends_on (Iterable[str]): The names of the tasks that must be done before this task starts
+            priority (tuple): Tasks with lower priorities start first, tasks of same priority start in the order they were added
+            pools (Iterable[str]): The pools the task uses while it runs (see set_pool_limit())
+            group (str): The group of the task, if any
+        Raises:
+            ValueError: If a task with the same name already exists
+        """
+        if name in self._tasks:
+            raise ValueError(f"Task '{name}' already exists")
+        self._tasks[name] = _Task(name, callback, list(depends_on), tuple(priority), tuple(pools), group)
+
+    def set_pool_limit(self, pool: str, limit: int):
+        """
+        Limit the number of tasks of a pool running at the same time. Pools have no limit by default
+        Args:
+            pool (str): The name of the pool
+            limit (int): The maximum number of tasks of the pool running at the same time
+        """
+        self._pool_limits[pool] = max(limit, 1)
+
+    def run(self, max_workers: int):
+        """
+        Run every task of the graph. A task that raises doesn't stop the other ones, nor its dependents
+        Args:
+            max_workers (int): Maximum number of threads running tasks
+        Raises:
+            ValueError: If a dependency is unknown or if the graph has a cycle
+            Exception: The first exception raised by a task, once every task is done
+        """
+        topological_order({name: task.depends_on for name, task in self._tasks.items()})
+        remaining = {}
+        group_remaining = {}
+        for name, task in self._tasks.items():
+            remaining[name] = len(set(task.depends_on))
+            for dependency in set(task.depends_on):
+                self._tasks[dependency].dependents.append(name)
+            if task.group is not None:
+                group_remaining[task.group] = group_remaining.get(task.group, 0) + 1
+
+        sequence = {name: i for i, name in enumerate(self._tasks)}
+        ready = [name for name, count in remaining.items() if count == 0]
+        running = {}
+        pool_usage = {}
+        active_groups = set()
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix="task") as executor:
+            while ready or running:
+                ready.sort(key=lambda name: (self._tasks[name].priority, sequence[name]))
+                for name in list(ready):
+                    task = self._tasks[name]
+                    if not self._can_start(task, pool_usage, active_groups, force=not running):
+                        continue
+                    ready.remove(name)
+                    for pool in task.pools:
+                        pool_usage[pool] = pool_usage.get(pool, 0) + 1
+                    if task.group is not None:
+                        active_groups.add(task.group)
+                    task.start = monotonic()
+                    running[executor.submit(task.callback)] = task
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    task.end = monotonic()
+                    if future.exception():
+                        errors.append(future.exception())
+                    if self._on_task_done:
+                        self._on_task_done(task.name)
+                    for pool in task.pools:
+                        pool_usage[pool] -= 1
+                    if task.group is not None:
+                        group_remaining[task.group] -= 1
+                        if group_remaining[task.group] == 0:
+                            active_groups.discard(task.group)
+                    for dependent in task.dependents:
+                        remaining[dependent] -= 1
+                        if remaining[dependent] == 0:
+                            ready.append(dependent)
+        if errors:
+            raise errors[0]
+
+    def critical_path(self) -> list[tuple[str, float]]:
+        """
+        Get the observed critical path of the last run: the chain of dependencies that ends with the last task done,
+        each task being preceded by its dependency done last
+        Returns:
+            list[tuple[str, float]]: The name and duration in seconds of each task of the path, in execution order
+        """
+        done = [task for task in self._tasks.values() if task.end is not None]
+        if not done:
+            return []
+        path = []
+        task = max(done, key=lambda t: t.end)
+        while task:
+            path.append((task.name, task.end - task.start))
+            dependencies = [self._tasks[name] for name in task.depends_on if self._tasks[name].end is not None]
+            task = max(dependencies, key=lambda t: t.end) if dependencies else None
+        return path[::-1]
+
+    def _can_start(self, task: _Task, pool_usage: dict[str, int], active_groups: set[str], force: bool) -> bool:
+        """
+        Check whether a ready task can start
+        Args:
+            task (_Task): The ready task
+            pool_usage (dict[str, int]): The number of running tasks, by pool
+            active_groups (set[str]): The groups in progress
+            force (bool): Whether no task is running. The group limit is then ignored, since the groups in progress
+                may be waiting for a task of another group
+        Returns:
+            bool: True if the task can start
+        """
+        for pool in task.pools:
+            if pool in self._pool_limits and pool_usage.get(pool, 0) >= self._pool_limits[pool]:
+                return False
+        if task.group is None or task.group in active_groups or force or self._max_groups is None:
+            return True
+        return len(active_groups) < self._max_groups
@@ -0,0 +1,216 @@
+from concurrent.futures import Future
+from dataclasses import dataclass
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Callable
+from pyVmomi import vim, vmodl
+from pyVim.task import WaitForTask
+import logging
+
+from data_retriever.property_watcher import PropertyWatcher
+
+
+UPDATE_WAIT = 1          # Maximum duration of a wait for updates, so that timeouts are checked often enough, in seconds
+UPDATE_RETRY_DELAY = 5   # Delay before waiting for updates again after an error, in seconds
+MAX_UPDATE_ERRORS = 3    # Number of consecutive errors of the update stream after which the pending tasks fail
+TASK_TIMEOUT = 900       # Maximum time the plans and batches wait for a VM task, in seconds
+TASK_PROPERTIES = ["info.state", "info.error", "info.progress"]
+
+
+@dataclass
+class _TrackedTask:
+    task: vim.Task
+    future: Future
+    property_filter: vmodl.query.PropertyCollector.Filter
+    deadline: float = None
+    on_progress: Callable[[int], None] = None
+
+
+class TaskMonitor:
+    """
+    Wait for many vCenter tasks at once. The state of every task tracked is followed with a single PropertyWatcher in
+    the background, instead of a thread polling each task (see pyVim.task.WaitForTask())
+    """
+    def __init__(self, watcher: PropertyWatcher):
+        """
+        Args:
+            watcher (PropertyWatcher): The watcher to follow the tasks with, destroyed by stop()
+        """
+        self._watcher = watcher
+        self._tasks = {}  # Tracked tasks, by moid
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread = None
+
+    def start(self):
+        """ Start following the tracked tasks """
+        self._stopped.clear()
+        self._thread = Thread(target=self._follow, name="task-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop following the tasks and destroy the watcher. The futures of the pending tasks are cancelled """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            tracked_tasks = list(self._tasks.values())
+            self._tasks = {}
+        for tracked in tracked_tasks:
+            tracked.future.cancel()
+        self._watcher.destroy()
+
+    def track(self, task: vim.Task, timeout: float = None, on_progress: Callable[[int], None] = None) -> Future:
+        """
+        Follow a task until it ends
+        Args:
+            task (vim.Task): The task to follow
+            timeout (float): Maximum time to wait for the task, in seconds, None for no limit. The task itself goes on
+            on_progress (Callable[[int], None]): Called with the progress of the task, in percent, each time it changes
+        Returns:
+            Future: Resolved with None when the task succeeds, or with the fault of the task when it fails, or with a
+                TimeoutError when it is not done within `timeout`
+        """
+        future = Future()
+        deadline = monotonic() + timeout if timeout is not None else None
+        tracked = _TrackedTask(task, future, None, deadline, on_progress)
+        # Tracked before the filter is created, since its first update may come right away: it gives the current state
+        # of the task, even if it is already done
+        with self._lock:
+            self._tasks[task._moId] = tracked
+        try:
+            property_filter = self._watcher.watch_objects([task], vim.Task, TASK_PROPERTIES)
+        except Exception as e:
+            self._finish(tracked, e)
+            return future
+        with self._lock:
+            tracked.property_filter = property_filter
+            done = task._moId not in self._tasks
+        if done:
+            self._watcher.unwatch(property_filter)
+        return future
+
+    def _follow(self):
+        """
+        Resolve the futures of the tasks as they end or time out, until stopped. When the update stream fails
+        `MAX_UPDATE_ERRORS` times in a row (e.g. expired session), the pending tasks fail with the last error
+        """
+        errors = 0
+        while not self._stopped.is_set():
+            try:
+                updates = self._watcher.wait_for_updates(UPDATE_WAIT)
+                errors = 0
+            except Exception as e:
+                logging.error(f"Can't follow the vCenter tasks: {e}")
+                errors += 1
+                if errors >= MAX_UPDATE_ERRORS:
+                    with self._lock:
+                        pending = list(self._tasks.values())
+                    for tracked in pending:
+                        self._finish(tracked, e)
+                self._stopped.wait(UPDATE_RETRY_DELAY)
+                updates = []
+            for update in updates:
+                with self._lock:
+                    tracked = self._tasks.get(update.moid)
+                if not tracked:
+                    continue
+                try:
+                    self._update(tracked, update.changes)
+                except Exception as e:
+                    logging.error(f"Can't handle the update of task {update.moid}: {e}")
+                    self._finish(tracked, e)
+            now = monotonic()
+            with self._lock:
+                timed_out = [tracked for tracked in self._tasks.values() if tracked.deadline is not None and tracked.deadline <= now]
+            for tracked in timed_out:
+                self._finish(tracked, TimeoutError(f"Task {tracked.task._moId} is not done yet"))
+
+    def _update(self, tracked: _TrackedTask, changes: dict):
+        """
+        Handle the changes of the properties of a tracked task
+        Args:
+            tracked (_TrackedTask): The task
+            changes (dict): The new value of each property changed
+        """
+        if "info.progress" in changes and tracked.on_progress and changes["info.progress"] is not None:
+            try:
+                tracked.on_progress(changes["info.progress"])
+            except Exception as e:
+                logging.warning(f"Progress callback of task {tracked.task._moId} failed: {e}")
+        state = changes.get("info.state")
+        if state == vim.TaskInfo.State.success:
+            self._finish(tracked)
+        elif state == vim.TaskInfo.State.error:
+            error = changes.get("info.error") or tracked.task.info.error
+            self._finish(tracked, error if isinstance(error, Exception) else RuntimeError(str(error)))
+
+    def _finish(self, tracked: _TrackedTask, error: Exception = None):
+        """
+        Stop following a task and resolve its future
+        Args:
+            tracked (_TrackedTask): The task
+            error (Exception): The error of the task, None if it succeeded
+        """
+        with self._lock:
+            if self._tasks.pop(tracked.task._moId, None) is None:
+                return
+            property_filter = tracked.property_filter
+        if property_filter:
+            try:
+                self._watcher.unwatch(property_filter)
+            except Exception as e:
+                logging.warning(f"Can't stop following task {tracked.task._moId}: {e}")
+        if tracked.future.cancelled():
+            return
+        if error:
+            tracked.future.set_exception(error)
+        else:
+            tracked.future.set_result(None)
+
+
+def resolved(result) -> Future:
+    """
+    Get a future already resolved
+    Args:
+        result: The result of the future
+    Returns:
+        Future: The future, resolved with `result`
+    """
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def wait_task(task: vim.Task, monitor: TaskMonitor, success: dict, on_error: Callable[[Exception], dict], timeout: float = None) -> Future:
+    """
+    Wait for a task and convert its outcome into a result message
+    Args:
+        task (vim.Task): The task
+        monitor (TaskMonitor): The monitor following the task, None to wait for it in this thread with WaitForTask()
+        success (dict): The result message when the task succeeds
+        on_error (Callable[[Exception], dict]): Get the result message from the error of the task when it fails
+        timeout (float): Maximum time to wait for the task when it is followed by `monitor`, in seconds
+    Returns:
+        Future: Resolved with the result message once the task is done
+    """
+    if not monitor:
+        try:
+            WaitForTask(task)
+            return resolved(success)
+        except Exception as err:
+            return resolved(on_error(err))
+
+    future = Future()
+
+    def convert(task_future: Future):
+        if task_future.cancelled():
+            future.set_result(on_error(RuntimeError("Task monitor stopped")))
+        elif task_future.exception():
+            future.set_result(on_error(task_future.exception()))
+        else:
+            future.set_result(success)
+
+    monitor.track(task, timeout).add_done_callback(convert)
+    return future
@@ -0,0 +1,70 @@
+from subprocess import run, SubprocessError
+from threading import Event, Lock, Thread
+from time import monotonic
+import logging
+
+
+UPS_BATTERY_SCRIPT = "./ups_battery.sh"
+UPS_POLL_INTERVAL = 10  # Interval between two readings of the UPS remaining runtime, in seconds
+UPS_POLL_TIMEOUT = 30   # Maximum duration of a reading, in seconds
+
+
+class UpsMonitor:
+    """ Poll the remaining runtime of a UPS in the background with `ups_battery.sh` """
+    def __init__(self, ip: str, interval: float = UPS_POLL_INTERVAL):
+        """
+        Args:
+            ip (str): The IP address of the UPS, or the URL of a mock UPS
+            interval (float): The interval between two readings, in seconds
+        """
+        self._ip = ip
+        self._interval = interval
+        self._reading = None  # (remaining runtime in seconds, monotonic time of the reading)
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Read the remaining runtime in the background until stop() is called. The first reading is done right away, in the
+        background too: remaining() is None until it is done
+        """
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, name="ups-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the background readings """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def remaining(self) -> float:
+        """
+        Get the remaining runtime of the UPS, estimated from the last reading
+        Returns:
+            float: The remaining runtime in seconds, or None if the UPS could never be read
+        """
+        with self._lock:
+            if not self._reading:
+                return None
+            runtime, read_at = self._reading
+        return max(0.0, runtime - (monotonic() - read_at))
+
+    def poll(self):
+        """ Read the remaining runtime of the UPS. Failures are logged, and the last reading is kept """
+        try:
+            result = run([UPS_BATTERY_SCRIPT, "--ip", self._ip], capture_output=True, text=True, timeout=UPS_POLL_TIMEOUT, check=True)
+            runtime = float(result.stdout.strip()) * 60
+        except (SubprocessError, OSError, ValueError) as e:
+            logging.warning(f"Can't read UPS battery: {e}")
+            return
+        with self._lock:
+            self._reading = (runtime, monotonic())
+
+    def _run(self):
+        """ Read the remaining runtime right away, then every `interval` seconds until stopped """
+        self.poll()
+        while not self._stopped.wait(self._interval):
+            self.poll()
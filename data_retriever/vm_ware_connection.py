@@ -1,16 +1,42 @@
 from pyVim.connect import SmartConnect, Disconnect
-from pyVmomi import vim
+from pyVmomi import vim, vmodl, SoapStubAdapter
+from dotenv import load_dotenv
+from os import environ as env
+from threading import Lock
+from time import monotonic
+from typing import Iterator
 import ssl
 
+from data_retriever.perf_counters import PerfCollector
+from data_retriever.property_watcher import PropertyWatcher, container_filter_spec
+from data_retriever.session_cache import SessionCache, CachedSession, session_key
+
+load_dotenv()
+
+PROPERTY_PAGE_SIZE = 500
+SESSION_REUSE = env.get('SESSION_REUSE', 'true').lower() != 'false'
+SESSION_CHECK_DELAY = 60
+INDEX_REBUILD_INTERVAL = 10  # Minimum time between two rebuilds of a MoId index for missing MoIds, in seconds
+
+# Sessions opened by this process, by session key: (ServiceInstance, ServiceContent, time of the last validity check)
+_live_sessions = {}
+_live_sessions_lock = Lock()
+
 
 class VMwareConnection:
     def __init__(self):
         self._content = None
         self._si = None
+        self._index = {}  # MoId index of each managed object type: ({moid: object}, time it was built)
+        self._index_lock = Lock()  # Lookups may be done from several threads, e.g. by the migration plan
+        self._session_key = None
 
     def connect(self, host: str, user: str, password: str, port=443, verified_ssl=False):
         """
-        Connect to the server where VMs are located
+        Connect to the server where VMs are located.
+        When session reuse is enabled (SESSION_REUSE, default to true), a valid session opened earlier by this process
+        or by another process with the same credentials is reused instead of logging in again. Sessions are not reused
+        when ENCRYPTION_KEY is not set, since they can't be cached securely
         Args:
             host (str): The IP address or hostname of the server
             user (str): The username for authentication
@@ -25,15 +51,98 @@ class VMwareConnection:
         if not verified_ssl:
             context.check_hostname = False
             context.verify_mode = ssl.CERT_NONE
-        self._si = SmartConnect(host=host, user=user, pwd=password, port=port, sslContext=context)
-        self._content = self._si.RetrieveContent()
+        self._si = None
+        self._index = {}
+        self._session_key = None
+        if SESSION_REUSE:
+            try:
+                self._session_key = session_key(host, port, user, password)
+            except ValueError:
+                pass
+        if self._session_key:
+            self._si, self._content = self._reuse_session(host, port, context)
+        if not self._si:
+            self._si = SmartConnect(host=host, user=user, pwd=password, port=port, sslContext=context)
+            self._content = self._si.RetrieveContent()
+            if self._session_key:
+                SessionCache().set(self._session_key, CachedSession(self._si._stub.cookie, self._si._stub.version))
+                with _live_sessions_lock:
+                    _live_sessions[self._session_key] = (self._si, self._content, monotonic())
 
-    def disconnect(self):
-        """ Close the connection with the server where VMs are located """
+    def disconnect(self, logout=False):
+        """
+        Close the connection with the server where VMs are located.
+        A reusable session is kept open for the next connections unless `logout` is set
+        Args:
+            logout (bool): Whether to close the vCenter session even if it could be reused (default to False)
+        """
         if self._si:
-            Disconnect(self._si)
+            if not self._session_key:
+                Disconnect(self._si)
+            elif logout:
+                with _live_sessions_lock:
+                    _live_sessions.pop(self._session_key, None)
+                SessionCache().delete(self._session_key)
+                Disconnect(self._si)
         self._content = None
         self._si = None
+        self._index = {}
+
+    def _reuse_session(self, host: str, port: int, context: ssl.SSLContext):
+        """
+        Get a valid session for the current session key, from this process first, then from the session cache.
+        Invalid sessions are forgotten
+        Args:
+            host (str): The IP address or hostname of the server
+            port (int): The port to use for the connection
+            context (ssl.SSLContext): The SSL context of the connection
+        Returns:
+            tuple[vim.ServiceInstance, vim.ServiceInstanceContent]: The service instance and content of the reused session, or (None, None) if no valid session is available
+        """
+        with _live_sessions_lock:
+            live = _live_sessions.get(self._session_key)
+        if live:
+            si, content, checked_at = live
+            if monotonic() - checked_at < SESSION_CHECK_DELAY:
+                return si, content
+            if self._is_session_valid(content):
+                with _live_sessions_lock:
+                    _live_sessions[self._session_key] = (si, content, monotonic())
+                return si, content
+            with _live_sessions_lock:
+                _live_sessions.pop(self._session_key, None)
+
+        session_cache = SessionCache()
+        cached = session_cache.get(self._session_key)
+        if not cached:
+            return None, None
+        try:
+            stub = SoapStubAdapter(host=host, port=port, version=cached.version, sslContext=context)
+            stub.cookie = cached.cookie
+            si = vim.ServiceInstance("ServiceInstance", stub)
+            content = si.RetrieveContent()
+        except Exception:
+            return None, None
+        if not self._is_session_valid(content):
+            session_cache.delete(self._session_key)
+            return None, None
+        with _live_sessions_lock:
+            _live_sessions[self._session_key] = (si, content, monotonic())
+        return si, content
+
+    @staticmethod
+    def _is_session_valid(content: vim.ServiceInstanceContent) -> bool:
+        """
+        Check whether a session is still authenticated. The check also keeps the session alive on the vCenter
+        Args:
+            content (vim.ServiceInstanceContent): The service content of the session
+        Returns:
+            bool: True if the session is authenticated
+        """
+        try:
+            return content.sessionManager.currentSession is not None
+        except Exception:
+            return False
 
     def get_all_vms(self) -> list[vim.VirtualMachine]:
         """
@@ -88,34 +197,121 @@ class VMwareConnection:
             hosts.extend(collect_hosts_from_folder(host_folder))
         return hosts
 
-    def get_vm(self, moid: str) -> vim.VirtualMachine:
+    def get_all_vms_properties(self, properties: list[str]) -> list[dict]:
         """
-        Get a VM by its MoId
+        Get the given properties of every VM of the vCenter in bulk
         Args:
-            moid (str): The Managed Object ID of the VM
+            properties (list[str]): The property paths to retrieve (e.g. "runtime.powerState")
         Returns:
-            vim.VirtualMachine: The VM object, or None if not found
+            list[dict]: One record per VM, mapping each retrieved property path to its value, plus "obj" and "moid"
         """
-        def search_moid_in_folder(folder, moid):
-            for entity in folder.childEntity:
-                if isinstance(entity, vim.VirtualMachine):
-                    if entity._moId == moid:
-                        return entity
-                elif isinstance(entity, vim.Folder):
-                    vm = search_moid_in_folder(entity, moid)
-                    if vm:
-                        return vm
+        return list(self._retrieve_properties(vim.VirtualMachine, properties))
+
+    def iter_vms_properties(self, properties: list[str]) -> Iterator[dict]:
+        """
+        Get the given properties of every VM of the vCenter, page by page, without keeping them all in memory
+        Args:
+            properties (list[str]): The property paths to retrieve (e.g. "runtime.powerState")
+        Yields:
+            dict: One record per VM, mapping each retrieved property path to its value, plus "obj" and "moid"
+        """
+        return self._retrieve_properties(vim.VirtualMachine, properties)
+
+    def get_all_hosts_properties(self, properties: list[str]) -> list[dict]:
+        """
+        Get the given properties of every server of the vCenter in bulk
+        Args:
+            properties (list[str]): The property paths to retrieve (e.g. "summary.quickStats")
+        Returns:
+            list[dict]: One record per server, mapping each retrieved property path to its value, plus "obj" and "moid"
+        """
+        return list(self._retrieve_properties(vim.HostSystem, properties))
+
+    def iter_hosts_properties(self, properties: list[str]) -> Iterator[dict]:
+        """
+        Get the given properties of every server of the vCenter, page by page, without keeping them all in memory
+        Args:
+            properties (list[str]): The property paths to retrieve (e.g. "summary.quickStats")
+        Yields:
+            dict: One record per server, mapping each retrieved property path to its value, plus "obj" and "moid"
+        """
+        return self._retrieve_properties(vim.HostSystem, properties)
+
+    def get_compute_resource_names(self) -> dict[str, str]:
+        """
+        Get the name of every compute resource (cluster or standalone server) of the vCenter in bulk
+        Returns:
+            dict[str, str]: The name of each compute resource, by Managed Object ID
+        """
+        return {record["moid"]: record.get("name", "") for record in self._retrieve_properties(vim.ComputeResource, ["name"])}
+
+    def _retrieve_properties(self, obj_type, properties: list[str], page_size=PROPERTY_PAGE_SIZE):
+        """
+        Retrieve properties of every object of a type with a paged PropertyCollector query on a ContainerView.
+        Unset properties are missing from the records
+        Args:
+            obj_type (type): The managed object type to retrieve (e.g. vim.VirtualMachine)
+            properties (list[str]): The property paths to retrieve
+            page_size (int): The maximum number of objects returned by each round trip
+        Yields:
+            dict: A record mapping each retrieved property path to its value, plus "obj" and "moid"
+        """
+        if not self._si:
+            return
+        collector = self._content.propertyCollector
+        view = self._content.viewManager.CreateContainerView(self._content.rootFolder, [obj_type], True)
+        token = None
+        try:
+            options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=page_size)
+            result = collector.RetrievePropertiesEx(
+                specSet=[container_filter_spec(view, obj_type, properties)],
+                options=options
+            )
+            while result:
+                token = result.token
+                for obj_content in result.objects:
+                    record = {prop.name: prop.val for prop in obj_content.propSet}
+                    record["obj"] = obj_content.obj
+                    record["moid"] = obj_content.obj._moId
+                    yield record
+                if not token:
+                    break
+                result = collector.ContinueRetrievePropertiesEx(token=token)
+                token = None
+        finally:
+            if token:
+                collector.CancelRetrievePropertiesEx(token=token)
+            view.Destroy()
+
+    def create_property_watcher(self) -> PropertyWatcher:
+        """
+        Create a watcher following property changes on the vCenter. The watcher has to be destroyed after use
+        Returns:
+            PropertyWatcher: The watcher, or None if not connected
+        """
+        if not self._si:
             return None
+        return PropertyWatcher(self._content)
 
+    def create_perf_collector(self) -> PerfCollector:
+        """
+        Create a collector of the real-time performance counters of the vCenter
+        Returns:
+            PerfCollector: The collector, or None if not connected
+        """
         if not self._si:
             return None
+        return PerfCollector(self._content)
 
-        for datacenter in self._content.rootFolder.childEntity:
-            vm_folder = datacenter.vmFolder
-            vm = search_moid_in_folder(vm_folder, moid)
-            if vm:
-                return vm
-        return None
+    def get_vm(self, moid: str) -> vim.VirtualMachine:
+        """
+        Get a VM by its MoId
+        Args:
+            moid (str): The Managed Object ID of the VM
+        Returns:
+            vim.VirtualMachine: The VM object, or None if not found
+        """
+        return self._lookup(vim.VirtualMachine, moid)
 
     def get_host_system(self, esxi_moid: str) -> vim.HostSystem:
         """
@@ -125,18 +321,29 @@ class VMwareConnection:
         Returns:
             vim.HostSystem: The HostSystem object, or None if not found
         """
-        if not self._content:
-            return None
+        return self._lookup(vim.HostSystem, esxi_moid)
 
-        for datacenter in self._content.rootFolder.childEntity:
-            host_folder = datacenter.hostFolder
-            for compute_resource in host_folder.childEntity:
-                if hasattr(compute_resource, 'host'):
-                    hosts = compute_resource.host
-                else:
-                    hosts = [compute_resource]
-
-                for host in hosts:
-                    if host._moId == esxi_moid:
-                        return host
-        return None
+    def refresh_inventory(self):
+        """ Invalidate the MoId index so that it is rebuilt from the vCenter on the next lookup """
+        self._index = {}
+
+    def _lookup(self, obj_type, moid: str):
+        """
+        Find a managed object by its MoId in the MoId index of its type.
+        The index is built once per connection and rebuilt when a MoId is missing from it, in case the inventory changed.
+        It is rebuilt at most once every `INDEX_REBUILD_INTERVAL` seconds, so that lookups of MoIds that don't exist
+        don't retrieve the whole inventory each time
+        Args:
+            obj_type (type): The managed object type to look for (e.g. vim.VirtualMachine)
+            moid (str): The Managed Object ID of the object
+        Returns:
+            The managed object, or None if not found
+        """
+        if not self._si:
+            return None
+        with self._index_lock:
+            index, built_at = self._index.get(obj_type, (None, None))
+            if index is None or (moid not in index and monotonic() - built_at >= INDEX_REBUILD_INTERVAL):
+                index = {record["moid"]: record["obj"] for record in self._retrieve_properties(obj_type, [])}
+                self._index[obj_type] = (index, monotonic())
+            return index.get(moid)
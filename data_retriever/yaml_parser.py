@@ -1,7 +1,8 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from yaml import safe_load as yaml_load
 
-from data_retriever.decrypt_password import decrypt
+from data_retriever.decrypt_password import decrypt_all
+from data_retriever.task_graph import topological_order
 
 
 @dataclass
@@ -21,10 +22,14 @@ class Server:
     host: Host
     destination: Host
     vm_order: list[str]
+    max_concurrent_migrations: int = 1  # Maximum number of VM operations (stop, migration, start) of the server running at the same time
+    depends_on: dict[str, list[str]] = field(default_factory=dict)  # VMs that must be stopped before a VM is stopped, by VM moid
 
 @dataclass
 class Servers:
     servers: list[Server]
+    max_concurrency: int = None  # Maximum number of servers whose plans are executed at the same time, None for all of them
+    max_concurrent_migrations: int = 1  # Default per-server limit, and maximum number of VMs migrated to a destination at the same time
 
 @dataclass
 class VCenter:
@@ -37,6 +42,12 @@ class VCenter:
 class UpsGrace:
     shutdown_grace: int
     restart_grace: int
+    ip: str = None           # The IP address of the UPS, to adapt the plan to its remaining runtime
+    safety_margin: int = 60  # Runtime to keep in reserve once the servers are stopped, in seconds
+    host_ready_timeout: int = 600  # Maximum time to wait for a server to be connected to the vCenter once started during a rollback, in seconds
+    restart_wave_size: int = None  # Number of servers started at the same time during a rollback, None for all of them
+    restart_wave_delay: int = 30   # Delay between two waves of servers started during a rollback, in seconds
+    restore_concurrency: int = 4   # Number of VMs of a server restored at the same time during a rollback
 
 
 def load_plan_from_yaml(file_path: str) -> tuple[VCenter, UpsGrace, Servers]:
@@ -50,24 +61,43 @@ def load_plan_from_yaml(file_path: str) -> tuple[VCenter, UpsGrace, Servers]:
         DecryptionException: If an error occurs while decrypting passwords
         FileNotFoundError: If `file_path` is not a valid YAML file
         KeyError: If YAML file has not a correct format
+        ValueError: If a VM appears twice, or if VM dependencies reference an unknown VM or have a cycle
         Exception: For any other error
      """
     with open(file_path, 'r') as f:
         data = yaml_load(f)
 
+    encrypted = [data['vCenter']['password']]
+    for server in data['servers']:
+        encrypted.append(server['server']['host']['ilo']['password'])
+        if server['server'].get('destination'):
+            encrypted.append(server['server']['destination']['ilo']['password'])
+    passwords = dict(zip(encrypted, decrypt_all(encrypted)))
+
     vcenter = VCenter(
         ip=data['vCenter']['ip'],
         user=data['vCenter']['user'],
-        password=decrypt(data['vCenter']['password']),
+        password=passwords[data['vCenter']['password']],
         port=data['vCenter']['port'] if 'port' in data['vCenter'] else 443,
     )
 
     ups_grace = UpsGrace(
         shutdown_grace=data['ups']['shutdownGrace'],
         restart_grace=data['ups']['restartGrace'],
+        ip=data['ups']['ip'] if 'ip' in data['ups'] else None,
+        safety_margin=data['ups']['safetyMargin'] if 'safetyMargin' in data['ups'] else 60,
+        host_ready_timeout=data['ups']['hostReadyTimeout'] if 'hostReadyTimeout' in data['ups'] else 600,
+        restart_wave_size=data['ups']['restartWaveSize'] if 'restartWaveSize' in data['ups'] else None,
+        restart_wave_delay=data['ups']['restartWaveDelay'] if 'restartWaveDelay' in data['ups'] else 30,
+        restore_concurrency=data['ups']['restoreConcurrency'] if 'restoreConcurrency' in data['ups'] else 4,
     )
 
-    servers = Servers(servers=[None] * len(data['servers']))
+    execution = data['execution'] if 'execution' in data and data['execution'] else {}
+    servers = Servers(
+        servers=[None] * len(data['servers']),
+        max_concurrency=execution['maxConcurrentServers'] if 'maxConcurrentServers' in execution else None,
+        max_concurrent_migrations=execution['maxConcurrentMigrations'] if 'maxConcurrentMigrations' in execution else 1,
+    )
     for i, server in enumerate(data['servers']):
         host = server['server']['host']
         destination = server['server']['destination'] if 'destination' in server['server'] else None
@@ -78,7 +108,7 @@ def load_plan_from_yaml(file_path: str) -> tuple[VCenter, UpsGrace, Servers]:
                 ilo=IloYaml(
                     ip=host['ilo']['ip'],
                     user=host['ilo']['user'],
-                    password=decrypt(host['ilo']['password']),
+                    password=passwords[host['ilo']['password']],
                 )
             ),
             destination=Host(
@@ -87,9 +117,29 @@ def load_plan_from_yaml(file_path: str) -> tuple[VCenter, UpsGrace, Servers]:
                 ilo=IloYaml(
                     ip=destination['ilo']['ip'],
                     user=destination['ilo']['user'],
-                    password=decrypt(destination['ilo']['password']),
+                    password=passwords[destination['ilo']['password']],
                 )
             ) if destination else None,
             vm_order=[vm['vmMoId'] for vm in server['server']['vmOrder']],
+            max_concurrent_migrations=server['server']['maxConcurrentMigrations'] if 'maxConcurrentMigrations' in server['server'] else servers.max_concurrent_migrations,
+            depends_on={vm['vmMoId']: list(vm['dependsOn']) for vm in server['server']['vmOrder'] if vm.get('dependsOn')},
         )
+    _check_dependencies(servers)
     return vcenter, ups_grace, servers
+
+
+def _check_dependencies(servers: Servers):
+    """
+    Check the dependencies between the VMs of a migration plan. Dependencies may link VMs of different servers
+    Args:
+        servers (Servers): The migration plan for each server
+    Raises:
+        ValueError: If a VM appears twice, or if dependencies reference an unknown VM or have a cycle
+    """
+    dependencies = {}
+    for server in servers.servers:
+        for vm_moid in server.vm_order:
+            if vm_moid in dependencies:
+                raise ValueError(f"VM '{vm_moid}' appears more than once in the migration plan")
+            dependencies[vm_moid] = server.depends_on.get(vm_moid, [])
+    topological_order(dependencies)
@@ -1,8 +1,9 @@
 from argparse import ArgumentParser
+from typing import Iterator
 from pyVmomi import vim
 import socket
 
-from data_retriever.dto import result_message, output, servers_list_info
+from data_retriever.dto import result_message, output, output_ndjson, servers_list_info, server_record_info, SERVER_LIST_PROPERTIES
 from data_retriever.vm_ware_connection import VMwareConnection
 
 
@@ -35,13 +36,49 @@ def list_server(ip: str, user: str, password: str, port: int) -> dict:
         conn.disconnect()
 
 
+def stream_server(ip: str, user: str, password: str, port: int) -> Iterator[dict]:
+    """
+    List all servers on an architecture one by one, as they are fetched page by page, so that they are not all kept in memory
+    Args:
+        ip (str): The ip of the VCenter to retrieve data from
+        user (str): The username of the VCenter to retrieve data from
+        password (str): The password of the VCenter to retrieve data from
+        port (int): The port to use to connect to the VCenter
+    Yields:
+        dict: A dictionary formatted for json dump containing the data of a server (server_record_info()), or an error
+            message (result_message()) ending the list
+    """
+    conn = VMwareConnection()
+    try:
+        conn.connect(ip, user, password, port=port)
+        parent_names = conn.get_compute_resource_names()
+        for record in conn.iter_hosts_properties(SERVER_LIST_PROPERTIES):
+            yield server_record_info(record, parent_names)
+
+    except vim.fault.InvalidLogin:
+        yield result_message("Invalid credentials", 401)
+    except (vim.fault.NoCompatibleHost, vim.fault.InvalidHostState, OSError, socket.error):
+        yield result_message("Host is unreachable", 404)
+    except vim.fault.VimFault:
+        yield result_message("Can't list Servers", 403)
+    except Exception as err:
+        yield result_message(str(err), 400)
+    finally:
+        conn.disconnect()
+
+
 if __name__ == "__main__":
     parser = ArgumentParser(description="Lister les VM d'un serveur")
     parser.add_argument("--ip", required=True, help="Adresse IP du vCenter")
     parser.add_argument("--user", required=True, help="Nom d'utilisateur du vCenter")
     parser.add_argument("--password", required=True, help="Mot de passe de l'utilisateur du vCenter")
     parser.add_argument("--port", type=int, default=443, help="Port du vCenter")
+    parser.add_argument("--format", choices=["json", "ndjson"], default="json",
+                        help="Format de sortie : json, ou ndjson pour écrire chaque serveur dès qu'il est récupéré (optionnel, json par défaut)")
 
     args = parser.parse_args()
 
-    output(list_server(args.ip, args.user, args.password, args.port))
+    if args.format == "ndjson":
+        output_ndjson(stream_server(args.ip, args.user, args.password, args.port))
+    else:
+        output(list_server(args.ip, args.user, args.password, args.port))
@@ -1,6 +1,16 @@
 #!/bin/bash
 
-# Usage: ./list_server.sh --ip <IP> --user <USER> --password <PASS> [--port <PORT>]
+# Usage: ./list_server.sh --ip <IP> --user <USER> --password <PASS> [--port <PORT>] [--format json|ndjson]
+
+# The ndjson format is streamed locally, the command server only returns whole JSON documents
+if [ -n "$UPS_MANAGER_URL" ] && [[ " $* " != *" --format ndjson "* && " $* " != *" --format=ndjson "* ]]; then
+    ./command_client.sh list_server "$@"
+    CODE=$?
+    # 7: command server unreachable, run the command locally instead
+    if [ "$CODE" -ne 7 ]; then
+        exit "$CODE"
+    fi
+fi
 
 if [ ! -f .venv/bin/activate ]; then
     echo "ERROR: Virtual environment not found at .venv/bin/activate"
@@ -1,8 +1,9 @@
 from argparse import ArgumentParser
+from typing import Iterator
 from pyVmomi import vim
 import socket
 
-from data_retriever.dto import result_message, vms_list_info, output
+from data_retriever.dto import result_message, vms_list_records_info, vm_record_info, output, output_ndjson, VM_LIST_PROPERTIES
 from data_retriever.vm_ware_connection import VMwareConnection
 
 
@@ -20,8 +21,9 @@ def list_vm(ip: str, user: str, password: str, port: int) -> dict:
     conn = VMwareConnection()
     try:
         conn.connect(ip, user, password, port=port)
-        vms = conn.get_all_vms()
-        return vms_list_info(vms)
+        host_names = {host["moid"]: host.get("name", "") for host in conn.get_all_hosts_properties(["name"])}
+        vms = conn.get_all_vms_properties(VM_LIST_PROPERTIES)
+        return vms_list_records_info(vms, host_names)
 
     except vim.fault.InvalidLogin:
         return result_message("Invalid credentials", 401)
@@ -35,13 +37,49 @@ def list_vm(ip: str, user: str, password: str, port: int) -> dict:
         conn.disconnect()
 
 
+def stream_vm(ip: str, user: str, password: str, port: int) -> Iterator[dict]:
+    """
+    List all VMs on a server one by one, as they are fetched page by page, so that they are not all kept in memory
+    Args:
+        ip (str): The ip of the VCenter to connect to
+        user (str): The username of the VCenter to connect to
+        password (str): The password of the VCenter to connect to
+        port (int): The port to use to connect to the VCenter
+    Yields:
+        dict: A dictionary formatted for json dump containing the data of a VM (vm_record_info()), or an error message
+            (result_message()) ending the list
+    """
+    conn = VMwareConnection()
+    try:
+        conn.connect(ip, user, password, port=port)
+        host_names = {host["moid"]: host.get("name", "") for host in conn.get_all_hosts_properties(["name"])}
+        for record in conn.iter_vms_properties(VM_LIST_PROPERTIES):
+            yield vm_record_info(record, host_names)
+
+    except vim.fault.InvalidLogin:
+        yield result_message("Invalid credentials", 401)
+    except (vim.fault.NoCompatibleHost, vim.fault.InvalidHostState, OSError, socket.error):
+        yield result_message("Host is unreachable", 404)
+    except vim.fault.VimFault:
+        yield result_message("Can't list VMs", 403)
+    except Exception as err:
+        yield result_message(str(err), 400)
+    finally:
+        conn.disconnect()
+
+
 if __name__ == "__main__":
     parser = ArgumentParser(description="Lister les VM d'un serveur")
     parser.add_argument("--ip", required=True, help="Adresse IP du vCenter")
     parser.add_argument("--user", required=True, help="Nom d'utilisateur du vCenter")
     parser.add_argument("--password", required=True, help="Mot de passe de l'utilisateur du vCenter")
     parser.add_argument("--port", type=int, default=443, help="Port du vCenter (optionnel, 443 par défaut)")
+    parser.add_argument("--format", choices=["json", "ndjson"], default="json",
+                        help="Format de sortie : json, ou ndjson pour écrire chaque VM dès qu'elle est récupérée (optionnel, json par défaut)")
 
     args = parser.parse_args()
 
-    output(list_vm(args.ip, args.user, args.password, args.port))
+    if args.format == "ndjson":
+        output_ndjson(stream_vm(args.ip, args.user, args.password, args.port))
+    else:
+        output(list_vm(args.ip, args.user, args.password, args.port))
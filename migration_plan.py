@@ -1,11 +1,20 @@
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from signal import signal, SIGTERM
+from time import sleep, monotonic
 from pyVmomi import vim
+import logging
 
+from data_retriever.deadline_planner import DeadlinePlanner, StepDurations
 from data_retriever.migration_event_queue import EventQueue, EventQueueException
 from data_retriever.migration_event import VMMigrationEvent, VMShutdownEvent, ServerShutdownEvent, VMStartedEvent, \
     MigrationErrorEvent
+from data_retriever.plan_compiler import load_plan
+from data_retriever.task_graph import TaskGraph
+from data_retriever.task_monitor import TASK_TIMEOUT, TaskMonitor
+from data_retriever.ups_monitor import UpsMonitor
 from data_retriever.vm_ware_connection import VMwareConnection
-from data_retriever.yaml_parser import Server, VCenter, Servers, load_plan_from_yaml, UpsGrace
+from data_retriever.yaml_parser import Server, VCenter, Servers, UpsGrace
 from server_start import server_start
 from server_stop import server_stop
 from vm_migration import vm_migration
@@ -13,12 +22,17 @@ from vm_start import vm_start
 from vm_stop import vm_stop
 
 
-def get_distant_host(conn: VMwareConnection, server: Server) -> vim.HostSystem:
+MAX_WORKERS = 64       # Maximum number of steps of the plan running at the same time, whatever the limits of the plan
+GRACE_CHECK_DELAY = 5  # Interval between two checks of the UPS deadline during the grace period, in seconds
+
+
+def get_distant_host(conn: VMwareConnection, server: Server, powered_on: set[str] = frozenset()) -> vim.HostSystem:
     """
     Get the distant server if set and on
     Args:
         conn (VMwareConnection): The connection to the vCenter that orchestrates the migration plan
         server (Server): The `Server` object that represents the migration plan for one server
+        powered_on (set[str]): The moids of the distant servers already started, e.g. by the preflight
     Returns:
         vim.HostSystem: The `HostSystem` object representing the distant server, or None if the server is unavailable
     """
@@ -31,7 +45,7 @@ def get_distant_host(conn: VMwareConnection, server: Server) -> vim.HostSystem:
         # print(f"Distant server '{server.destination.name}' ({server.destination.moid}) not found")
         return None
 
-    if dist_host.runtime.powerState == vim.HostSystem.PowerState.poweredOff:
+    if dist_host.runtime.powerState == vim.HostSystem.PowerState.poweredOff and server.destination.moid not in powered_on:
         start_result = server_start(server.destination.ilo.ip, server.destination.ilo.user, server.destination.ilo.password)
         if start_result['result']['httpCode'] != 200:
             # print(f"Distant server '{server.destination.name}' ({server.destination.moid}) is off and won't turn on : {start_result['result']['message']}")
@@ -40,88 +54,421 @@ def get_distant_host(conn: VMwareConnection, server: Server) -> vim.HostSystem:
     return dist_host
 
 
+def preflight(conn: VMwareConnection, servers: Servers, powered_on: set[str]):
+    """
+    Prepare the execution of the plan during the grace period: resolve every server and VM of the plan so that they are
+    cached by the connection, check the distant servers and start those that are off, since they take minutes to boot.
+    Problems are only logged: they are handled by the plan once executed
+    Args:
+        conn (VMwareConnection): The connection to the vCenter that orchestrates the migration plan
+        servers (Servers): The migration plan for each server
+        powered_on (set[str]): Filled with the moids of the distant servers started
+    """
+    destinations = {}
+    for server in servers.servers:
+        if not conn.get_host_system(server.host.moid):
+            logging.warning(f"Preflight: server '{server.host.name}' ({server.host.moid}) not found")
+        for vm_moid in server.vm_order:
+            if not conn.get_vm(vm_moid):
+                logging.warning(f"Preflight: VM {vm_moid} of server '{server.host.name}' not found")
+        if server.destination:
+            destinations[server.destination.moid] = server.destination
+
+    for destination in destinations.values():
+        dist_host = conn.get_host_system(destination.moid)
+        if not dist_host:
+            logging.warning(f"Preflight: distant server '{destination.name}' ({destination.moid}) not found")
+        elif dist_host.runtime.powerState == vim.HostSystem.PowerState.poweredOff:
+            # Recorded before starting it, so that it is stopped by a rollback even if the request is interrupted
+            powered_on.add(destination.moid)
+            start_result = server_start(destination.ilo.ip, destination.ilo.user, destination.ilo.password)
+            if start_result['result']['httpCode'] != 200:
+                powered_on.discard(destination.moid)
+                logging.warning(f"Preflight: distant server '{destination.name}' ({destination.moid}) won't start: {start_result['result']['message']}")
+        elif dist_host.runtime.connectionState != 'connected':
+            logging.warning(f"Preflight: distant server '{destination.name}' ({destination.moid}) is not connected to the vCenter")
+
+
+def rollback_preflight(servers: Servers, powered_on: set[str]):
+    """
+    Stop the distant servers started by the preflight, when the plan is cancelled during the grace period
+    Args:
+        servers (Servers): The migration plan for each server
+        powered_on (set[str]): The moids of the distant servers started by the preflight
+    """
+    destinations = {server.destination.moid: server.destination for server in servers.servers
+                    if server.destination and server.destination.moid in powered_on}
+    with ThreadPoolExecutor(max_workers=max(len(destinations), 1)) as executor:
+        results = executor.map(lambda host: (host, server_stop(host.ilo.ip, host.ilo.user, host.ilo.password)), destinations.values())
+        for host, stop_result in results:
+            if stop_result['result']['httpCode'] != 200:
+                logging.error(f"Rollback: distant server '{host.name}' ({host.moid}) won't stop: {stop_result['result']['message']}")
+
+
+def _cancel_plan(signum, frame):
+    """ Handle SIGTERM during the grace period, sent when power comes back (see restart_plan.sh) """
+    raise PlanCancelled()
+
+
+class PlanCancelled(Exception):
+    """ Raised when the plan is cancelled during the grace period """
+
+
+class ServerExecution:
+    """ State of the execution of the shutdown plan of one server, shared by its steps """
+    def __init__(self, server: Server):
+        self.server = server
+        self.available = False  # Whether the server was found on
+        self.dist_host = None   # The distant server, if available
+        self.migrated = set()   # The moids of the VMs migrated to the distant server
+
+
+def check_server(conn: VMwareConnection, event_queue: EventQueue, execution: ServerExecution, powered_on: set[str]):
+    """
+    Check that a server is on and get its distant server, started if needed. The other steps of a server that is not
+    available do nothing
+    Args:
+        conn (VMwareConnection): The connection to the vCenter that orchestrates the migration plan
+        event_queue (EventQueue): The queue where the events of the plan are pushed
+        execution (ServerExecution): The execution of the plan of the server
+        powered_on (set[str]): The moids of the distant servers started by the preflight
+    Raises:
+        EventQueueException: If an event could not be pushed
+    """
+    server = execution.server
+    current_host = conn.get_host_system(server.host.moid)
+    if not current_host:
+        event = MigrationErrorEvent("Server not found", f"Server '{server.host.name}' with moId {server.host.moid} not found")
+        event_queue.push(event)
+        return
+    if current_host.runtime.powerState == vim.HostSystem.PowerState.poweredOff:
+        event = MigrationErrorEvent("Server off", f"Server '{server.host.name}' with moId {server.host.moid} is already off")
+        event_queue.push(event)
+        return
+    execution.available = True
+    execution.dist_host = get_distant_host(conn, server, powered_on)
+
+
+def stop_vm_step(conn: VMwareConnection, event_queue: EventQueue, planner: DeadlinePlanner, execution: ServerExecution, vm_moid: str,
+                 task_monitor: TaskMonitor = None):
+    """
+    Stop a VM of a server
+    Args:
+        conn (VMwareConnection): The connection to the vCenter that orchestrates the migration plan
+        event_queue (EventQueue): The queue where the events of the plan are pushed
+        planner (DeadlinePlanner): The planner recording the duration of the steps
+        execution (ServerExecution): The execution of the plan of the server of the VM
+        vm_moid (str): The Managed Object ID of the VM
+        task_monitor (TaskMonitor): The monitor following the tasks of the VMs, None to wait for them in this thread
+    Raises:
+        EventQueueException: If an event could not be pushed
+    """
+    if not execution.available:
+        return
+    started = monotonic()
+    stop_result = vm_stop(conn.get_vm(vm_moid), vm_moid, task_monitor, TASK_TIMEOUT)
+    if stop_result['result']['httpCode'] == 200:
+        planner.record(f"stop {vm_moid}", monotonic() - started)
+        event = VMShutdownEvent(vm_moid, execution.server.host.moid)
+    else:
+        event = MigrationErrorEvent("VM won't stop", stop_result['result']['message'])
+    event_queue.push(event)
+
+
+def migrate_vm_step(conn: VMwareConnection, event_queue: EventQueue, planner: DeadlinePlanner, execution: ServerExecution, vm_moid: str,
+                    task_monitor: TaskMonitor = None):
+    """
+    Migrate a VM of a server to its distant server, if available. The migration is skipped, leaving the VM stopped, if
+    it would put the stop of the servers at risk of not finishing before the UPS battery runs out
+    Args:
+        conn (VMwareConnection): The connection to the vCenter that orchestrates the migration plan
+        event_queue (EventQueue): The queue where the events of the plan are pushed
+        planner (DeadlinePlanner): The planner checking the UPS deadline and recording the duration of the steps
+        execution (ServerExecution): The execution of the plan of the server of the VM
+        vm_moid (str): The Managed Object ID of the VM
+        task_monitor (TaskMonitor): The monitor following the tasks of the VMs, None to wait for them in this thread
+    Raises:
+        EventQueueException: If an event could not be pushed
+    """
+    if not execution.available or not execution.dist_host:
+        return
+    if not planner.can_afford(f"migrate {vm_moid}"):
+        event = MigrationErrorEvent("Migration skipped", f"VM '{vm_moid}' is left stopped to stop the servers before the UPS battery runs out")
+        event_queue.push(event)
+        return
+    server = execution.server
+    started = monotonic()
+    migration_result = vm_migration(conn.get_vm(vm_moid), vm_moid, execution.dist_host, server.destination.moid, task_monitor, TASK_TIMEOUT)
+    if migration_result['result']['httpCode'] == 200:
+        planner.record(f"migrate {vm_moid}", monotonic() - started)
+        execution.migrated.add(vm_moid)
+        event = VMMigrationEvent(vm_moid, server.host.moid)
+    else:
+        event = MigrationErrorEvent("VM won't migrate", migration_result['result']['message'])
+    event_queue.push(event)
+
+
+def start_vm_step(conn: VMwareConnection, event_queue: EventQueue, planner: DeadlinePlanner, execution: ServerExecution, vm_moid: str,
+                  task_monitor: TaskMonitor = None):
+    """
+    Start a VM migrated to its distant server
+    Args:
+        conn (VMwareConnection): The connection to the vCenter that orchestrates the migration plan
+        event_queue (EventQueue): The queue where the events of the plan are pushed
+        planner (DeadlinePlanner): The planner recording the duration of the steps
+        execution (ServerExecution): The execution of the plan of the server of the VM
+        vm_moid (str): The Managed Object ID of the VM
+        task_monitor (TaskMonitor): The monitor following the tasks of the VMs, None to wait for them in this thread
+    Raises:
+        EventQueueException: If an event could not be pushed
+    """
+    if vm_moid not in execution.migrated:
+        return
+    started = monotonic()
+    start_result = vm_start(conn.get_vm(vm_moid), vm_moid, task_monitor, TASK_TIMEOUT)
+    if start_result['result']['httpCode'] == 200:
+        planner.record(f"start {vm_moid}", monotonic() - started)
+        event = VMStartedEvent(vm_moid, execution.server.host.moid)
+    else:
+        event = MigrationErrorEvent("VM won't start", start_result['result']['message'])
+    event_queue.push(event)
+
+
+def stop_server_step(event_queue: EventQueue, planner: DeadlinePlanner, execution: ServerExecution):
+    """
+    Stop a server once its VMs have been evacuated
+    Args:
+        event_queue (EventQueue): The queue where the events of the plan are pushed
+        planner (DeadlinePlanner): The planner recording the duration of the steps
+        execution (ServerExecution): The execution of the plan of the server
+    Raises:
+        EventQueueException: If an event could not be pushed
+    """
+    if not execution.available:
+        return
+    host = execution.server.host
+    started = monotonic()
+    stop_result = server_stop(host.ilo.ip, host.ilo.user, host.ilo.password)
+    if stop_result['result']['httpCode'] == 200:
+        planner.record(f"stop-server {host.moid}", monotonic() - started)
+        event = ServerShutdownEvent(host.moid, host.ilo.ip, host.ilo.user, host.ilo.password)
+    else:
+        event = MigrationErrorEvent("Server won't stop", stop_result['result']['message'])
+    event_queue.push(event)
+
+
+def completed_steps(events: list) -> set[str]:
+    """
+    Get the steps of the shutdown plan completed by a previous run, from its events. Every step of a server stopped is
+    completed, since its other steps can't be done anymore
+    Args:
+        events (list): The events of the previous run (see EventQueue.get_event_list())
+    Returns:
+        set[str]: The names of the completed steps (see build_shutdown_graph())
+    """
+    completed = set()
+    for event in events:
+        if isinstance(event, VMShutdownEvent):
+            completed.add(f"stop {event.vm_moid}")
+        elif isinstance(event, VMMigrationEvent):
+            completed.add(f"migrate {event.vm_moid}")
+        elif isinstance(event, VMStartedEvent):
+            completed.add(f"start {event.vm_moid}")
+        elif isinstance(event, ServerShutdownEvent):
+            completed.add(f"check-server {event.server_moid}")
+            completed.add(f"stop-server {event.server_moid}")
+    return completed
+
+
+def build_shutdown_graph(conn: VMwareConnection, event_queue: EventQueue, planner: DeadlinePlanner, servers: Servers,
+                         powered_on: set[str], completed: set[str] = frozenset(), task_monitor: TaskMonitor = None) -> TaskGraph:
+    """
+    Build the graph of the steps of the shutdown plan. For each server, its VMs are stopped, migrated to the distant
+    server and started there, then the server is stopped.
+    A VM is stopped once the VMs it depends on are stopped, which may belong to other servers. VM operations of a server
+    are limited to `server.max_concurrent_migrations` at a time, and are prioritized in the order of `server.vm_order`.
+    Migrations to a destination are limited to `servers.max_concurrent_migrations` at a time, and the steps of at most
+    `servers.max_concurrency` servers are in progress at a time.
+    The steps are registered in `planner`, stopping VMs and servers being mandatory and migrating and starting VMs optional.
+    Steps in `completed`, done by a previous run of the plan, do nothing and are not registered
+    Args:
+        conn (VMwareConnection): The connection to the vCenter that orchestrates the migration plan
+        event_queue (EventQueue): The queue where the events of the plan are pushed
+        planner (DeadlinePlanner): The planner checking the UPS deadline
+        servers (Servers): The migration plan for each server
+        powered_on (set[str]): The moids of the distant servers started by the preflight
+        completed (set[str]): The names of the steps completed by a previous run (see completed_steps())
+        task_monitor (TaskMonitor): The monitor following the tasks of the VMs, None to wait for them in their step
+    Returns:
+        TaskGraph: The graph of the steps of the plan
+    """
+    graph = TaskGraph(max_groups=servers.max_concurrency, on_task_done=planner.finish_step)
+
+    def add_step(name, callback, depends_on=(), priority=(), pools=(), mandatory=True, concurrency=1):
+        if name in completed:
+            # Kept in the graph for its dependents
+            graph.add_task(name, _step_completed, depends_on, priority, group=server.host.moid)
+            return
+        graph.add_task(name, callback, depends_on, priority, pools, group=server.host.moid)
+        planner.add_step(server.host.moid, name, mandatory, concurrency)
+
+    for server in servers.servers:
+        execution = ServerExecution(server)
+        execution.migrated = {vm_moid for vm_moid in server.vm_order if f"migrate {vm_moid}" in completed}
+        concurrency = server.max_concurrent_migrations
+        host_pool = f"host {server.host.moid}"
+        graph.set_pool_limit(host_pool, concurrency)
+        add_step(f"check-server {server.host.moid}", partial(check_server, conn, event_queue, execution, powered_on))
+
+        migration_pools = [host_pool]
+        if server.destination:
+            migration_pools.append(f"destination {server.destination.moid}")
+            graph.set_pool_limit(f"destination {server.destination.moid}", servers.max_concurrent_migrations)
+        for i, vm_moid in enumerate(server.vm_order):
+            depends_on = [f"check-server {server.host.moid}"] + [f"stop {moid}" for moid in server.depends_on.get(vm_moid, [])]
+            add_step(f"stop {vm_moid}", partial(stop_vm_step, conn, event_queue, planner, execution, vm_moid, task_monitor),
+                     depends_on, (i, 0), [host_pool], concurrency=concurrency)
+            add_step(f"migrate {vm_moid}", partial(migrate_vm_step, conn, event_queue, planner, execution, vm_moid, task_monitor),
+                     [f"stop {vm_moid}"], (i, 1), migration_pools, mandatory=False, concurrency=concurrency)
+            add_step(f"start {vm_moid}", partial(start_vm_step, conn, event_queue, planner, execution, vm_moid, task_monitor),
+                     [f"migrate {vm_moid}"], (i, 2), [host_pool], mandatory=False, concurrency=concurrency)
+        add_step(f"stop-server {server.host.moid}", partial(stop_server_step, event_queue, planner, execution),
+                 [f"check-server {server.host.moid}"] + [f"start {vm_moid}" for vm_moid in server.vm_order])
+    return graph
+
+
+def _step_completed():
+    """ Callback of the steps completed by a previous run of the plan """
+
+
+def wait_grace_period(planner: DeadlinePlanner, end: float):
+    """
+    Wait for the end of the grace period before the execution of the plan, ending it early if the plan may not finish
+    before the UPS battery runs out
+    Args:
+        planner (DeadlinePlanner): The planner checking the UPS deadline
+        end (float): The end of the grace period, as given by time.monotonic()
+    """
+    while monotonic() < end:
+        if planner.plan_at_risk():
+            logging.warning("Grace period ended early: the plan may not finish before the UPS battery runs out")
+            return
+        sleep(min(GRACE_CHECK_DELAY, end - monotonic()))
+
+
+def log_critical_path(graph: TaskGraph):
+    """
+    Log the observed critical path of the shutdown plan, i.e. the chain of steps that bounded its duration
+    Args:
+        graph (TaskGraph): The graph of the steps of the executed plan
+    """
+    path = graph.critical_path()
+    total = sum(duration for _, duration in path)
+    steps = " -> ".join(f"{name} ({duration:.1f}s)" for name, duration in path)
+    logging.info(f"Critical path ({total:.1f}s): {steps}")
+
+
 def shutdown(vcenter: VCenter, ups_grace: UpsGrace, servers: Servers):
     """
-    Launch the shutdown plan of all servers specified in `servers
+    Launch the shutdown plan of all servers specified in `servers`.
+    The steps of the plan are executed as soon as their dependencies are done, independent steps running in parallel
+    (see build_shutdown_graph()). The events of each VM and server are pushed in the order they occur.
+    The grace period is used to connect to the vCenter, resolve the servers and VMs and start the distant servers. If the
+    plan is cancelled during the grace period (SIGTERM), the distant servers started are stopped.
+    If a previous run of the plan was interrupted (its migration was started and neither finished nor rolled back), the
+    plan resumes at its first incomplete steps without waiting for the grace period. Otherwise the whole plan is run,
+    its events being added to the saved migration if it was not rolled back yet.
+    When the IP address of the UPS is set, its remaining runtime is polled during the whole plan: the grace period ends
+    early and migrations are skipped when the stop of the servers may not finish before the battery runs out
     Args:
         vcenter (VCenter): The vCenter that orchestrates the migration plan
         ups_grace (UpsGrace): The `UpsGrace` object containing graces periods to wait before shutdown and restart
         servers (Servers): The migration plan for each server
     """
-    stop_delay = ups_grace.shutdown_grace
+    # The grace period starts now: the time spent connecting and in the preflight is part of it
+    grace_end = monotonic() + ups_grace.shutdown_grace
     conn = VMwareConnection()
     event_queue = EventQueue()
+    monitor = UpsMonitor(ups_grace.ip) if ups_grace.ip else None
+    durations = StepDurations()
+    durations.load()
+    planner = DeadlinePlanner(monitor, durations, ups_grace.safety_margin, servers.max_concurrency)
+    powered_on = set()
+    task_monitor = None
+    previous_handler = signal(SIGTERM, _cancel_plan)
     try:
+        if monitor:
+            monitor.start()
         event_queue.connect()
+        resumed = event_queue.migration_interrupted()
+        completed = set()
+        if resumed:
+            try:
+                completed = completed_steps(event_queue.get_event_list())
+                logging.info(f"Resuming the previous run of the plan, {len(completed)} steps already completed")
+            except EventQueueException as e:
+                logging.warning(f"Can't get the steps completed by the previous run, running the whole plan: {e}")
         event_queue.grace_shutdown()
-        sleep(stop_delay)
+        connected = False
+        try:
+            conn.connect(vcenter.ip, vcenter.user, vcenter.password, vcenter.port)
+            connected = True
+            task_monitor = TaskMonitor(conn.create_property_watcher())
+            task_monitor.start()
+            preflight(conn, servers, powered_on)
+        except PlanCancelled:
+            raise
+        except Exception as e:
+            logging.warning(f"Preflight failed: {e}")
+        graph = build_shutdown_graph(conn, event_queue, planner, servers, powered_on, completed, task_monitor)
+        if not resumed:
+            wait_grace_period(planner, grace_end)
+        signal(SIGTERM, previous_handler)
 
         event_queue.start_shutdown()
-        conn.connect(vcenter.ip, vcenter.user, vcenter.password, vcenter.port)
-        for server in servers.servers:
-            vms = server.vm_order
-            current_host = conn.get_host_system(server.host.moid)
-            if not current_host:
-                event = MigrationErrorEvent("Server not found", f"Server '{server.host.name}' with moId {server.host.moid} not found")
-                event_queue.push(event)
-                continue
-            if current_host.runtime.powerState == vim.HostSystem.PowerState.poweredOff:
-                event = MigrationErrorEvent("Server off", f"Server '{server.host.name}' with moId {server.host.moid} is already off")
-                event_queue.push(event)
-                continue
-
-            dist_host = get_distant_host(conn, server)
-            for vm_moid in vms:
-                vm = conn.get_vm(vm_moid)
-                stop_result = vm_stop(vm, vm_moid)
-                if stop_result['result']['httpCode'] == 200:
-                    event = VMShutdownEvent(vm_moid, server.host.moid)
-                else:
-                    event = MigrationErrorEvent("VM won't stop", stop_result['result']['message'])
-                event_queue.push(event)
-                if not dist_host:
-                    continue
-
-                stop_result = vm_migration(vm, vm_moid, dist_host, server.destination.moid)
-                if stop_result['result']['httpCode'] == 200:
-                    event = VMMigrationEvent(vm_moid, server.host.moid)
-                    event_queue.push(event)
-                    stop_result = vm_start(vm, vm_moid)
-                    if stop_result['result']['httpCode'] == 200:
-                        event = VMStartedEvent(vm_moid, server.host.moid)
-                    else:
-                        event = MigrationErrorEvent("VM won't start", stop_result['result']['message'])
-                    event_queue.push(event)
-                else:
-                    event = MigrationErrorEvent("VM won't migrate", stop_result['result']['message'])
-                    event_queue.push(event)
-
-            stop_result = server_stop(server.host.ilo.ip, server.host.ilo.user, server.host.ilo.password)
-            if stop_result['result']['httpCode'] == 200:
-                event = ServerShutdownEvent(server.host.moid, server.host.ilo.ip, server.host.ilo.user, server.host.ilo.password)
-            else:
-                event = MigrationErrorEvent("Server won't stop", stop_result['result']['message'])
-            event_queue.push(event)
+        if not connected:
+            conn.connect(vcenter.ip, vcenter.user, vcenter.password, vcenter.port)
+        try:
+            graph.run(MAX_WORKERS)
+        finally:
+            log_critical_path(graph)
+            planner.save()
         event_queue.finish_shutdown()
 
+    except PlanCancelled:
+        signal(SIGTERM, previous_handler)
+        logging.info("Plan cancelled during the grace period")
+        rollback_preflight(servers, powered_on)
     except EventQueueException as e:
         event = MigrationErrorEvent("Database error", str(e))
-        event_queue.push(event)
+        event_queue.push_error(event)
     except vim.fault.InvalidLogin:
         event = MigrationErrorEvent("Invalid credentials", "Username or password is incorrect")
-        event_queue.push(event)
+        event_queue.push_error(event)
     except Exception as e:
         event = MigrationErrorEvent("Unknown error", str(e))
-        event_queue.push(event)
+        event_queue.push_error(event)
     finally:
+        signal(SIGTERM, previous_handler)
+        if monitor:
+            monitor.stop()
+        if task_monitor:
+            task_monitor.stop()
         event_queue.disconnect()
         conn.disconnect()
 
 
 if __name__ == "__main__":
+    logging.basicConfig(
+        filename='migration_plan.log',
+        level=logging.INFO,
+        format='%(asctime)s %(message)s',
+        datefmt='%d-%m-%Y %H:%M:%S'
+    )
+
     vcenter, ups_grace, servers = None, None, None
     try:
-        vcenter, ups_grace, servers = load_plan_from_yaml("plans/migration.yml")
+        vcenter, ups_grace, servers = load_plan("plans/migration.yml")
     except Exception as e:
         print(f"Error parsing YAML file: {e}")
     if vcenter and ups_grace and servers:
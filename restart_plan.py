@@ -1,90 +1,207 @@
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
 from pyVmomi import vim
 
+from data_retriever.host_readiness import HostReadinessWaiter
 from data_retriever.migration_event_queue import EventQueue, EventQueueException
 from data_retriever.migration_event import VMMigrationEvent, VMShutdownEvent, ServerShutdownEvent, VMStartedEvent, \
-    MigrationErrorEvent, ServerStartedEvent
+    MigrationErrorEvent, ServerStartedEvent, compact_events, remove_undone_events
+from data_retriever.plan_compiler import load_plan
+from data_retriever.task_monitor import TASK_TIMEOUT, TaskMonitor
 from data_retriever.vm_ware_connection import VMwareConnection
-from data_retriever.yaml_parser import VCenter, load_plan_from_yaml, UpsGrace
+from data_retriever.yaml_parser import VCenter, UpsGrace
 from server_start import server_start
 from vm_migration import vm_migration
 from vm_start import vm_start
 from vm_stop import vm_stop
 
 
+def wait_host(waiter: HostReadinessWaiter, event_queue: EventQueue, server_moid: str) -> bool:
+    """
+    Wait for a server to be connected to the vCenter before restoring its VMs
+    Args:
+        waiter (HostReadinessWaiter): The waiter following the connection state of the servers
+        event_queue (EventQueue): The queue where the events of the rollback are pushed
+        server_moid (str): The Managed Object ID of the server
+    Returns:
+        bool: True if the server is connected, False if it is not connected in time
+    Raises:
+        EventQueueException: If an event could not be pushed
+    """
+    if waiter.wait_ready(server_moid):
+        return True
+    event = MigrationErrorEvent("Server not ready", f"Server with moId {server_moid} is not connected to the vCenter")
+    event_queue.push(event, True)
+    return False
+
+
+def restart_servers(event_queue: EventQueue, waiter: HostReadinessWaiter, events: list[ServerShutdownEvent], wave_size: int,
+                    wave_delay: float):
+    """
+    Start the servers stopped by the migration plan, in waves to avoid a boot storm. The servers of a wave are started
+    at the same time, and the wait for their connection to the vCenter starts once they are powered on
+    Args:
+        event_queue (EventQueue): The queue where the events of the rollback are pushed
+        waiter (HostReadinessWaiter): The waiter following the connection state of the servers, armed for each server
+            started
+        events (list[ServerShutdownEvent]): The events of the servers stopped
+        wave_size (int): The number of servers of a wave, None to start every server at once
+        wave_delay (float): The delay between two waves, in seconds
+    Raises:
+        EventQueueException: If an event could not be pushed
+    """
+    wave_size = wave_size or max(len(events), 1)
+    try:
+        for i in range(0, len(events), wave_size):
+            if i > 0:
+                sleep(wave_delay)
+            wave = events[i:i + wave_size]
+            with ThreadPoolExecutor(max_workers=len(wave)) as executor:
+                results = list(executor.map(lambda e: server_start(e.ilo_ip, e.ilo_user, e.ilo_password), wave))
+            for event in wave:
+                waiter.arm(event.server_moid)
+            for event, start_result in zip(wave, results):
+                if start_result['result']['httpCode'] == 200:
+                    event_queue.push(ServerStartedEvent(event.server_moid), True)
+                else:
+                    event_queue.push(MigrationErrorEvent("Server won't start", start_result['result']['message']), True)
+    finally:
+        # The VMs of the servers not started are not waited for forever
+        for event in events:
+            waiter.arm(event.server_moid)
+
+
+def restore_vm(conn: VMwareConnection, event_queue: EventQueue, waiter: HostReadinessWaiter, event, task_monitor: TaskMonitor = None):
+    """
+    Undo the operation of the migration plan on a VM, once its server is connected to the vCenter
+    Args:
+        conn (VMwareConnection): The connection to the vCenter
+        event_queue (EventQueue): The queue where the events of the rollback are pushed
+        waiter (HostReadinessWaiter): The waiter following the connection state of the servers
+        event (VMShutdownEvent | VMMigrationEvent | VMStartedEvent): The event of the operation to undo
+        task_monitor (TaskMonitor): The monitor following the tasks of the VMs, None to wait for them in this thread
+    Raises:
+        EventQueueException: If an event could not be pushed
+    """
+    if not wait_host(waiter, event_queue, event.server_moid):
+        return
+    vm = conn.get_vm(event.vm_moid)
+    if isinstance(event, VMShutdownEvent):
+        start_result = vm_start(vm, event.vm_moid, task_monitor, TASK_TIMEOUT)
+        if start_result['result']['httpCode'] == 200:
+            event = VMStartedEvent(event.vm_moid, event.server_moid)
+        else:
+            event = MigrationErrorEvent("VM won't start", start_result['result']['message'])
+    elif isinstance(event, VMMigrationEvent):
+        target_host = conn.get_host_system(event.server_moid)
+        start_result = vm_migration(vm, event.vm_moid, target_host, event.server_moid, task_monitor, TASK_TIMEOUT)
+        if start_result['result']['httpCode'] == 200:
+            event = VMMigrationEvent(event.vm_moid, event.server_moid)
+        else:
+            event = MigrationErrorEvent("VM won't migrate", start_result['result']['message'])
+    else:
+        start_result = vm_stop(vm, event.vm_moid, task_monitor, TASK_TIMEOUT)
+        if start_result['result']['httpCode'] == 200:
+            event = VMShutdownEvent(event.vm_moid, event.server_moid)
+        else:
+            event = MigrationErrorEvent("VM won't stop", start_result['result']['message'])
+    event_queue.push(event, True)
+
+
+def restore_server_vms(conn: VMwareConnection, event_queue: EventQueue, waiter: HostReadinessWaiter, events: list,
+                       max_concurrency: int, task_monitor: TaskMonitor = None):
+    """
+    Undo the operations of the migration plan on the VMs of a server. Different VMs are restored at the same time, while
+    the operations of each VM are undone in the reverse order they were done
+    Args:
+        conn (VMwareConnection): The connection to the vCenter
+        event_queue (EventQueue): The queue where the events of the rollback are pushed
+        waiter (HostReadinessWaiter): The waiter following the connection state of the servers
+        events (list[VMShutdownEvent | VMMigrationEvent | VMStartedEvent]): The events of the server, latest first
+        max_concurrency (int): The maximum number of VMs restored at the same time
+        task_monitor (TaskMonitor): The monitor following the tasks of the VMs, None to wait for them in this thread
+    Raises:
+        EventQueueException: If an event could not be pushed
+    """
+    vm_events = {}  # Events of each VM, latest first, by VM moid
+    for event in events:
+        vm_events.setdefault(event.vm_moid, []).append(event)
+
+    def restore_vm_events(events_of_vm: list):
+        for event in events_of_vm:
+            restore_vm(conn, event_queue, waiter, event, task_monitor)
+
+    with ThreadPoolExecutor(max_workers=max(min(max_concurrency, len(vm_events)), 1), thread_name_prefix="restore-vm") as executor:
+        futures = [executor.submit(restore_vm_events, events_of_vm) for events_of_vm in vm_events.values()]
+        # Every VM is restored, the first error is reported once all of them are done
+        for future in futures:
+            future.result()
+
+
 def restart(vcenter: VCenter, ups_grace: UpsGrace):
     """
-    Launch the restart plan of all servers specified in `servers` to go back to the initial state
+    Launch the restart plan of all servers specified in `servers` to go back to the initial state.
+    Servers are started in waves of `ups_grace.restart_wave_size` servers, while the operations on the VMs of each
+    server are undone in parallel with the other servers, as soon as the server is connected to the vCenter, for up to
+    `ups_grace.restore_concurrency` VMs at a time. They are given up if it is not connected within
+    `ups_grace.host_ready_timeout` seconds of being powered on.
+    Events are compacted first, so that only the net change of each VM and server is undone, and those already undone by
+    an interrupted run of the rollback are skipped
     Args:
         vcenter (VCenter): The VCenter informations to connect to
         ups_grace (UpsGrace): The `UpsGrace` object containing graces periods to wait before shutdown and restart
     """
-    start_delay = ups_grace.restart_grace
     conn = VMwareConnection()
     event_queue = EventQueue()
+    waiter = None
+    task_monitor = None
     try:
         event_queue.connect()
         conn.connect(vcenter.ip, vcenter.user, vcenter.password, vcenter.port)
+        waiter = HostReadinessWaiter(conn.create_property_watcher(), ups_grace.host_ready_timeout)
+        waiter.start()
+        task_monitor = TaskMonitor(conn.create_property_watcher())
+        task_monitor.start()
         event_queue.start_restart()
-        events = event_queue.get_event_list()
+        events = compact_events(event_queue.get_event_list())
+        events = remove_undone_events(events, event_queue.get_event_list(rollback=True))
 
+        server_events = []
+        vm_events = {}  # Events of the VMs of each server, latest first, by server moid
         for event in events:
-            if isinstance(event, VMShutdownEvent):
-                vm = conn.get_vm(event.vm_moid)
-                target_host = conn.get_host_system(event.server_moid)
-                while target_host.runtime.connectionState != 'connected':
-                    sleep(start_delay)
-                start_result = vm_start(vm, event.vm_moid)
-                if start_result['result']['httpCode'] == 200:
-                    event = VMStartedEvent(event.vm_moid, event.server_moid)
-                else:
-                    event = MigrationErrorEvent("VM won't start", start_result['result']['message'])
-                event_queue.push(event, True)
-            elif isinstance(event, VMMigrationEvent):
-                vm = conn.get_vm(event.vm_moid)
-                target_host = conn.get_host_system(event.server_moid)
-                while target_host.runtime.connectionState != 'connected':
-                    sleep(start_delay)
-                start_result = vm_migration(vm, event.vm_moid, target_host, event.server_moid)
-                if start_result['result']['httpCode'] == 200:
-                    event = VMMigrationEvent(event.vm_moid, event.server_moid)
-                else:
-                    event = MigrationErrorEvent("VM won't migrate", start_result['result']['message'])
-                event_queue.push(event, True)
-            elif isinstance(event, VMStartedEvent):
-                vm = conn.get_vm(event.vm_moid)
-                target_host = conn.get_host_system(event.server_moid)
-                while target_host.runtime.connectionState != 'connected':
-                    sleep(start_delay)
-                start_result = vm_stop(vm, event.vm_moid)
-                if start_result['result']['httpCode'] == 200:
-                    event = VMShutdownEvent(event.vm_moid, event.server_moid)
-                else:
-                    event = MigrationErrorEvent("VM won't stop", start_result['result']['message'])
-                event_queue.push(event, True)
-            elif isinstance(event, ServerShutdownEvent):
-                start_result = server_start(event.ilo_ip, event.ilo_user, event.ilo_password)
-                if start_result['result']['httpCode'] == 200:
-                    event = ServerStartedEvent(event.server_moid)
-                else:
-                    event = MigrationErrorEvent("Server won't start", start_result['result']['message'])
-                event_queue.push(event, True)
+            if isinstance(event, ServerShutdownEvent):
+                server_events.append(event)
+            elif isinstance(event, (VMShutdownEvent, VMMigrationEvent, VMStartedEvent)):
+                vm_events.setdefault(event.server_moid, []).append(event)
             else:
                 event = MigrationErrorEvent("Unsupported event", f"Unknown event type: {event}")
                 event_queue.push(event, True)
-                continue
+
+        # The servers that were not stopped, or were already started by an interrupted rollback, are waited for right away
+        for server_moid in vm_events.keys() - {event.server_moid for event in server_events}:
+            waiter.arm(server_moid)
+        with ThreadPoolExecutor(max_workers=len(vm_events) + 1, thread_name_prefix="restore") as executor:
+            futures = [executor.submit(restart_servers, event_queue, waiter, server_events, ups_grace.restart_wave_size, ups_grace.restart_wave_delay)]
+            futures += [executor.submit(restore_server_vms, conn, event_queue, waiter, server_vm_events, ups_grace.restore_concurrency, task_monitor) for server_vm_events in vm_events.values()]
+            # Every server is restored, the first error is reported once all of them are done
+            for future in futures:
+                future.result()
         event_queue.finish_restart()
 
     except EventQueueException as e:
         event = MigrationErrorEvent("Database error", str(e))
-        event_queue.push(event)
+        event_queue.push_error(event)
     except vim.fault.InvalidLogin:
         event = MigrationErrorEvent("Invalid credentials", "Username or password is incorrect")
-        event_queue.push(event)
+        event_queue.push_error(event)
     except Exception as e:
         event = MigrationErrorEvent("Unknown error", str(e))
-        event_queue.push(event)
+        event_queue.push_error(event)
     finally:
+        if waiter:
+            waiter.stop()
+        if task_monitor:
+            task_monitor.stop()
         event_queue.disconnect()
         conn.disconnect()
 
@@ -92,7 +209,7 @@ def restart(vcenter: VCenter, ups_grace: UpsGrace):
 if __name__ == "__main__":
     vcenter, ups_grace = None, None
     try:
-        vcenter, ups_grace, _ = load_plan_from_yaml("plans/migration.yml")
+        vcenter, ups_grace, _ = load_plan("plans/migration.yml")
     except Exception as e:
         print(f"Error parsing YAML file: {e}")
     if vcenter and ups_grace:
@@ -27,7 +27,11 @@ PID=$(pgrep -f "python.*migration_plan\.py$")
 if [ -n "$PID" ]; then
     echo "Killing migration_plan.py (PID $PID)..."
     kill "$PID"
-    sleep 2
+    # Leave time to stop the distant servers started during the grace period
+    for _ in $(seq 30); do
+        kill -0 "$PID" 2>/dev/null || break
+        sleep 1
+    done
     if kill -0 "$PID" 2>/dev/null; then
         echo "Process $PID still running, forcing termination..."
         kill -9 "$PID"
@@ -2,6 +2,15 @@
 
 # Usage: ./server_metrics.sh --moid <MOID> --ip <IP> --user <USER> --password <PASS> [--port <PORT>]
 
+if [ -n "$UPS_MANAGER_URL" ]; then
+    ./command_client.sh server_metrics "$@"
+    CODE=$?
+    # 7: command server unreachable, run the command locally instead
+    if [ "$CODE" -ne 7 ]; then
+        exit "$CODE"
+    fi
+fi
+
 if [ ! -f .venv/bin/activate ]; then
     echo "ERROR: Virtual environment not found at .venv/bin/activate"
     exit 1
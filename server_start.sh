@@ -2,6 +2,15 @@
 
 # Usage: ./server_start.sh --ip <IP> --user <USER> --password <PASS>
 
+if [ -n "$UPS_MANAGER_URL" ]; then
+    ./command_client.sh server_start "$@"
+    CODE=$?
+    # 7: command server unreachable, run the command locally instead
+    if [ "$CODE" -ne 7 ]; then
+        exit "$CODE"
+    fi
+fi
+
 if [ ! -f .venv/bin/activate ]; then
     echo "ERROR: Virtual environment not found at .venv/bin/activate"
     exit 1
@@ -0,0 +1,45 @@
+import pytest
+
+from data_retriever import decrypt_password
+from data_retriever.decrypt_password import DecryptionException, decrypt, decrypt_all, encrypt
+
+
+@pytest.fixture
+def derivations(monkeypatch):
+    """ Count the key derivations, with an empty key cache """
+    secrets = []
+    scrypt = decrypt_password.scrypt
+
+    def counting_scrypt(secret_key, *args, **kwargs):
+        secrets.append(secret_key)
+        return scrypt(secret_key, *args, **kwargs)
+
+    monkeypatch.setattr(decrypt_password, "scrypt", counting_scrypt)
+    monkeypatch.setenv("ENCRYPTION_KEY", "secret")
+    decrypt_password._derive_key.cache_clear()
+    yield secrets
+    decrypt_password._derive_key.cache_clear()
+
+
+def test_key_is_derived_once_per_secret(derivations, monkeypatch):
+    encrypted = [encrypt(password) for password in ["a", "b", "c"]]
+    assert decrypt_all(encrypted) == ["a", "b", "c"]
+    assert derivations == ["secret"]
+
+    monkeypatch.setenv("ENCRYPTION_KEY", "other")
+    with pytest.raises(DecryptionException):
+        decrypt(encrypted[0])
+    assert derivations == ["secret", "other"]
+
+
+def test_decrypt_all_decrypts_identical_passwords_once(derivations, monkeypatch):
+    encrypted = encrypt("password")
+    calls = []
+
+    def counting_decrypt(value):
+        calls.append(value)
+        return decrypt(value)
+
+    monkeypatch.setattr(decrypt_password, "decrypt", counting_decrypt)
+    assert decrypt_all([encrypted, encrypted]) == ["password", "password"]
+    assert calls == [encrypted]
@@ -0,0 +1,65 @@
+from data_retriever.migration_event import VMMigrationEvent, VMShutdownEvent, VMStartedEvent, ServerShutdownEvent, \
+    ServerStartedEvent, MigrationErrorEvent, compact_events, remove_undone_events
+
+
+def server_stopped(server_moid: str) -> ServerShutdownEvent:
+    return ServerShutdownEvent(server_moid, "10.0.0.1", "admin", "password")
+
+
+def test_migrated_vm_is_stopped_migrated_back_and_started():
+    events = [
+        VMStartedEvent("vm-1", "host-1"),
+        VMMigrationEvent("vm-1", "host-1"),
+        VMShutdownEvent("vm-1", "host-1"),
+    ]
+    assert compact_events(events) == [
+        VMStartedEvent("vm-1", "host-1"),
+        VMMigrationEvent("vm-1", "host-1"),
+        VMShutdownEvent("vm-1", "host-1"),
+    ]
+
+
+def test_vm_migrated_but_not_started_is_migrated_back_and_started():
+    events = [VMMigrationEvent("vm-1", "host-1"), VMShutdownEvent("vm-1", "host-1")]
+    assert compact_events(events) == [VMMigrationEvent("vm-1", "host-1"), VMShutdownEvent("vm-1", "host-1")]
+
+
+def test_vm_stopped_and_started_again_by_two_runs_is_left_as_is():
+    events = [
+        VMShutdownEvent("vm-1", "host-1"),
+        VMStartedEvent("vm-1", "host-1"),
+        VMShutdownEvent("vm-1", "host-1"),
+    ]
+    assert compact_events(events) == [VMShutdownEvent("vm-1", "host-1")]
+    assert compact_events(events[1:]) == []
+
+
+def test_servers_come_first_and_other_events_last():
+    error = MigrationErrorEvent("VM won't migrate", "No compatible host")
+    events = [
+        server_stopped("host-1"),
+        error,
+        VMShutdownEvent("vm-1", "host-1"),
+        ServerStartedEvent("host-2"),
+        server_stopped("host-2"),
+    ]
+    assert compact_events(events) == [server_stopped("host-1"), VMShutdownEvent("vm-1", "host-1"), error]
+
+
+def test_events_undone_by_a_previous_rollback_are_removed_in_order():
+    events = [
+        server_stopped("host-1"),
+        VMStartedEvent("vm-1", "host-1"),
+        VMMigrationEvent("vm-1", "host-1"),
+        VMShutdownEvent("vm-1", "host-1"),
+        VMShutdownEvent("vm-2", "host-1"),
+    ]
+    rollback_events = [
+        VMMigrationEvent("vm-1", "host-1"),
+        VMShutdownEvent("vm-1", "host-1"),
+        ServerStartedEvent("host-1"),
+    ]
+    assert remove_undone_events(events, rollback_events) == [
+        VMShutdownEvent("vm-1", "host-1"),
+        VMShutdownEvent("vm-2", "host-1"),
+    ]
@@ -0,0 +1,168 @@
+from json import dumps as json_dumps, loads as json_loads
+import pytest
+
+from data_retriever import migration_event_queue
+from data_retriever.migration_event import ActionType, MigrationErrorEvent, VMShutdownEvent
+from data_retriever.migration_event_queue import EventQueue, EventQueueException
+
+
+class FakePostgres:
+    """ In-memory "history_event" table, standing for the Postgres connection and its cursor """
+    def __init__(self):
+        self.rows = []  # ("entityId", "action", "metadata", "createdAt") of each inserted row
+        self._selected = []
+
+    def connect(self, **kwargs):
+        return self
+
+    def cursor(self):
+        return self
+
+    def execute_values(self, cursor, query, rows, template=None):
+        self.rows.extend(rows)
+
+    def execute(self, query, params):
+        # "metadata" is a jsonb column
+        self._selected = [(action, json_loads(metadata)) for entity_id, action, metadata, _ in reversed(self.rows) if entity_id == params[0]]
+
+    def fetchall(self):
+        return self._selected
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def postgres(tmp_path, monkeypatch):
+    db = FakePostgres()
+    monkeypatch.setattr(migration_event_queue, "postgres", db.connect)
+    monkeypatch.setattr(migration_event_queue, "execute_values", db.execute_values)
+    monkeypatch.setattr(migration_event_queue, "SAVED_MIGRATION_ID", str(tmp_path / "migration_id"))
+    monkeypatch.setattr(migration_event_queue, "SAVED_MIGRATION_STATUS", str(tmp_path / "migration_status"))
+    monkeypatch.setattr(migration_event_queue, "WRITE_INTERVAL", 0.01)
+    return db
+
+
+def run_migration(wal_path: str, vm_moid: str):
+    queue = EventQueue(wal_path)
+    queue.connect()
+    queue.grace_shutdown()
+    queue.start_shutdown()
+    queue.push(VMShutdownEvent(vm_moid, "host-1"))
+    queue.finish_shutdown()
+    queue.disconnect()
+
+
+def wal_row(seq: int, vm_moid: str) -> str:
+    return json_dumps({
+        "seq": seq,
+        "entityId": "migration-1",
+        "action": ActionType.VM_STOPPED,
+        "metadata": json_dumps({"vm_moid": vm_moid}),
+        "createdAt": "2026-01-01T00:00:00",
+    }) + "\n"
+
+
+def stopped_vms(db: FakePostgres) -> list[tuple[str, str]]:
+    return [(entity_id, metadata) for entity_id, action, metadata, _ in db.rows if action == ActionType.VM_STOPPED]
+
+
+def test_migrations_are_added_to_the_saved_migration_until_it_is_rolled_back(postgres, tmp_path):
+    wal_path = str(tmp_path / "events.wal")
+    run_migration(wal_path, "vm-1")
+    run_migration(wal_path, "vm-2")
+
+    queue = EventQueue(wal_path)
+    queue.connect()
+    assert not queue.migration_interrupted()
+    queue.start_restart()
+    assert {event.vm_moid for event in queue.get_event_list()} == {"vm-1", "vm-2"}
+    queue.finish_restart()
+    queue.disconnect()
+
+    run_migration(wal_path, "vm-3")
+    (first_id, _), (second_id, _), (third_id, _) = stopped_vms(postgres)
+    assert first_id == second_id
+    assert third_id != first_id
+
+
+def test_interrupted_migration_is_resumed(postgres, tmp_path):
+    wal_path = str(tmp_path / "events.wal")
+    queue = EventQueue(wal_path)
+    queue.connect()
+    queue.start_shutdown()
+    queue.push(VMShutdownEvent("vm-1", "host-1"))
+    queue.disconnect()
+
+    queue = EventQueue(wal_path)
+    queue.connect()
+    assert queue.migration_interrupted()
+    queue.start_shutdown()
+    queue.push(VMShutdownEvent("vm-2", "host-1"))
+    queue.finish_shutdown()
+    assert not queue.migration_interrupted()
+    queue.disconnect()
+
+    (first_id, _), (second_id, _) = stopped_vms(postgres)
+    assert first_id == second_id
+
+
+def test_push_requires_a_started_migration(postgres, tmp_path, caplog):
+    queue = EventQueue(str(tmp_path / "events.wal"))
+    queue.connect()
+    with pytest.raises(EventQueueException):
+        queue.push(VMShutdownEvent("vm-1", "host-1"))
+    queue.push_error(MigrationErrorEvent("Unknown error", "vCenter unreachable"))
+    queue.disconnect()
+
+    assert not (tmp_path / "migration_id").exists()
+    assert "vCenter unreachable" in caplog.text
+    assert postgres.rows == []
+
+
+def test_rows_after_the_high_water_mark_are_written_and_the_torn_row_is_dropped(postgres, tmp_path):
+    wal_path = tmp_path / "events.wal"
+    wal_path.write_text(wal_row(1, "vm-1") + wal_row(2, "vm-2") + wal_row(3, "vm-3") + wal_row(4, "vm-4")[:20])
+    (tmp_path / "events.wal.ack").write_text("1")
+
+    queue = EventQueue(str(wal_path))
+    queue.connect()
+    assert queue.flush()
+    assert [json_loads(metadata)["vm_moid"] for _, metadata in stopped_vms(postgres)] == ["vm-2", "vm-3"]
+    assert (tmp_path / "events.wal.ack").read_text() == "3"
+
+    # The sequence continues after the last complete row
+    queue.start_shutdown()
+    queue.disconnect()
+    assert (tmp_path / "events.wal.ack").read_text() == "4"
+    assert wal_path.read_bytes() == b""
+
+
+def test_rows_stay_in_the_log_while_postgres_is_unreachable(postgres, tmp_path, monkeypatch):
+    def unreachable(**kwargs):
+        raise ConnectionError("Postgres unreachable")
+
+    monkeypatch.setattr(migration_event_queue, "postgres", unreachable)
+    monkeypatch.setattr(migration_event_queue, "WRITE_RETRY_DELAY", 0.01)
+    # `disconnect` waits for the writer at most the default flush timeout
+    monkeypatch.setattr(EventQueue.flush, "__defaults__", (0.05,))
+    wal_path = tmp_path / "events.wal"
+    queue = EventQueue(str(wal_path))
+    queue.connect()
+    queue.start_shutdown()
+    queue.push(VMShutdownEvent("vm-1", "host-1"))
+    assert not queue.flush()
+    queue.disconnect()
+    assert [json_loads(line)["seq"] for line in wal_path.read_bytes().splitlines()] == [1, 2]
+
+    monkeypatch.setattr(migration_event_queue, "postgres", postgres.connect)
+    queue = EventQueue(str(wal_path))
+    queue.connect()
+    assert queue.flush()
+    queue.disconnect()
+    assert [vm["vm_moid"] for vm in (json_loads(metadata) for _, metadata in stopped_vms(postgres))] == ["vm-1"]
+    assert (tmp_path / "events.wal.ack").read_text() == "2"
+    assert wal_path.read_bytes() == b""
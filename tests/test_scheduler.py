@@ -0,0 +1,80 @@
+import pytest
+
+from data_retriever import scheduler
+from data_retriever.scheduler import Scheduler
+
+
+class Clock:
+    """ Wall clock moved by the tests """
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(100.3)
+    monkeypatch.setattr(scheduler, "time", clock)
+    return clock
+
+
+def test_jobs_run_at_once_then_on_multiples_of_their_interval(clock):
+    ticks = []
+    jobs = Scheduler()
+    jobs.add_job("state", 10, ticks.append)
+    jobs.run_pending()
+    assert ticks == [100.3]
+    assert jobs.delay() == pytest.approx(9.7)
+
+    clock.now = 109.9
+    jobs.run_pending()
+    assert ticks == [100.3]
+
+    clock.now = 110.4
+    jobs.run_pending()
+    assert ticks == [100.3, 110]
+
+
+def test_overrun_ticks_are_skipped_and_reported(clock):
+    ticks = []
+    overruns = []
+
+    def collect(tick):
+        ticks.append(tick)
+        clock.now += 25
+
+    jobs = Scheduler(on_overrun=lambda name, missed: overruns.append((name, missed)))
+    jobs.add_job("state", 10, collect)
+    jobs.run_pending()
+    assert overruns == [("state", 2)]
+    assert jobs.delay() == pytest.approx(130 - 125.3)
+
+    clock.now = 130
+    jobs.run_pending()
+    assert ticks == [100.3, 130]
+
+
+def test_clock_going_backwards_runs_the_job_again_at_once(clock):
+    ticks = []
+
+    def collect(tick):
+        ticks.append(tick)
+        clock.now = 50
+
+    jobs = Scheduler()
+    jobs.add_job("state", 10, collect)
+    jobs.run_pending()
+    assert jobs.delay() == 0
+
+
+def test_due_jobs_run_in_the_order_they_were_added(clock):
+    runs = []
+    jobs = Scheduler()
+    jobs.add_job("state", 20, lambda tick: runs.append("state"))
+    jobs.add_job("history", 60, lambda tick: runs.append("history"))
+    jobs.run_pending()
+    clock.now = 120
+    jobs.run_pending()
+    assert runs == ["state", "history", "state", "history"]
@@ -0,0 +1,156 @@
+from threading import Lock
+from time import sleep
+import pytest
+
+from data_retriever.task_graph import TaskGraph, topological_order
+
+
+class Recorder:
+    """ Record the order the tasks start in """
+    def __init__(self):
+        self.started = []
+        self._lock = Lock()
+
+    def task(self, name: str, duration: float = 0.01):
+        def callback():
+            with self._lock:
+                self.started.append(name)
+            sleep(duration)
+        return callback
+
+
+class Concurrency:
+    """ Record the highest number of tasks running at the same time by key, and of keys with running tasks """
+    def __init__(self):
+        self.running = {}
+        self.peak = {}
+        self.peak_keys = 0
+        self._lock = Lock()
+
+    def task(self, *keys: str, duration: float = 0.05):
+        def callback():
+            with self._lock:
+                for key in keys:
+                    self.running[key] = self.running.get(key, 0) + 1
+                    self.peak[key] = max(self.peak.get(key, 0), self.running[key])
+                self.peak_keys = max(self.peak_keys, len([key for key, count in self.running.items() if count]))
+            sleep(duration)
+            with self._lock:
+                for key in keys:
+                    self.running[key] -= 1
+        return callback
+
+
+def test_tasks_start_after_their_dependencies():
+    recorder = Recorder()
+    graph = TaskGraph()
+    graph.add_task("stop-server", recorder.task("stop-server"), ["stop vm-1", "stop vm-2"])
+    graph.add_task("stop vm-2", recorder.task("stop vm-2"), ["stop vm-1"])
+    graph.add_task("stop vm-1", recorder.task("stop vm-1"))
+    graph.run(max_workers=4)
+    assert recorder.started == ["stop vm-1", "stop vm-2", "stop-server"]
+
+
+def test_ready_tasks_start_by_priority():
+    recorder = Recorder()
+    graph = TaskGraph()
+    for name, priority in [("c", (2,)), ("a", (0,)), ("b", (1,))]:
+        graph.add_task(name, recorder.task(name), priority=priority)
+    graph.run(max_workers=1)
+    assert recorder.started == ["a", "b", "c"]
+
+
+def test_cycles_are_rejected_before_any_task_runs():
+    recorder = Recorder()
+    graph = TaskGraph()
+    graph.add_task("a", recorder.task("a"), ["b"])
+    graph.add_task("b", recorder.task("b"), ["a"])
+    graph.add_task("c", recorder.task("c"))
+    with pytest.raises(ValueError, match="cycle"):
+        graph.run(max_workers=2)
+    assert recorder.started == []
+
+
+def test_unknown_dependencies_are_rejected():
+    with pytest.raises(ValueError, match="unknown"):
+        topological_order({"a": ["missing"]})
+
+
+def test_duplicate_tasks_are_rejected():
+    graph = TaskGraph()
+    graph.add_task("a", lambda: None)
+    with pytest.raises(ValueError):
+        graph.add_task("a", lambda: None)
+
+
+def test_failed_task_does_not_stop_the_other_tasks():
+    recorder = Recorder()
+    done = []
+
+    def fail():
+        raise RuntimeError("vCenter unreachable")
+
+    graph = TaskGraph(on_task_done=done.append)
+    graph.add_task("a", fail)
+    graph.add_task("b", recorder.task("b"), ["a"])
+    graph.add_task("c", recorder.task("c"))
+    with pytest.raises(RuntimeError, match="vCenter unreachable"):
+        graph.run(max_workers=2)
+    assert sorted(recorder.started) == ["b", "c"]
+    assert sorted(done) == ["a", "b", "c"]
+
+
+def test_critical_path_follows_the_dependency_done_last():
+    recorder = Recorder()
+    graph = TaskGraph()
+    graph.add_task("short", recorder.task("short", 0.01))
+    graph.add_task("long", recorder.task("long", 0.1))
+    graph.add_task("last", recorder.task("last"), ["short", "long"])
+    graph.run(max_workers=2)
+    assert [name for name, _ in graph.critical_path()] == ["long", "last"]
+
+
+def test_at_most_max_groups_groups_are_in_progress():
+    concurrency = Concurrency()
+    graph = TaskGraph(max_groups=2)
+    for server in ["host-1", "host-2", "host-3"]:
+        graph.add_task(f"stop {server} vm-1", concurrency.task(server), group=server)
+        graph.add_task(f"stop {server} vm-2", concurrency.task(server), [f"stop {server} vm-1"], group=server)
+    graph.run(max_workers=6)
+    assert concurrency.peak_keys == 2
+
+
+def test_group_limit_does_not_block_a_group_waiting_for_another_one():
+    recorder = Recorder()
+    graph = TaskGraph(max_groups=1)
+    graph.add_task("a1", recorder.task("a1"), group="a")
+    graph.add_task("a2", recorder.task("a2"), ["b1"], group="a")
+    graph.add_task("b1", recorder.task("b1"), group="b")
+    graph.run(max_workers=2)
+    assert recorder.started == ["a1", "b1", "a2"]
+
+
+def test_pool_limits_cap_the_tasks_running_at_the_same_time():
+    concurrency = Concurrency()
+    graph = TaskGraph()
+    graph.set_pool_limit("host host-1", 2)
+    graph.set_pool_limit("host host-2", 2)
+    graph.set_pool_limit("destination host-3", 1)
+    for server in ["host-1", "host-2"]:
+        for vm in range(4):
+            pools = [f"host {server}", "destination host-3"]
+            graph.add_task(f"migrate {server} vm-{vm}", concurrency.task(f"host {server}", "destination host-3"), pools=pools)
+            graph.add_task(f"stop {server} vm-{vm}", concurrency.task(f"host {server}"), pools=[f"host {server}"])
+    graph.run(max_workers=8)
+    assert concurrency.peak["host host-1"] == 2
+    assert concurrency.peak["host host-2"] == 2
+    assert concurrency.peak["destination host-3"] == 1
+
+
+def test_pool_limit_is_at_least_one():
+    recorder = Recorder()
+    graph = TaskGraph()
+    graph.set_pool_limit("host host-1", 0)
+    graph.add_task("a", recorder.task("a"), pools=["host host-1"])
+    graph.run(max_workers=1)
+    assert recorder.started == ["a"]
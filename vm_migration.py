@@ -1,15 +1,19 @@
 from argparse import ArgumentParser
+from concurrent.futures import Future
+from functools import partial
 from pyVmomi import vim
-from pyVim.task import WaitForTask
 import socket
 
+from data_retriever.batch import BATCH_CONCURRENCY, read_moids, run_batch
 from data_retriever.dto import result_message, output
+from data_retriever.task_monitor import TASK_TIMEOUT, TaskMonitor, resolved, wait_task
 from data_retriever.vm_ware_connection import VMwareConnection
 from vm_start import vm_start
 from vm_stop import vm_stop
 
 
-def vm_migration(vm: vim.VirtualMachine, vm_name: str, target_host: vim.HostSystem, target_moid: str) -> dict:
+def vm_migration(vm: vim.VirtualMachine, vm_name: str, target_host: vim.HostSystem, target_moid: str, monitor: TaskMonitor = None,
+                 timeout: float = None) -> dict:
     """
     Migrate a VM to a different host
     Args:
@@ -17,20 +21,40 @@ def vm_migration(vm: vim.VirtualMachine, vm_name: str, target_host: vim.HostSyst
         vm_name (str): The name of the VM to migrate for logging
         target_host (vim.HostSystem): The `HostSystem` object representing the server to migrate to
         target_moid (str): The Managed Object ID of the server to migrate to
+        monitor (TaskMonitor): The monitor following the task of the VM, None to wait for it in this thread
+        timeout (float): Maximum time to wait for the VM to be migrated when followed by `monitor`, in seconds
     Returns:
         dict: A dictionary formatted for json dump containing the result message. See result_message() function in dto.py
     """
+    return vm_migration_async(vm, vm_name, target_host, target_moid, monitor, timeout).result()
+
+
+def vm_migration_async(vm: vim.VirtualMachine, vm_name: str, target_host: vim.HostSystem, target_moid: str,
+                       monitor: TaskMonitor = None, timeout: float = None) -> Future:
+    """
+    Migrate a VM to a different host, without waiting for it when a task monitor is given, so that many VMs can be
+    migrated at once
+    Args:
+        vm (vim.VirtualMachine): The `VirtualMachine` object representing the VM to migrate
+        vm_name (str): The name of the VM to migrate for logging
+        target_host (vim.HostSystem): The `HostSystem` object representing the server to migrate to
+        target_moid (str): The Managed Object ID of the server to migrate to
+        monitor (TaskMonitor): The monitor following the task of the VM, None to wait for it in this thread
+        timeout (float): Maximum time to wait for the VM to be migrated when followed by `monitor`, in seconds
+    Returns:
+        Future: Resolved with the result message (see vm_migration())
+    """
     try:
         if not vm:
-            return result_message(f"VM '{vm_name}' not found", 404)
+            return resolved(result_message(f"VM '{vm_name}' not found", 404))
         if vm.runtime.host._moId == target_moid:
-            return result_message(f"VM '{vm_name}' is already on this server", 403)
+            return resolved(result_message(f"VM '{vm_name}' is already on this server", 403))
         if not target_host:
-            return result_message(f"Target server '{target_moid}' not found", 404)
+            return resolved(result_message(f"Target server '{target_moid}' not found", 404))
         if target_host.runtime.powerState == vim.HostSystem.PowerState.poweredOff:
-            return result_message(f"Target server '{target_moid}' is off. Turn it on before launching a migration", 403)
+            return resolved(result_message(f"Target server '{target_moid}' is off. Turn it on before launching a migration", 403))
         if vm.runtime.powerState == vim.VirtualMachinePowerState.poweredOn:
-            return result_message(f"VM '{vm_name}' is started and can't migrate in that state", 403)
+            return resolved(result_message(f"VM '{vm_name}' is started and can't migrate in that state", 403))
 
         target_resource_pool = target_host.parent.resourcePool
         task = vm.Migrate(
@@ -38,48 +62,84 @@ def vm_migration(vm: vim.VirtualMachine, vm_name: str, target_host: vim.HostSyst
             host=target_host,
             priority=vim.VirtualMachine.MovePriority.defaultPriority
         )
-        WaitForTask(task)
-        return result_message(f"VM '{vm_name}' migrated successfully", 200)
+    except Exception as err:
+        return resolved(_migration_error(vm_name, err))
+    return wait_task(task, monitor, result_message(f"VM '{vm_name}' migrated successfully", 200),
+                     partial(_migration_error, vm_name), timeout)
 
-    except (vim.fault.NoCompatibleHost, vim.fault.InvalidHostState, OSError, socket.error):
+
+def _migration_error(vm_name: str, err: Exception) -> dict:
+    """
+    Get the result message of a VM that couldn't be migrated
+    Args:
+        vm_name (str): The name of the VM for logging
+        err (Exception): The error raised while creating the task, or the fault of the task
+    Returns:
+        dict: A dictionary formatted for json dump containing the result message. See result_message() function in dto.py
+    """
+    if isinstance(err, TimeoutError):
+        return result_message(f"VM '{vm_name}' is still migrating", 408)
+    if isinstance(err, (vim.fault.NoCompatibleHost, vim.fault.InvalidHostState, OSError, socket.error)):
         return result_message("Host is unreachable", 404)
-    except vim.fault.TaskInProgress:
+    if isinstance(err, vim.fault.TaskInProgress):
         return result_message(f"VM '{vm_name}' is busy", 403)
-    except (vim.fault.InvalidPowerState, vim.fault.VimFault):
+    if isinstance(err, (vim.fault.InvalidPowerState, vim.fault.VimFault)):
         return result_message(f"VM '{vm_name}' can't be migrated", 403)
-    except Exception as err:
-        return result_message(str(err), 400)
+    return result_message(str(err), 400)
 
 
-def complete_vm_migration(vm_moid: str, dist_moid: str,  ip: str, user: str, password: str, port: int) -> dict:
+def migrate_started_vm(vm: vim.VirtualMachine, vm_moid: str, target_host: vim.HostSystem, dist_moid: str, monitor: TaskMonitor = None,
+                       timeout: float = None) -> dict:
     """
-    Migrate a VM to a different host by creating a connection to the VCenter
+    Migrate a VM to a different host, stopping it before and starting it after the migration. The VM is started again
+    if the migration fails
     Args:
+        vm (vim.VirtualMachine): The `VirtualMachine` object representing the VM to migrate
         vm_moid (str): The Managed Object ID of the VM to migrate
+        target_host (vim.HostSystem): The `HostSystem` object representing the server to migrate to
+        dist_moid (str): The Managed Object ID of the server where to migrate the VM
+        monitor (TaskMonitor): The monitor following the tasks of the VM, None to wait for them in this thread
+        timeout (float): Maximum time to wait for each task of the VM when followed by `monitor`, in seconds
+    Returns:
+        dict: A dictionary formatted for json dump containing the result message. See result_message() function in dto.py
+    """
+    vm_stop(vm, vm_moid, monitor, timeout)
+    result = vm_migration(vm, vm_moid, target_host, dist_moid, monitor, timeout)
+    if result['result']['httpCode'] != 200:
+        vm_start(vm, vm_moid, monitor, timeout)
+        return result
+
+    result = vm_start(vm, vm_moid, monitor, timeout)
+    if result['result']['httpCode'] != 200:
+        return result
+    return result_message(f"VM '{vm_moid}' migrated successfully", 200)
+
+
+def complete_vm_migration(vm_moid: str | list[str], dist_moid: str,  ip: str, user: str, password: str, port: int,
+                          max_concurrency: int = BATCH_CONCURRENCY) -> dict:
+    """
+    Migrate one or several VMs to a different host by creating a connection to the VCenter
+    Args:
+        vm_moid (str | list[str]): The Managed Object ID of the VM to migrate, or a list of them to migrate several VMs at once
         dist_moid (str): The Managed Object ID of the server where to migrate the VM
         ip (str): The ip of the VCenter to connect to
         user (str): The username of the VCenter to connect to
         password (str): The password of the VCenter to connect to
         port (int): The port to use to connect to the VCenter
+        max_concurrency (int): The maximum number of VMs handled at the same time, for a list of VMs
     Returns:
-        dict: A dictionary formatted for json dump containing the result message. See result_message() function in dto.py
+        dict: A dictionary formatted for json dump containing the result message, or the result message of each VM for a
+            list of VMs (see run_batch() in batch.py). See result_message() function in dto.py
     """
     conn = VMwareConnection()
     try:
         conn.connect(ip, user, password, port=port)
-        vm = conn.get_vm(vm_moid)
         target_host = conn.get_host_system(dist_moid)
+        if isinstance(vm_moid, list):
+            return run_batch(conn, vm_moid, lambda moid, monitor: migrate_started_vm(conn.get_vm(moid), moid, target_host, dist_moid, monitor, TASK_TIMEOUT), max_concurrency)
+        vm = conn.get_vm(vm_moid)
 
-        vm_stop(vm, vm_moid)
-        result = vm_migration(vm, vm_moid, target_host, dist_moid)
-        if result['result']['httpCode'] != 200:
-            vm_start(vm, vm_moid)
-            return result
-
-        result = vm_start(vm, vm_moid)
-        if result['result']['httpCode'] != 200:
-            return result
-        return result_message(f"VM '{vm_moid}' migrated successfully", 200)
+        return migrate_started_vm(vm, vm_moid, target_host, dist_moid)
 
     except vim.fault.InvalidLogin:
         return result_message("Invalid credentials", 401)
@@ -90,14 +150,20 @@ def complete_vm_migration(vm_moid: str, dist_moid: str,  ip: str, user: str, pas
 
 
 if __name__ == "__main__":
-    parser = ArgumentParser(description="Migrer une VM")
-    parser.add_argument("--vm_moid", required=True, help="Le Managed Object ID de la VM")
+    parser = ArgumentParser(description="Migrer une ou plusieurs VM")
+    parser.add_argument("--vm_moid", nargs="+", help="Le ou les Managed Object ID des VM")
+    parser.add_argument("--file", help="Fichier contenant un Managed Object ID de VM par ligne, - pour l'entrée standard")
     parser.add_argument("--dist_moid", required=True, help="Le Managed Object ID du serveur ESXi destination")
     parser.add_argument("--ip", required=True, help="Adresse IP du vCenter")
     parser.add_argument("--user", required=True, help="Nom d'utilisateur du vCenter")
     parser.add_argument("--password", required=True, help="Mot de passe de l'utilisateur du vCenter")
     parser.add_argument("--port", type=int, default=443, help="Port du vCenter (optionnel, 443 par défaut)")
+    parser.add_argument("--max_concurrency", type=int, default=BATCH_CONCURRENCY, help=f"Nombre maximum de VM traitées en même temps (optionnel, {BATCH_CONCURRENCY} par défaut)")
 
     args = parser.parse_args()
+    if not args.vm_moid and not args.file:
+        parser.error("--vm_moid ou --file est requis")
 
-    output(complete_vm_migration(args.vm_moid, args.dist_moid, args.ip, args.user, args.password, args.port))
+    vm_moids = read_moids(args.vm_moid, args.file)
+    vm_moid = vm_moids[0] if len(vm_moids) == 1 and not args.file else vm_moids
+    output(complete_vm_migration(vm_moid, args.dist_moid, args.ip, args.user, args.password, args.port, args.max_concurrency))
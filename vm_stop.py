@@ -1,56 +1,92 @@
 from argparse import ArgumentParser
+from concurrent.futures import Future
+from functools import partial
 from pyVmomi import vim
-from pyVim.task import WaitForTask
 import socket
 
+from data_retriever.batch import BATCH_CONCURRENCY, read_moids, run_batch
 from data_retriever.dto import result_message, output
+from data_retriever.task_monitor import TASK_TIMEOUT, TaskMonitor, resolved, wait_task
 from data_retriever.vm_ware_connection import VMwareConnection
 
 
-def vm_stop(vm: vim.VirtualMachine, name: str) -> dict:
+def vm_stop(vm: vim.VirtualMachine, name: str, monitor: TaskMonitor = None, timeout: float = None) -> dict:
     """
     Stop a VM
     Args:
         vm (vim.VirtualMachine): The `VirtualMachine` object representing the VM to stop
         name (str): The name of the VM to stop for logging
+        monitor (TaskMonitor): The monitor following the task of the VM, None to wait for it in this thread
+        timeout (float): Maximum time to wait for the VM to be stopped when followed by `monitor`, in seconds
     Returns:
         dict: A dictionary formatted for json dump containing the result message. See result_message() function in dto.py
     """
+    return vm_stop_async(vm, name, monitor, timeout).result()
+
+
+def vm_stop_async(vm: vim.VirtualMachine, name: str, monitor: TaskMonitor = None, timeout: float = None) -> Future:
+    """
+    Stop a VM, without waiting for it when a task monitor is given, so that many VMs can be stopped at once
+    Args:
+        vm (vim.VirtualMachine): The `VirtualMachine` object representing the VM to stop
+        name (str): The name of the VM to stop for logging
+        monitor (TaskMonitor): The monitor following the task of the VM, None to wait for it in this thread
+        timeout (float): Maximum time to wait for the VM to be stopped when followed by `monitor`, in seconds
+    Returns:
+        Future: Resolved with the result message (see vm_stop())
+    """
     try:
         if not vm:
-            return result_message(f"VM '{name}' not found", 404)
+            return resolved(result_message(f"VM '{name}' not found", 404))
         if vm.runtime.powerState == vim.VirtualMachinePowerState.poweredOff:
-            return result_message(f"VM '{name}' is already off", 403)
+            return resolved(result_message(f"VM '{name}' is already off", 403))
 
         task = vm.PowerOff()
-        WaitForTask(task)
-        return result_message(f"VM '{name}' has been successfully stopped", 200)
+    except Exception as err:
+        return resolved(_stop_error(name, err))
+    return wait_task(task, monitor, result_message(f"VM '{name}' has been successfully stopped", 200),
+                     partial(_stop_error, name), timeout)
 
-    except (vim.fault.NoCompatibleHost, vim.fault.InvalidHostState, OSError, socket.error):
+
+def _stop_error(name: str, err: Exception) -> dict:
+    """
+    Get the result message of a VM that couldn't be stopped
+    Args:
+        name (str): The name of the VM for logging
+        err (Exception): The error raised while creating the task, or the fault of the task
+    Returns:
+        dict: A dictionary formatted for json dump containing the result message. See result_message() function in dto.py
+    """
+    if isinstance(err, TimeoutError):
+        return result_message(f"VM '{name}' is still stopping", 408)
+    if isinstance(err, (vim.fault.NoCompatibleHost, vim.fault.InvalidHostState, OSError, socket.error)):
         return result_message("Host is unreachable", 404)
-    except vim.fault.TaskInProgress:
+    if isinstance(err, vim.fault.TaskInProgress):
         return result_message(f"VM '{name}' is busy", 403)
-    except (vim.fault.InvalidPowerState, vim.fault.VimFault):
+    if isinstance(err, (vim.fault.InvalidPowerState, vim.fault.VimFault)):
         return result_message(f"VM '{name}' can't be stopped", 403)
-    except Exception as err:
-        return result_message(str(err), 400)
+    return result_message(str(err), 400)
 
 
-def complete_vm_stop(moid: str, ip: str, user: str, password: str, port: int) -> dict:
+def complete_vm_stop(moid: str | list[str], ip: str, user: str, password: str, port: int, max_concurrency: int = BATCH_CONCURRENCY) -> dict:
     """
-    Stop a VM by creating a connection to the VCenter
+    Stop one or several VMs by creating a connection to the VCenter
     Args:
-        moid (str): The Managed Object ID of the VM to stop
+        moid (str | list[str]): The Managed Object ID of the VM to stop, or a list of them to stop several VMs at once
         ip (str): The ip of the VCenter to connect to
         user (str): The username of the VCenter to connect to
         password (str): The password of the VCenter to connect to
         port (int): The port to use to connect to the VCenter
+        max_concurrency (int): The maximum number of VMs handled at the same time, for a list of VMs
     Returns:
-        dict: A dictionary formatted for json dump containing the result message. See result_message() function in dto.py
+        dict: A dictionary formatted for json dump containing the result message, or the result message of each VM for a
+            list of VMs (see run_batch() in batch.py). See result_message() function in dto.py
     """
     conn = VMwareConnection()
     try:
         conn.connect(ip, user, password, port=port)
+        if isinstance(moid, list):
+            return run_batch(conn, moid, lambda vm_moid, monitor: vm_stop(conn.get_vm(vm_moid), vm_moid, monitor, TASK_TIMEOUT), max_concurrency)
         vm = conn.get_vm(moid)
 
         return vm_stop(vm, moid)
@@ -64,13 +100,19 @@ def complete_vm_stop(moid: str, ip: str, user: str, password: str, port: int) ->
 
 
 if __name__ == "__main__":
-    parser = ArgumentParser(description="Éteins une VM sur un serveur ESXi")
-    parser.add_argument("--moid", required=True, help="Le Managed Object ID de la VM")
+    parser = ArgumentParser(description="Éteins une ou plusieurs VM sur un serveur ESXi")
+    parser.add_argument("--moid", nargs="+", help="Le ou les Managed Object ID des VM")
+    parser.add_argument("--file", help="Fichier contenant un Managed Object ID de VM par ligne, - pour l'entrée standard")
     parser.add_argument("--ip", required=True, help="Adresse IP du vCenter")
     parser.add_argument("--user", required=True, help="Nom d'utilisateur du vCenter")
     parser.add_argument("--password", required=True, help="Mot de passe de l'utilisateur du vCenter")
     parser.add_argument("--port", type=int, default=443, help="Port du vCenter (optionnel, 443 par défaut)")
+    parser.add_argument("--max_concurrency", type=int, default=BATCH_CONCURRENCY, help=f"Nombre maximum de VM traitées en même temps (optionnel, {BATCH_CONCURRENCY} par défaut)")
 
     args = parser.parse_args()
+    if not args.moid and not args.file:
+        parser.error("--moid ou --file est requis")
 
-    output(complete_vm_stop(args.moid, args.ip, args.user, args.password, args.port))
+    moids = read_moids(args.moid, args.file)
+    moid = moids[0] if len(moids) == 1 and not args.file else moids
+    output(complete_vm_stop(moid, args.ip, args.user, args.password, args.port, args.max_concurrency))
@@ -1,6 +1,16 @@
 #!/bin/bash
 
-# Usage: ./vm_stop.sh --moid <MOID> --ip <IP> --user <USER> --password <PASS> [--port <PORT>]
+# Usage: ./vm_stop.sh (--moid <MOID> [<MOID> ...] | --file <FILE|->) --ip <IP> --user <USER> --password <PASS> [--port <PORT>] [--max_concurrency <N>]
+
+# The moids of --file are read locally, so the command is not sent to the command server
+if [ -n "$UPS_MANAGER_URL" ] && [[ " $* " != *" --file "* ]]; then
+    ./command_client.sh vm_stop "$@"
+    CODE=$?
+    # 7: command server unreachable, run the command locally instead
+    if [ "$CODE" -ne 7 ]; then
+        exit "$CODE"
+    fi
+fi
 
 if [ ! -f .venv/bin/activate ]; then
     echo "ERROR: Virtual environment not found at .venv/bin/activate"